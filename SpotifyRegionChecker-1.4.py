@@ -1,70 +1,25 @@
-from dotenv import load_dotenv
-load_dotenv()
+import time
+SCRIPT_STARTED = time.perf_counter()  # 本次脚本执行（冷启动或重跑）的计时起点
 
 import streamlit as st
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import re
-from collections import defaultdict
-import time
-import os
-import logging
-from logging.handlers import RotatingFileHandler
 import sys
-
-# ==== 日志系统设置 ==== #
-logger = logging.getLogger("SpotifyRegionChecker")
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-if not logger.hasHandlers():
-    file_handler = RotatingFileHandler('spotify_app.log', maxBytes=3*1024*1024, backupCount=3)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-logger.info("✅ 程序已启动，日志系统初始化成功")
-
-# ==== Spotify API 授权 ==== #
-SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
-SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
-if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
-    st.error("错误：缺少Spotify API凭证。请检查环境变量配置。")
-    logger.error("❌ 缺少Spotify API凭证，程序终止 [Type: Config]")
-    st.stop()
-client_credentials_manager = SpotifyClientCredentials(
-    client_id=SPOTIFY_CLIENT_ID,
-    client_secret=SPOTIFY_CLIENT_SECRET
+import threading
+from html import escape
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from region_core import (
+    logger, setup_logging, log_session, metrics, trace_request, start_metrics_exporter, has_credentials,
+    MARKET_TABLE, CONTINENT_MARKETS, market_name, continent_name, MARKET_CODES, has_market,
+    market_count, extract_album_id, get_cache_backend, single_flight, FlightAbandoned, get_market_index,
+    stream_album_data, get_album_data, track_market_gaps, normalize_query, search_albums, get_artist_albums,
+    get_artist_market_matrix, market_matrix_frame, get_watch_list, start_watch_refresher,
+    start_prewarm, run_cli
 )
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-
-# ==== 大洲国家定义 ==== #
-CONTINENT_COUNTRIES = {
-    "亚洲": [("CN", "中国"), ("TW", "台湾"), ("HK", "香港"),
-             ("JP", "日本"), ("SG", "新加坡"),
-             ("TH", "泰国"), ("VN", "越南"), ("ID", "印尼")],
-    "欧洲": [("GB", "英国"), ("FR", "法国"), ("DE", "德国"),
-             ("ES", "西班牙"), ("NL", "荷兰"), ("SE", "瑞典"),
-             ("BE", "比利时")],
-    "北美洲": [("US", "美国"), ("CA", "加拿大"), ("MX", "墨西哥")],
-    "南美洲": [("BR", "巴西"), ("AR", "阿根廷"), ("CL", "智利"),
-             ("CO", "哥伦比亚"), ("PE", "秘鲁")],
-    "大洋洲": [("AU", "澳大利亚"), ("NZ", "新西兰")],
-    "非洲": [("ZA", "南非"), ("EG", "埃及"), ("NG", "尼日利亚")]
-}
-CONTINENT_COUNTRIES_EN = {
-    "Asia": [("CN", "China"), ("TW", "Taiwan"), ("HK", "Hong Kong"),
-             ("JP", "Japan"), ("SG", "Singapore"),
-             ("TH", "Thailand"), ("VN", "Vietnam"), ("ID", "Indonesia")],
-    "Europe": [("GB", "United Kingdom"), ("FR", "France"), ("DE", "Germany"),
-               ("ES", "Spain"), ("NL", "Netherlands"), ("SE", "Sweden"),
-               ("BE", "Belgium")],
-    "North America": [("US", "United States"), ("CA", "Canada"), ("MX", "Mexico")],
-    "South America": [("BR", "Brazil"), ("AR", "Argentina"), ("CL", "Chile"),
-                      ("CO", "Colombia"), ("PE", "Peru")],
-    "Oceania": [("AU", "Australia"), ("NZ", "New Zealand")],
-    "Africa": [("ZA", "South Africa"), ("EG", "Egypt"), ("NG", "Nigeria")]
-}
+
+# ==== 进程级资源 ==== #
+def process_resource(factory):
+    # 核心模块里的对象本身跨重跑存活；本脚本每次交互都会重新执行，
+    # 这里定义的进程级对象（启动计时、后台导入）仍需经 st.cache_resource 复用
+    return st.cache_resource(show_spinner=False)(factory)
 
 # ==== 语言包 ==== #
 TRANSLATIONS = {
@@ -97,7 +52,9 @@ TRANSLATIONS = {
         "sort_order": "曲目顺序",
         "sort_popularity": "流行度",
         "region_dist_title": "🌍 可用地区分布（共{total}地区）",
-        "region_dist_caption": "以下仅显示代表性国家，灰色为未上架。",
+        "region_dist_caption": "地图覆盖全部 Spotify 地区，灰色为未上架；部分微型国家在地图上不可见，见下方列表。",
+        "region_available": "已上架",
+        "region_unavailable": "未上架",
         "no_markets": "⚠️ 此专辑的地区信息不可用，可能为新专辑或特殊版权。",
         "error_fetch": "❌ 获取专辑信息失败，请稍后重试或检查链接。",
         "artist": "艺术家",
@@ -109,7 +66,50 @@ TRANSLATIONS = {
         "artist_link": "艺术家链接",
         "search_no_result": "未找到相关专辑或艺人，请换个关键词试试。",
         "powered": "🚀 Powered by Spotify | 纯学习展示用途 | 设计美化：二千",
-        "language": "语言 / Language"
+        "language": "语言 / Language",
+        "artist_albums_count": "共 {total} 张专辑/单曲",
+        "page": "页码",
+        "market_matrix_title": "🗺️ 专辑 × 地区矩阵",
+        "build_matrix_btn": "生成地区矩阵",
+        "download_matrix": "⬇️ 导出 CSV",
+        "album": "专辑",
+        "market_count": "地区数",
+        "index_title": "🗂️ 已查询专辑地区检索",
+        "index_available_in": "以下地区均可用",
+        "index_unavailable_in": "以下地区均不可用",
+        "index_result": "{count} 张专辑匹配（索引共 {total} 张，用时 {ms:.1f} ms）",
+        "index_empty": "索引为空，查询过的专辑会自动加入。",
+        "watch_add": "🔔 监控地区变化",
+        "watch_remove": "🔕 取消监控",
+        "changes_title": "🔔 地区变更动态",
+        "changes_watched": "监控中 {count} 张专辑",
+        "changes_empty": "暂无地区变更记录。",
+        "changed_at": "时间",
+        "markets_added": "新增地区",
+        "markets_removed": "下架地区",
+        "trace_title": "⏱️ 本次加载追踪",
+        "trace_summary": "{calls} 次 API 调用（{rate_limited} 次限流，累计 {api_time:.2f}s），缓存命中 {hits} / 未命中 {misses}，总耗时 {elapsed:.2f}s",
+        "trace_kind": "类型",
+        "trace_name": "名称",
+        "trace_start": "开始 (ms)",
+        "trace_duration": "耗时 (ms)",
+        "trace_result": "结果",
+        "metrics_title": "📈 API 指标",
+        "metrics_empty": "暂无 API 调用记录。",
+        "metrics_endpoint": "接口",
+        "metrics_calls": "调用数",
+        "stale_badge": "⏳ 当前显示的是 {minutes} 分钟前缓存的数据（已过期），正在后台刷新。",
+        "track_gaps_toggle": "🎚️ 逐曲目地区差异",
+        "track_gaps_none": "所有曲目在专辑的全部地区均可用。",
+        "track_gaps_summary": "{tracks}/{checked} 首曲目在专辑可用的 {markets} 个地区中缺失（红色为缺失）。",
+        "track_gaps_unknown": "暂无曲目地区数据，请稍后重新加载专辑。",
+        "track_col_title": "曲目",
+        "track_col_duration": "时长",
+        "track_page_caption": "第 {start}–{end} 首，共 {total} 首",
+        "cache_stats_title": "🗄️ 缓存统计",
+        "cache_stats": "命中 {hits} / 未命中 {misses}（命中率 {ratio:.0%}）",
+        "cache_usage": "{entries} 条缓存，{size:.1f} MB（{backend}）",
+        "panel_toggle": "🔄 加载数据"
     },
     "en": {
         "title": "Spotify Album Region Checker",
@@ -140,7 +140,9 @@ TRANSLATIONS = {
         "sort_order": "Track Order",
         "sort_popularity": "Popularity",
         "region_dist_title": "🌍 Region Coverage ({total} regions)",
-        "region_dist_caption": "Only major countries shown below, gray means unavailable.",
+        "region_dist_caption": "The map covers every Spotify market, gray means unavailable; some microstates are too small to see, see the list below.",
+        "region_available": "Available",
+        "region_unavailable": "Unavailable",
         "no_markets": "⚠️ Region info unavailable, may be new or restricted album.",
         "error_fetch": "❌ Failed to fetch album info. Please retry or check link.",
         "artist": "Artist",
@@ -152,107 +154,469 @@ TRANSLATIONS = {
         "artist_link": "Artist Link",
         "search_no_result": "No matching albums/artists found. Try another keyword.",
         "powered": "🚀 Powered by Spotify | For demo only | UI: 二千",
-        "language": "语言 / Language"
+        "language": "语言 / Language",
+        "artist_albums_count": "{total} albums/singles in total",
+        "page": "Page",
+        "market_matrix_title": "🗺️ Album × Market Matrix",
+        "build_matrix_btn": "Build Market Matrix",
+        "download_matrix": "⬇️ Export CSV",
+        "album": "Album",
+        "market_count": "Markets",
+        "index_title": "🗂️ Search Checked Albums by Region",
+        "index_available_in": "Available in all of",
+        "index_unavailable_in": "Unavailable in all of",
+        "index_result": "{count} matching albums ({total} indexed, {ms:.1f} ms)",
+        "index_empty": "Index is empty. Albums you check are added automatically.",
+        "watch_add": "🔔 Watch Market Changes",
+        "watch_remove": "🔕 Stop Watching",
+        "changes_title": "🔔 Market Change Feed",
+        "changes_watched": "Watching {count} albums",
+        "changes_empty": "No market changes recorded yet.",
+        "changed_at": "Time",
+        "markets_added": "Added",
+        "markets_removed": "Removed",
+        "trace_title": "⏱️ Page Load Trace",
+        "trace_summary": "{calls} API calls ({rate_limited} rate limited, {api_time:.2f}s in total), cache {hits} hits / {misses} misses, {elapsed:.2f}s overall",
+        "trace_kind": "Kind",
+        "trace_name": "Name",
+        "trace_start": "Start (ms)",
+        "trace_duration": "Duration (ms)",
+        "trace_result": "Result",
+        "metrics_title": "📈 API Metrics",
+        "metrics_empty": "No API calls recorded yet.",
+        "metrics_endpoint": "Endpoint",
+        "metrics_calls": "Calls",
+        "stale_badge": "⏳ Showing expired data cached {minutes} min ago; refreshing in the background.",
+        "track_gaps_toggle": "🎚️ Per-track availability",
+        "track_gaps_none": "Every track is available in all of the album's markets.",
+        "track_gaps_summary": "{tracks}/{checked} tracks are missing in {markets} of the album's markets (red = missing).",
+        "track_gaps_unknown": "No per-track market data yet, please reload the album later.",
+        "track_col_title": "Track",
+        "track_col_duration": "Duration",
+        "track_page_caption": "Tracks {start}–{end} of {total}",
+        "cache_stats_title": "🗄️ Cache Stats",
+        "cache_stats": "Hits {hits} / Misses {misses} (hit ratio {ratio:.0%})",
+        "cache_usage": "{entries} entries, {size:.1f} MB ({backend})",
+        "panel_toggle": "🔄 Load data"
     }
 }
 
-def extract_album_id(url):
-    if not url or not isinstance(url, str):
-        return None
-    pattern = r"(?:spotify\.com/album/|:album:)([\w\d]+)"
-    match = re.search(pattern, url)
-    return match.group(1) if match else None
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_album_data(album_id):
-    if not album_id or not isinstance(album_id, str):
-        logger.warning("无效专辑ID [Type: Input]")
-        raise ValueError("无效的专辑ID")
-    retries = 2
-    for attempt in range(retries + 1):
-        try:
-            start_time = time.time()
-            album = sp.album(album_id)
-            elapsed = time.time() - start_time
-            logger.info(f"Fetched album {album_id} in {elapsed:.2f}s [Type: API]")
-            if not album.get('available_markets'):
-                tracks = sp.album_tracks(album_id, limit=1)
-                if tracks['items']:
-                    track = sp.track(tracks['items'][0]['id'])
-                    album['available_markets'] = track.get('available_markets', [])
-            tracks = sp.album_tracks(album_id)
-            album['tracks'] = tracks['items']
-            track_ids = [track['id'] for track in album['tracks'] if track['id']]
-            if track_ids:
-                track_details = sp.tracks(track_ids)
-                for i, track in enumerate(album['tracks']):
-                    if i < len(track_details['tracks']):
-                        track['popularity'] = track_details['tracks'][i].get('popularity', 0)
-                        track['preview_url'] = track_details['tracks'][i].get('preview_url', None)
-                        track['artists'] = track_details['tracks'][i].get('artists', [])
-            album['genres'] = []
-            album['artist_followers'] = 0
-            album['artist_url'] = ''
-            if album['artists']:
-                artist = sp.artist(album['artists'][0]['id'])
-                album['genres'] = artist.get('genres', [])
-                album['artist_followers'] = artist.get('followers', {}).get('total', 0)
-                album['artist_url'] = artist.get('external_urls', {}).get('spotify', '')
-            logger.info(f"Successfully fetched album data for ID: {album_id} [Type: API]")
-            return album
-        except spotipy.SpotifyException as e:
-            if hasattr(e, "http_status") and e.http_status == 429 and attempt < retries:
-                retry_after = int(getattr(e, "headers", {}).get('Retry-After', 2))
-                logger.warning(f"Rate limit hit for album {album_id}, retry after {retry_after}s [Type: API]")
-                time.sleep(retry_after)
-                continue
-            logger.error(f"Spotify API error for album {album_id}: {str(e)} [Type: API]", exc_info=True)
-            raise Exception("Spotify API错误")
-        except Exception as e:
-            logger.error(f"Failed to fetch album data for {album_id}: {str(e)} [Type: General]", exc_info=True)
-            raise Exception("获取专辑数据失败")
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def search_albums(query, limit=10):
-    if not query or not isinstance(query, str):
-        logger.warning("无效的搜索关键词 [Type: Input]")
-        return [], []
-    retries = 2
-    albums, artists = [], []
-    for attempt in range(retries + 1):
-        try:
-            album_results = sp.search(q=query, type='album', limit=limit)
-            artist_results = sp.search(q=query, type='artist', limit=limit)
-            albums = album_results['albums']['items']
-            artists = artist_results['artists']['items']
-            logger.info(f"Search successful for query: {query} [Type: API]")
-            return albums, artists
-        except spotipy.SpotifyException as e:
-            if hasattr(e, "http_status") and e.http_status == 429 and attempt < retries:
-                retry_after = int(getattr(e, "headers", {}).get('Retry-After', 2))
-                logger.warning(f"Rate limit hit for search {query}, retry after {retry_after}s [Type: API]")
-                time.sleep(retry_after)
-                continue
-            logger.error(f"Spotify API error for search {query}: {str(e)} [Type: API]", exc_info=True)
-            raise Exception("Spotify API错误")
-        except Exception as e:
-            logger.error(f"Search failed for {query}: {str(e)} [Type: General]", exc_info=True)
-            return [], []
-
-def get_artist_albums(artist_id):
-    albums = []
-    seen = set()
-    results = sp.artist_albums(artist_id=artist_id, album_type="album,single", limit=50)
-    for item in results['items']:
-        if item['id'] not in seen:
-            albums.append(item)
-            seen.add(item['id'])
-    return albums
+# ==== 启动计时 ==== #
+def create_startup_state():
+    return {"lock": threading.Lock(), "first_render": None}
+
+startup_state = process_resource(create_startup_state)()
+
+def record_script_run(setup_seconds):
+    # 冷启动 = 进程内第一次完整渲染；之后每次重跑单独计入
+    elapsed = time.perf_counter() - SCRIPT_STARTED
+    with startup_state["lock"]:
+        cold = startup_state["first_render"] is None
+        if cold:
+            startup_state["first_render"] = elapsed
+    run = "cold" if cold else "rerun"
+    metrics.observe("script_setup_seconds", setup_seconds, run=run)
+    metrics.observe("script_run_seconds", elapsed, run=run)
+    if cold:
+        logger.info(f"Cold start: module setup {setup_seconds:.2f}s, first render {elapsed:.2f}s [Type: Config]", extra={"latency": elapsed})
 
 # ========= Streamlit 主体 ========= #
 
+def render_album_header(album, T):
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if album.image_url:
+            st.image(album.image_url, width=180, use_container_width=True, output_format='PNG')
+        if album.spotify_url:
+            st.markdown(f"[Open in Spotify]({album.spotify_url})")
+    with col2:
+        st.markdown(
+            f"<h2 style='color:#232445;font-size:2.3rem;font-weight:700;margin-bottom:8px'>{album.name or '未知专辑'}</h2>",
+            unsafe_allow_html=True
+        )
+        st.markdown(f"👤 <b>{T['artist']}</b>：" + ", ".join(album.artist_names()), unsafe_allow_html=True)
+        st.write(f"📅 **{T['release_date']}**：{album.release_date or 'N/A'}")
+        st.write(f"💽 **{T['album_type']}**：{(album.album_type or 'N/A').capitalize()}")
+        st.write(f"⭐ **{T['popularity']}**：{album.popularity}/100")
+        if album.genres:
+            st.write(f"🎼 **{T['genres']}**：{', '.join(album.genres)}")
+        st.write(f"👥 **{T['followers']}**：{album.artist_followers:,}")
+        if album.artist_url:
+            st.write(f"🔗 **{T['artist_link']}**：[Spotify]({album.artist_url})")
+
+TRACK_PAGE_SIZE = 50  # 曲目表每页行数，排序与翻页只重绘这一页
+
+def format_duration(duration_ms):
+    return f"{duration_ms // 60000}:{(duration_ms % 60000) // 1000:02d}"
+
+def track_table_html(tracks, start, main_artist_names, T):
+    # 整页曲目拼成一个 HTML 表格，一次 st.markdown 输出，而不是每首曲目一个元素
+    rows = []
+    for idx, track in enumerate(tracks, start):
+        # 只有当track的艺人和专辑主艺人完全一致时不显示
+        if track.artists == main_artist_names:
+            artist_part = ""
+        else:
+            artist_part = f"<br><span class='track-artists'>{T['artist']}: {escape(', '.join(track.artists))}</span>"
+        rows.append(
+            f"<tr><td class='track-no'>{idx}</td><td><b>{escape(track.name)}</b>{artist_part}</td>"
+            f"<td class='track-num'>{format_duration(track.duration_ms)}</td>"
+            f"<td class='track-num'>{track.popularity}/100</td></tr>"
+        )
+    return (
+        f"<table class='track-table'><thead><tr><th>#</th><th>{T['track_col_title']}</th>"
+        f"<th>{T['track_col_duration']}</th><th>{T['popularity']}</th></tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table>"
+    )
+
+def render_track_list(album, T, sort_option, page=1):
+    sorted_tracks = album.tracks
+    if sort_option == T["sort_popularity"]:
+        sorted_tracks = sorted(
+            sorted_tracks,
+            key=lambda x: x.popularity,
+            reverse=True
+        )
+    start = (page - 1) * TRACK_PAGE_SIZE
+    page_tracks = sorted_tracks[start:start + TRACK_PAGE_SIZE]
+    main_artist_names = album.artist_names()
+    if len(sorted_tracks) > TRACK_PAGE_SIZE:
+        st.caption(T["track_page_caption"].format(start=start + 1, end=start + len(page_tracks), total=len(sorted_tracks)))
+    st.markdown(track_table_html(page_tracks, start + 1, main_artist_names, T), unsafe_allow_html=True)
+
+@st.fragment
+def track_list_fragment(album, T):
+    # 排序与翻页只重跑本片段，不重新读取缓存、不重建地区图
+    sort_option = st.selectbox(
+        T["sort_track"],
+        [T["sort_order"], T["sort_popularity"]],
+        key="sort_tracks"
+    )
+    total_pages = (len(album.tracks) + TRACK_PAGE_SIZE - 1) // TRACK_PAGE_SIZE
+    page = 1
+    if total_pages > 1:
+        page = st.number_input(T["page"], min_value=1, max_value=total_pages, value=1, step=1, key=f"track_page_{album.id}")
+    render_track_list(album, T, sort_option, page)
+
+REGION_FIGURE_CACHE_SIZE = 256  # 按 (地区位图, 语言) 缓存的地图数量
+
+@st.cache_resource(show_spinner=False, max_entries=REGION_FIGURE_CACHE_SIZE)
+def region_figure(market_bits, lang_code):
+    # 覆盖全部地区的世界地图；返回序列化后的图表字典，同一地区组合与语言在重跑和会话之间复用
+    T = TRANSLATIONS[lang_code]
+    import plotly.express as px
+    available, unavailable = T["region_available"], T["region_unavailable"]
+    fig = px.choropleth(
+        locations=[MARKET_TABLE[code][0] for code in MARKET_CODES],
+        locationmode="ISO-3",
+        color=[available if has_market(market_bits, code) else unavailable for code in MARKET_CODES],
+        hover_name=[f"{market_name(code, lang_code)} ({code})" for code in MARKET_CODES],
+        color_discrete_map={available: "#1DB954", unavailable: "#d5d8dc"},
+        category_orders={"color": [available, unavailable]},
+    )
+    fig.update_traces(hovertemplate="%{hovertext}<extra></extra>")
+    fig.update_geos(projection_type="natural earth", showframe=False, showcoastlines=False, showcountries=True, countrycolor="#ffffff")
+    fig.update_layout(
+        height=380,
+        margin=dict(l=0, r=0, t=0, b=0),
+        legend=dict(title=None, orientation="h", yanchor="bottom", y=0, xanchor="center", x=0.5)
+    )
+    return fig.to_dict()
+
+def continent_markets_html(continent, codes, market_bits, lang_code):
+    # 每个大洲的已上架地区拼成一个三列网格，一次 st.markdown 输出，而不是每个地区一个元素
+    countries = sorted((market_name(code, lang_code), code) for code in codes if has_market(market_bits, code))
+    if not countries:
+        return ""
+    cells = "".join(f"<div>✅ {escape(name)} ({code})</div>" for name, code in countries)
+    return (
+        f"<h4>{escape(continent_name(continent, lang_code))} ({len(countries)}/{len(codes)})</h4>"
+        f"<div class='market-grid'>{cells}</div>"
+    )
+
+def render_region_panel(market_bits, T, lang_code):
+    if not market_bits:
+        st.warning(T["no_markets"])
+        return
+    total_markets = market_count(market_bits)
+    st.subheader(T["region_dist_title"].format(total=total_markets))
+    st.caption(T["region_dist_caption"])
+    st.plotly_chart(region_figure(market_bits, lang_code), use_container_width=True)
+    for continent, codes in CONTINENT_MARKETS.items():
+        block = continent_markets_html(continent, codes, market_bits, lang_code)
+        if block:
+            st.markdown(block, unsafe_allow_html=True)
+
+def render_track_gaps(album, T):
+    # 曲目 × 地区热力图，只列出存在缺失的曲目与地区，大专辑也保持紧凑
+    if not st.toggle(T["track_gaps_toggle"], key="track_gaps"):
+        return
+    gaps = track_market_gaps(album)
+    if not gaps["checked"]:
+        st.info(T["track_gaps_unknown"])
+        return
+    if not gaps["tracks"]:
+        st.success(T["track_gaps_none"])
+        return
+    st.caption(T["track_gaps_summary"].format(
+        tracks=len(gaps["tracks"]), checked=gaps["checked"], markets=len(gaps["markets"])
+    ))
+    import plotly.express as px
+    fig = px.imshow(
+        gaps["missing"].astype(int),
+        x=gaps["markets"],
+        y=[f"{i}. {name}" for i, name in gaps["tracks"]],
+        color_continuous_scale=[[0, "#e6f4ea"], [1, "#d93025"]],
+        zmin=0, zmax=1, aspect="auto"
+    )
+    fig.update_layout(
+        coloraxis_showscale=False,
+        height=min(120 + 18 * len(gaps["tracks"]), 900),
+        margin=dict(l=0, r=0, t=10, b=0),
+        xaxis=dict(side="top", tickangle=0, title=None),
+        yaxis=dict(title=None)
+    )
+    fig.update_traces(hovertemplate="%{y}<br>%{x}<extra></extra>")
+    st.plotly_chart(fig, use_container_width=True)
+
+@st.fragment
+def region_fragment(album, T, lang_code):
+    # 逐曲目差异开关只重跑地区区块
+    render_region_panel(album.market_bits, T, lang_code)
+    render_track_gaps(album, T)
+
+@st.fragment
+def search_results_fragment(T):
+    # 搜索结果只随搜索本身变化；选中艺人或专辑时才重跑整页
+    albums, artists = st.session_state['search_albums'], st.session_state['search_artists']
+    cache_meta = st.session_state.get('search_cache_meta') or {}
+    if cache_meta.get("stale"):
+        st.warning(T["stale_badge"].format(minutes=int(cache_meta["age"] // 60)))
+    # 艺人
+    if artists:
+        st.markdown(f"#### {T['artist_section']}")
+        for artist in artists:
+            with st.container():
+                c1, c2, c3 = st.columns([1,2,1])
+                with c1:
+                    if artist.get("images"):
+                        st.image(artist["images"][0]["url"], width=72, use_container_width=False, output_format='PNG', caption="")
+                    else:
+                        st.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=64)
+                with c2:
+                    st.markdown(f"<span class='desc-strong'>{artist['name']}</span>", unsafe_allow_html=True)
+                    genres = ", ".join(artist['genres']) if artist.get('genres') else ""
+                    st.caption((f"{T['genres']}: {genres}  ") if genres else "")
+                    st.caption((f"{T['followers']}: {artist.get('followers',{}).get('total',0):,}"))
+                with c3:
+                    if st.button(T["view_albums"], key=f"artist_{artist['id']}"):
+                        st.session_state['artist_id'] = artist['id']
+                        st.session_state['album_id'] = None
+                        st.session_state['search_mode'] = "artist"
+                        st.rerun()
+    # 专辑
+    if albums:
+        st.markdown(f"#### {T['album_section']}")
+        for album in albums:
+            with st.container():
+                c1, c2, c3 = st.columns([1,2,1])
+                with c1:
+                    if album.get("images"):
+                        st.image(album["images"][0]["url"], width=72, use_container_width=False, output_format='PNG')
+                    else:
+                        st.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=64)
+                with c2:
+                    alb_name = album['name']
+                    artists_line = ", ".join(a['name'] for a in album['artists'])
+                    alb_year = album.get('release_date', '')[:4]
+                    st.markdown(f"<span class='desc-strong'>{alb_name}</span>", unsafe_allow_html=True)
+                    st.caption(f"{T['artist']}: {artists_line}  {T['release_date']}: {alb_year}")
+                with c3:
+                    if st.button(T["view_region"], key=f"alb_{album['id']}"):
+                        st.session_state['album_id'] = album['id']
+                        st.session_state['artist_id'] = album['artists'][0]['id'] if album['artists'] else None
+                        st.session_state['search_mode'] = "album"
+                        st.rerun()
+
+@st.fragment
+def artist_albums_fragment(artist_id, T):
+    # 翻页与生成地区矩阵只重跑本片段
+    st.subheader(T["artist_albums_title"])
+    try:
+        with trace_request("artist", artist_id):
+            albums, cache_meta = get_artist_albums.get_with_meta(artist_id)
+        if cache_meta["stale"]:
+            st.warning(T["stale_badge"].format(minutes=int(cache_meta["age"] // 60)))
+    except Exception as e:
+        albums = None
+        st.error(T["error_fetch"])
+        logger.error(f"Artist albums failed for {artist_id}: {str(e)} [Type: General]", exc_info=True, extra={"artist_id": artist_id})
+    if albums is not None and not albums:
+        st.info(T["no_artist_album"])
+    elif albums:
+        page_size = 12
+        total_pages = (len(albums) + page_size - 1) // page_size
+        st.caption(T["artist_albums_count"].format(total=len(albums)))
+        page = 1
+        if total_pages > 1:
+            page = st.number_input(T["page"], min_value=1, max_value=total_pages, value=1, step=1, key=f"artist_page_{artist_id}")
+        for album in albums[(page - 1) * page_size:page * page_size]:
+            c1, c2 = st.columns([1,5])
+            with c1:
+                if album.get('images'):
+                    st.image(album['images'][0]['url'], width=54, use_container_width=False, output_format='PNG')
+                else:
+                    st.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=48)
+            with c2:
+                btn = st.button(f"{album['name']} ({album['release_date'][:4]})", key=f"artist_album_{album['id']}")
+                if btn:
+                    st.session_state['album_id'] = album['id']
+                    st.session_state['search_mode'] = "album"
+                    st.rerun()
+
+        # 专辑 × 地区矩阵（按需生成，结果缓存）
+        st.markdown("---")
+        st.subheader(T["market_matrix_title"])
+        if st.button(T["build_matrix_btn"], key=f"build_matrix_{artist_id}"):
+            st.session_state['matrix_artist_id'] = artist_id
+        if st.session_state.get('matrix_artist_id') == artist_id:
+            try:
+                matrix, cache_meta = get_artist_market_matrix.get_with_meta(artist_id)
+                if cache_meta["stale"]:
+                    st.warning(T["stale_badge"].format(minutes=int(cache_meta["age"] // 60)))
+                frame = market_matrix_frame(matrix, T["album"], T["market_count"])
+                st.dataframe(frame, use_container_width=True)
+                st.download_button(
+                    T["download_matrix"],
+                    frame.to_csv().encode("utf-8-sig"),
+                    file_name=f"artist_{artist_id}_markets.csv",
+                    mime="text/csv"
+                )
+            except Exception as e:
+                st.error(T["error_fetch"])
+                logger.error(f"Market matrix failed for {artist_id}: {str(e)} [Type: General]", exc_info=True, extra={"artist_id": artist_id})
+
+# ==== 统计与检索面板 ==== #
+# 以下面板的查询走 SQLite 聚合；打开开关后才计算，结果按 PANEL_STATS_TTL 秒在会话间复用
+PANEL_STATS_TTL = 15
+
+@st.cache_resource(show_spinner=False, ttl=PANEL_STATS_TTL)
+def cache_stats_snapshot():
+    return get_cache_backend().stats()
+
+@st.cache_resource(show_spinner=False, ttl=PANEL_STATS_TTL, max_entries=64)
+def market_index_snapshot(available_in, unavailable_in):
+    market_index = get_market_index()
+    market_index.sync()
+    query_start = time.perf_counter()
+    matches = market_index.query(available_in, unavailable_in, limit=200)
+    total_matches = market_index.count(available_in, unavailable_in)
+    query_ms = (time.perf_counter() - query_start) * 1000
+    return {"matches": matches, "total_matches": total_matches, "indexed": len(market_index), "ms": query_ms}
+
+@st.cache_resource(show_spinner=False, ttl=PANEL_STATS_TTL)
+def watch_feed_snapshot():
+    watch_list = get_watch_list()
+    return {"watched": len(watch_list), "changes": watch_list.changes(limit=50)}
+
+@st.fragment
+def cache_stats_fragment(T):
+    if not st.toggle(T["panel_toggle"], key="show_cache_stats"):
+        return
+    cache_info = cache_stats_snapshot()
+    st.caption(T["cache_stats"].format(hits=cache_info["hits"], misses=cache_info["misses"], ratio=cache_info["hit_ratio"]))
+    st.caption(T["cache_usage"].format(entries=cache_info["entries"], size=cache_info["bytes"] / 1024 / 1024, backend=cache_info["backend"]))
+
+@st.fragment
+def market_index_fragment(T):
+    # 筛选条件变化只重跑本片段
+    if not st.toggle(T["panel_toggle"], key="show_market_index"):
+        return
+    if not market_index_snapshot((), ())["indexed"]:
+        st.caption(T["index_empty"])
+        return
+    c1, c2 = st.columns(2)
+    with c1:
+        available_in = st.multiselect(T["index_available_in"], MARKET_CODES, key="index_available_in")
+    with c2:
+        unavailable_in = st.multiselect(T["index_unavailable_in"], MARKET_CODES, key="index_unavailable_in")
+    result = market_index_snapshot(tuple(available_in), tuple(unavailable_in))
+    st.caption(T["index_result"].format(count=result["total_matches"], total=result["indexed"], ms=result["ms"]))
+    if result["matches"]:
+        st.dataframe(
+            [
+                {
+                    T["album"]: match["name"],
+                    T["artist"]: match["artists"],
+                    T["market_count"]: market_count(match["market_bits"]),
+                    "ID": match["id"],
+                }
+                for match in result["matches"]
+            ],
+            use_container_width=True,
+            hide_index=True
+        )
+
+@st.fragment
+def watch_feed_fragment(T):
+    if not st.toggle(T["panel_toggle"], key="show_watch_feed"):
+        return
+    feed = watch_feed_snapshot()
+    st.caption(T["changes_watched"].format(count=feed["watched"]))
+    if not feed["changes"]:
+        st.caption(T["changes_empty"])
+    else:
+        st.dataframe(
+            [
+                {
+                    T["changed_at"]: time.strftime("%Y-%m-%d %H:%M", time.localtime(change["changed_at"])),
+                    T["album"]: change["name"] or change["album_id"],
+                    T["markets_added"]: " ".join(change["added"]),
+                    T["markets_removed"]: " ".join(change["removed"]),
+                }
+                for change in feed["changes"]
+            ],
+            use_container_width=True,
+            hide_index=True
+        )
+
+def render_trace(trace, T):
+    # 本次页面加载的上游调用与缓存访问明细，按开始时间排列
+    summary = trace.summary()
+    with st.expander(T["trace_title"]):
+        st.caption(T["trace_summary"].format(
+            calls=summary["api_calls"], rate_limited=summary["rate_limited"], api_time=summary["api_time"],
+            hits=summary["cache_hits"], misses=summary["cache_misses"], elapsed=summary["elapsed"]
+        ))
+        if trace.spans:
+            st.dataframe(
+                [
+                    {
+                        T["trace_kind"]: span["kind"],
+                        T["trace_name"]: span["name"],
+                        T["trace_start"]: round(span["offset"] * 1000, 1),
+                        T["trace_duration"]: round(span["duration"] * 1000, 1),
+                        T["trace_result"]: span.get("outcome") or span.get("result", ""),
+                    }
+                    for span in sorted(trace.spans, key=lambda span: span["offset"])
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+
 def main():
+    setup_seconds = time.perf_counter() - SCRIPT_STARTED
     st.set_page_config(page_title="Spotify 专辑地区查询", page_icon="🎵", layout="centered")
+    setup_logging()
+    if not has_credentials():
+        st.error("错误：缺少Spotify API凭证。请检查环境变量配置。")
+        logger.error("❌ 缺少Spotify API凭证，程序终止 [Type: Config]")
+        st.stop()
+    ctx = get_script_run_ctx(suppress_warning=True)
+    log_session.set(ctx.session_id if ctx else None)
+    start_watch_refresher()
+    start_metrics_exporter()
+    start_prewarm()
     st.markdown("""
       <style>
 html, body, [class*="css"]  {
@@ -305,11 +669,35 @@ h1, h2, h3, h4, h5, h6 {
     color: #232445 !important;
     letter-spacing: 0.01em;
 }
-.track-list-row {
-    padding: 8px 0 8px 0;
-    border-bottom: 1px solid #f3f5fb;
+.track-table {
+    width: 100%;
+    border-collapse: collapse;
     font-size: 17.2px;
 }
+.track-table th {
+    text-align: left;
+    color: #889;
+    font-weight: 600;
+    border-bottom: 2px solid #e6e9f5;
+}
+.track-table td, .track-table th {
+    padding: 8px 6px;
+    border: none;
+    border-bottom: 1px solid #f3f5fb;
+    vertical-align: top;
+}
+.track-table .track-no, .track-table .track-num, .track-artists {
+    color: #889;
+}
+.track-table .track-num {
+    white-space: nowrap;
+}
+.market-grid {
+    display: grid;
+    grid-template-columns: repeat(3, 1fr);
+    gap: 4px 12px;
+    margin-bottom: 12px;
+}
 .stCaption, .stMarkdown, .stSubheader {
     color: #395acf !important;
     font-weight:600;
@@ -335,7 +723,26 @@ h1, h2, h3, h4, h5, h6 {
     lang_code = 'zh' if lang=="中文" else 'en'
     st.session_state['lang'] = lang_code
     T = TRANSLATIONS[lang_code]
-    CONTINENT = CONTINENT_COUNTRIES if lang_code=='zh' else CONTINENT_COUNTRIES_EN
+    with st.sidebar.expander(T["cache_stats_title"]):
+        cache_stats_fragment(T)
+    with st.sidebar.expander(T["metrics_title"]):
+        endpoints = metrics.histogram_summary("spotify_api_request_duration_seconds")
+        if not endpoints:
+            st.caption(T["metrics_empty"])
+        else:
+            st.dataframe(
+                [
+                    {
+                        T["metrics_endpoint"]: item["labels"]["endpoint"] + ("" if item["labels"]["outcome"] == "ok" else f" ({item['labels']['outcome']})"),
+                        T["metrics_calls"]: item["count"],
+                        "p50": f"≤{item['p50'] * 1000:.0f} ms",
+                        "p99": f"≤{item['p99'] * 1000:.0f} ms",
+                    }
+                    for item in endpoints
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
 
     # ========= 顶部标题与说明 ========= #
     st.title(f"🎵 {T['title']}")
@@ -355,17 +762,23 @@ h1, h2, h3, h4, h5, h6 {
         st.session_state['artist_id'] = None
         st.session_state['album_id'] = None
 
+    def run_search():
+        st.session_state['artist_id'] = None
+        st.session_state['album_id'] = None
+        query = st.session_state.get('search_input', '')
+        with trace_request("search", normalize_query(query)):
+            (albums, artists), cache_meta = search_albums.get_with_meta(query, limit=10)
+        st.session_state['search_albums'] = albums
+        st.session_state['search_artists'] = artists
+        st.session_state['search_cache_meta'] = cache_meta
+        st.session_state['search_mode'] = "search"
+
     if tab == T["search_tab"]:
-        search_val = st.text_input(f"{T['search_placeholder']}：", value="", key="search_input")
+        # 输入变化即触发搜索；前缀缓存让连续输入大多在本地完成
+        st.text_input(f"{T['search_placeholder']}：", value="", key="search_input", on_change=run_search)
         col1, col2 = st.columns([1,3])
         with col1:
-            if st.button(T["search_btn"]):
-                st.session_state['artist_id'] = None
-                st.session_state['album_id'] = None
-                albums, artists = search_albums(search_val.strip(), limit=10)
-                st.session_state['search_albums'] = albums
-                st.session_state['search_artists'] = artists
-                st.session_state['search_mode'] = "search"
+            st.button(T["search_btn"], on_click=run_search)
         with col2:
             st.button("🔄 清空", on_click=clear_artist_album)
     else:
@@ -383,74 +796,13 @@ h1, h2, h3, h4, h5, h6 {
 
     # ========= 搜索结果展示 ========= #
     if st.session_state.get('search_mode') == "search" and (st.session_state.get('search_albums') or st.session_state.get('search_artists')):
-        albums, artists = st.session_state['search_albums'], st.session_state['search_artists']
-        # 艺人
-        if artists:
-            st.markdown(f"#### {T['artist_section']}")
-            for artist in artists:
-                with st.container():
-                    c1, c2, c3 = st.columns([1,2,1])
-                    with c1:
-                        if artist.get("images"):
-                            st.image(artist["images"][0]["url"], width=72, use_container_width=False, output_format='PNG', caption="")
-                        else:
-                            st.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=64)
-                    with c2:
-                        st.markdown(f"<span class='desc-strong'>{artist['name']}</span>", unsafe_allow_html=True)
-                        genres = ", ".join(artist['genres']) if artist.get('genres') else ""
-                        st.caption((f"{T['genres']}: {genres}  ") if genres else "")
-                        st.caption((f"{T['followers']}: {artist.get('followers',{}).get('total',0):,}"))
-                    with c3:
-                        if st.button(T["view_albums"], key=f"artist_{artist['id']}"):
-                            st.session_state['artist_id'] = artist['id']
-                            st.session_state['album_id'] = None
-                            st.session_state['search_mode'] = "artist"
-                            st.rerun()
-        # 专辑
-        if albums:
-            st.markdown(f"#### {T['album_section']}")
-            for album in albums:
-                with st.container():
-                    c1, c2, c3 = st.columns([1,2,1])
-                    with c1:
-                        if album.get("images"):
-                            st.image(album["images"][0]["url"], width=72, use_container_width=False, output_format='PNG')
-                        else:
-                            st.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=64)
-                    with c2:
-                        alb_name = album['name']
-                        artists_line = ", ".join(a['name'] for a in album['artists'])
-                        alb_year = album.get('release_date', '')[:4]
-                        st.markdown(f"<span class='desc-strong'>{alb_name}</span>", unsafe_allow_html=True)
-                        st.caption(f"{T['artist']}: {artists_line}  {T['release_date']}: {alb_year}")
-                    with c3:
-                        if st.button(T["view_region"], key=f"alb_{album['id']}"):
-                            st.session_state['album_id'] = album['id']
-                            st.session_state['artist_id'] = album['artists'][0]['id'] if album['artists'] else None
-                            st.session_state['search_mode'] = "album"
-                            st.rerun()
+        search_results_fragment(T)
 
     # ========= 艺人专辑列表 ========= #
     if st.session_state.get('search_mode') == "artist" and st.session_state.get('artist_id') and not st.session_state.get('album_id'):
+        artist_id = st.session_state['artist_id']
         st.markdown('<div class="main-block">', unsafe_allow_html=True)
-        albums = get_artist_albums(st.session_state['artist_id'])
-        st.subheader(T["artist_albums_title"])
-        if not albums:
-            st.info(T["no_artist_album"])
-        else:
-            for album in albums[:12]:
-                c1, c2 = st.columns([1,5])
-                with c1:
-                    if album.get('images'):
-                        st.image(album['images'][0]['url'], width=54, use_container_width=False, output_format='PNG')
-                    else:
-                        st.image("https://cdn-icons-png.flaticon.com/512/727/727245.png", width=48)
-                with c2:
-                    btn = st.button(f"{album['name']} ({album['release_date'][:4]})", key=f"artist_album_{album['id']}")
-                    if btn:
-                        st.session_state['album_id'] = album['id']
-                        st.session_state['search_mode'] = "album"
-                        st.rerun()
+        artist_albums_fragment(artist_id, T)
         st.markdown('</div>', unsafe_allow_html=True)
 
     # ========= 专辑详情/地区分布 ========= #
@@ -459,123 +811,110 @@ h1, h2, h3, h4, h5, h6 {
         st.markdown('<div class="main-block">', unsafe_allow_html=True)
         progress = st.progress(0)
         placeholder = st.empty()
-        placeholder.text(T["loading_album"])
-        try:
-            start_time = time.time()
-            progress.progress(25)
-            album = get_album_data(album_id)
-            st.session_state['artist_id'] = album['artists'][0]['id'] if album.get('artists') else None
-            placeholder.text(T["loading_track"])
-            progress.progress(65)
-            load_time = time.time() - start_time
-            placeholder.empty()
-            progress.progress(100)
-            st.caption(T["loading_time"].format(time=load_time))
-
-            col1, col2 = st.columns([1, 3])
-            with col1:
-                if album.get('images'):
-                    st.image(album['images'][0]['url'], width=180, use_container_width=True, output_format='PNG')
-                if album.get('external_urls', {}).get('spotify'):
-                    st.markdown(f"[Open in Spotify]({album['external_urls']['spotify']})")
-            with col2:
-                st.markdown(
-                    f"<h2 style='color:#232445;font-size:2.3rem;font-weight:700;margin-bottom:8px'>{album.get('name', '未知专辑')}</h2>",
-                    unsafe_allow_html=True
-                )
-                st.markdown(f"👤 <b>{T['artist']}</b>：" + ", ".join(artist['name'] for artist in album.get('artists', [])), unsafe_allow_html=True)
-                st.write(f"📅 **{T['release_date']}**：{album.get('release_date', 'N/A')}")
-                st.write(f"💽 **{T['album_type']}**：{album.get('album_type', 'N/A').capitalize()}")
-                st.write(f"⭐ **{T['popularity']}**：{album.get('popularity', 0)}/100")
-                if album.get('genres'):
-                    st.write(f"🎼 **{T['genres']}**：{', '.join(album['genres'])}")
-                st.write(f"👥 **{T['followers']}**：{album.get('artist_followers', 0):,}")
-                if album.get('artist_url'):
-                    st.write(f"🔗 **{T['artist_link']}**：[Spotify]({album['artist_url']})")
-            st.markdown("---")
-            st.subheader(T["track_list_title"])
-            sort_option = st.selectbox(
-                T["sort_track"],
-                [T["sort_order"], T["sort_popularity"]],
-                key="sort_tracks"
-            )
-            sorted_tracks = album.get('tracks', [])
-            if sort_option == T["sort_popularity"]:
-                sorted_tracks = sorted(
-                    sorted_tracks,
-                    key=lambda x: x.get('popularity', 0),
-                    reverse=True
-                )
-
-            main_artist_names = [artist['name'] for artist in album.get('artists', [])]
-
-            for idx, track in enumerate(sorted_tracks, 1):
-                duration_ms = track.get('duration_ms', 0)
-                minutes = duration_ms // 60000
-                seconds = (duration_ms % 60000) // 1000
-                duration = f"{minutes}:{seconds:02d}"
-                track_artist_names = [a['name'] for a in track.get('artists', [])]
-
-                # 只有当track的艺人和专辑主艺人完全一致时不显示
-                if track_artist_names == main_artist_names:
-                    artist_part = ""
+        # 各区块预先占位，数据到达后就地填充
+        stale_slot = st.empty()
+        header_slot = st.empty()
+        watch_slot = st.empty()
+        tracks_head = st.container()
+        tracks_slot = st.empty()
+        region_slot = st.empty()
+        tracks_started = False
+        with trace_request("album", album_id) as trace:
+            flight, leader = None, False
+            try:
+                start_time = time.time()
+                hit, album, cache_meta = get_album_data.lookup(album_id)
+                if cache_meta["stale"]:
+                    stale_slot.warning(T["stale_badge"].format(minutes=int(cache_meta["age"] // 60)))
+                if not hit:
+                    flight, leader = get_album_data.join(album_id)
+                    while not leader:
+                        # 其他会话正在抓取同一专辑，等待其结果而不重复请求
+                        placeholder.text(T["loading_album"])
+                        try:
+                            album = flight.result()
+                            hit = True
+                            break
+                        except FlightAbandoned:
+                            # 对方的抓取被重跑打断，重新加入；可能由本会话接手抓取
+                            flight, leader = get_album_data.join(album_id)
+                if hit:
+                    # 缓存命中时按相同阶段一次性渲染
+                    stages = [("album", album, 1.0), ("tracks", album.tracks, 1.0), ("markets", album.market_bits, 1.0)]
                 else:
-                    artist_part = f"<br>{T['artist']}: {', '.join(track_artist_names)}"
-                
-                st.markdown(
-                    f"<div class='track-list-row'>{idx}. <b>{track.get('name', 'Unknown Track')}</b> "
-                    f"<span style='color:#889;'>({duration})</span> - {T['popularity']}: {track.get('popularity', 0)}/100{artist_part}</div>",
-                    unsafe_allow_html=True
-                )
-            st.markdown("---")
-            markets = album.get('available_markets', [])
-            if markets:
-                total_markets = len(markets)
-                st.subheader(T["region_dist_title"].format(total=total_markets))
-                st.caption(T["region_dist_caption"])
-                continent_data = defaultdict(list)
-                for continent, countries in CONTINENT.items():
-                    for code, name in countries:
-                        if code in markets:
-                            continent_data[continent].append((name, code))
-                stats = {continent: len(countries) for continent, countries in continent_data.items()}
-                import plotly.express as px
-                fig = px.bar(
-                    x=list(stats.keys()),
-                    y=list(stats.values()),
-                    labels={'x': 'Continent', 'y': 'Country/Region Count'} if lang_code=='en' else {'x': '大洲', 'y': '国家/地区数量'},
-                    color=list(stats.keys()),
-                    color_discrete_sequence=px.colors.sequential.Blues
-                )
-                fig.update_layout(
-                    xaxis_title="Continent" if lang_code=='en' else "大洲",
-                    yaxis_title="Country/Region Count" if lang_code=='en' else "国家/地区数量",
-                    showlegend=False
-                )
-                st.plotly_chart(fig, use_container_width=True)
-                num_cols = 3
-                for continent, countries in continent_data.items():
-                    countries.sort(key=lambda x: x[0])
-                    st.markdown(f"#### {continent}")
-                    cols = st.columns(num_cols)
-                    for i, (name, code) in enumerate(countries):
-                        cols[i % num_cols].write(f"✅ {name} ({code})")
-            else:
-                st.warning(T["no_markets"])
-        except Exception as e:
-            placeholder.empty()
-            progress.progress(100)
-            st.error(T["error_fetch"])
-            logger.error(f"Fetch failed: {str(e)} [Type: General]", exc_info=True)
-            if "429" in str(e):
-                st.warning("API请求超限，需等待 3 秒，建议稍后重试。")
+                    placeholder.text(T["loading_album"])
+                    stages = stream_album_data(album_id)
+                for stage, payload, fraction in stages:
+                    progress.progress(fraction)
+                    if stage in ("album", "artist"):
+                        album = payload
+                        st.session_state['artist_id'] = album.artists[0][0] if album.artists else None
+                        with header_slot.container():
+                            render_album_header(album, T)
+                        if stage == "album":
+                            placeholder.text(T["loading_track"])
+                    if stage == "tracks":
+                        if not tracks_started:
+                            tracks_started = True
+                            with tracks_head:
+                                st.markdown("---")
+                                st.subheader(T["track_list_title"])
+                        if not hit:
+                            # 抓取中只预览已到达的首页曲目，全部到达后换成可排序翻页的片段
+                            with tracks_slot.container():
+                                render_track_list(album, T, T["sort_order"])
+                    if stage == "markets":
+                        with tracks_slot.container():
+                            track_list_fragment(album, T)
+                        with region_slot.container():
+                            st.markdown("---")
+                            region_fragment(album, T, lang_code)
+                    if stage == "done":
+                        get_album_data.store(payload, album_id)
+                        single_flight.finish(flight, value=payload)
+                placeholder.caption(T["loading_time"].format(time=time.time() - start_time))
+                watch_list = get_watch_list()
+                if album_id in watch_list:
+                    if watch_slot.button(T["watch_remove"], key=f"unwatch_{album_id}"):
+                        watch_list.remove(album_id)
+                        watch_feed_snapshot.clear()
+                        st.rerun()
+                elif watch_slot.button(T["watch_add"], key=f"watch_{album_id}"):
+                    watch_list.add(album_id, album.name, album.market_bits)
+                    watch_feed_snapshot.clear()
+                    st.rerun()
+            except Exception as e:
+                if leader:
+                    single_flight.finish(flight, error=e)
+                placeholder.empty()
+                progress.progress(100)
+                st.error(T["error_fetch"])
+                logger.error(f"Fetch failed: {str(e)} [Type: General]", exc_info=True, extra={"album_id": album_id})
+                if "429" in str(e):
+                    st.warning("API请求超限，需等待 3 秒，建议稍后重试。")
+            finally:
+                if leader:
+                    # 抓取被重跑打断时释放等待方，由它们重新发起，而不是把中断当作失败交给它们
+                    single_flight.abandon(flight)
+        render_trace(trace, T)
         st.markdown('</div>', unsafe_allow_html=True)
 
+    # ========= 地区倒排索引查询 ========= #
+    with st.expander(T["index_title"]):
+        market_index_fragment(T)
+
+    # ========= 地区变更动态 ========= #
+    with st.expander(T["changes_title"]):
+        watch_feed_fragment(T)
+
     # 使用说明（始终底部浮动）
     with st.expander(T["usage_title"]):
         st.markdown(T["usage_content"])
 
     st.caption(T["powered"])
+    record_script_run(setup_seconds)
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ("batch", "watch"):
+        sys.exit(run_cli(sys.argv[1:]))
     main()
@@ -0,0 +1,296 @@
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# ==== 本地 Spotify API 替身 ==== #
+# 只实现应用用到的端点，响应体由录制的样例（fixtures）按 ID 派生，结果可复现；
+# 支持固定延迟、周期性 429 注入和超大专辑，供基准测试离线运行
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "spotify_responses.json")
+LARGE_ALBUM_PREFIX = "LARGE"  # 以此开头的专辑 ID 返回 large_album_tracks 首曲目
+TRACK_SUFFIX_DIGITS = 5       # 曲目 ID = 专辑 ID + 定长序号，便于由曲目反查专辑
+MAX_ALBUM_IDS = 20
+MAX_TRACK_IDS = 50
+
+ROUTES = [
+    ("album_tracks", re.compile(r"^albums/(?P<id>[A-Za-z0-9]+)/tracks/?$")),
+    ("album", re.compile(r"^albums/(?P<id>[A-Za-z0-9]+)/?$")),
+    ("albums", re.compile(r"^albums/?$")),
+    ("tracks", re.compile(r"^tracks/?$")),
+    ("artist_albums", re.compile(r"^artists/(?P<id>[A-Za-z0-9]+)/albums/?$")),
+    ("artist", re.compile(r"^artists/(?P<id>[A-Za-z0-9]+)/?$")),
+    ("search", re.compile(r"^search/?$")),
+]
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+def load_fixtures(path=FIXTURES_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+class FakeSpotify:
+    # 响应生成与调用计数，与 HTTP 层分离，便于直接复用
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, rate_limit_every=0, retry_after=0,
+                 album_tracks=13, large_album_tracks=1000, artist_album_count=130, search_total=1000):
+        self.fixtures = fixtures or load_fixtures()
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.album_tracks = album_tracks
+        self.large_album_tracks = large_album_tracks
+        self.artist_album_count = artist_album_count
+        self.search_total = search_total
+        self.markets = self.fixtures["album"]["available_markets"]
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = 0
+            self._calls = defaultdict(int)
+            self._rate_limited = 0
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self._requests, "rate_limited": self._rate_limited, "calls": dict(self._calls)}
+
+    # ---- 调度 ---- #
+    def handle(self, path, query):
+        endpoint, match = None, None
+        for name, pattern in ROUTES:
+            match = pattern.match(path)
+            if match:
+                endpoint = name
+                break
+        if not endpoint:
+            raise ApiError(404, f"Unknown endpoint: {path}")
+        with self._lock:
+            self._requests += 1
+            self._calls[endpoint] += 1
+            limited = self.rate_limit_every and self._requests % self.rate_limit_every == 0
+            if limited:
+                self._rate_limited += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if limited:
+            raise ApiError(429, "API rate limit exceeded", {"Retry-After": str(self.retry_after)})
+        params = {k: v[-1] for k, v in query.items()}
+        return getattr(self, f"_{endpoint}")(params, **match.groupdict())
+
+    # ---- 数据派生 ---- #
+    # 样例只做浅拷贝：嵌套字段要么整体替换，要么只读并立即序列化
+    def _rng(self, seed):
+        return random.Random(seed)
+
+    @functools.lru_cache(maxsize=4096)
+    def _album_markets(self, album_id):
+        # 每张专辑随机缺少若干地区，使地区位图与倒排索引有实际区分度
+        rng = self._rng(album_id)
+        missing = set(rng.sample(self.markets, rng.randint(0, 30)))
+        return tuple(m for m in self.markets if m not in missing)
+
+    def _track_total(self, album_id):
+        return self.large_album_tracks if album_id.startswith(LARGE_ALBUM_PREFIX) else self.album_tracks
+
+    def _artist_id(self, album_id):
+        return "BenchArtist" + album_id[-11:]
+
+    def _artist_ref(self, artist_id):
+        ref = dict(self.fixtures["artist"])
+        for key in ("followers", "genres", "images", "popularity"):
+            ref.pop(key, None)
+        ref.update(
+            id=artist_id, name=f"Artist {artist_id[-6:]}",
+            href=f"https://api.spotify.com/v1/artists/{artist_id}", uri=f"spotify:artist:{artist_id}",
+            external_urls={"spotify": f"https://open.spotify.com/artist/{artist_id}"},
+        )
+        return ref
+
+    def _simple_album(self, album_id, artist_id=None):
+        album = dict(self.fixtures["simple_album"])
+        album.update(
+            id=album_id, name=f"Album {album_id[-8:]}", total_tracks=self._track_total(album_id),
+            artists=[self._artist_ref(artist_id or self._artist_id(album_id))],
+            available_markets=list(self._album_markets(album_id)),
+            href=f"https://api.spotify.com/v1/albums/{album_id}", uri=f"spotify:album:{album_id}",
+            external_urls={"spotify": f"https://open.spotify.com/album/{album_id}"},
+        )
+        return album
+
+    def _simple_track(self, album_id, i):
+        track_id = f"{album_id}{i:0{TRACK_SUFFIX_DIGITS}d}"
+        track = dict(self.fixtures["simple_track"])
+        track.update(
+            id=track_id, name=f"Track {i + 1}", track_number=i + 1, duration_ms=150000 + (i * 7919) % 120000,
+            artists=[self._artist_ref(self._artist_id(album_id))],
+            available_markets=self._track_markets(album_id, i),
+            href=f"https://api.spotify.com/v1/tracks/{track_id}", uri=f"spotify:track:{track_id}",
+            external_urls={"spotify": f"https://open.spotify.com/track/{track_id}"},
+        )
+        return track
+
+    def _track_markets(self, album_id, i):
+        markets = self._album_markets(album_id)
+        # 少数曲目另缺几个地区，模拟单曲授权差异
+        if i % 7 == 3:
+            rng = self._rng(f"{album_id}:{i}")
+            missing = set(rng.sample(markets, min(len(markets), 5)))
+            markets = [m for m in markets if m not in missing]
+        return list(markets)
+
+    def _paging(self, href, items, total, limit, offset):
+        next_offset = offset + limit
+        return {
+            "href": f"{href}?offset={offset}&limit={limit}",
+            "items": items,
+            "limit": limit,
+            "next": f"{href}?offset={next_offset}&limit={limit}" if next_offset < total else None,
+            "offset": offset,
+            "previous": f"{href}?offset={max(0, offset - limit)}&limit={limit}" if offset else None,
+            "total": total,
+        }
+
+    def _track_page(self, album_id, limit, offset):
+        total = self._track_total(album_id)
+        items = [self._simple_track(album_id, i) for i in range(offset, min(offset + limit, total))]
+        return self._paging(f"https://api.spotify.com/v1/albums/{album_id}/tracks", items, total, limit, offset)
+
+    def _full_album(self, album_id):
+        album = dict(self.fixtures["album"])
+        album.update(self._simple_album(album_id))
+        album.pop("album_group", None)
+        album["tracks"] = self._track_page(album_id, 50, 0)
+        return album
+
+    # ---- 端点 ---- #
+    def _album(self, params, id):
+        return self._full_album(id)
+
+    def _albums(self, params):
+        ids = [i for i in params.get("ids", "").split(",") if i]
+        if len(ids) > MAX_ALBUM_IDS:
+            raise ApiError(400, "Too many ids requested")
+        return {"albums": [self._full_album(album_id) for album_id in ids]}
+
+    def _album_tracks(self, params, id):
+        return self._track_page(id, min(int(params.get("limit", 20)), 50), int(params.get("offset", 0)))
+
+    def _tracks(self, params):
+        ids = [i for i in params.get("ids", "").split(",") if i]
+        if len(ids) > MAX_TRACK_IDS:
+            raise ApiError(400, "Too many ids requested")
+        tracks = []
+        for track_id in ids:
+            album_id, i = track_id[:-TRACK_SUFFIX_DIGITS], int(track_id[-TRACK_SUFFIX_DIGITS:])
+            track = dict(self.fixtures["track"])
+            track.update(self._simple_track(album_id, i))
+            track["album"] = self._simple_album(album_id)
+            track["album"].pop("album_group", None)
+            track["popularity"] = self._rng(track_id).randint(0, 100)
+            tracks.append(track)
+        return {"tracks": tracks}
+
+    def _artist(self, params, id):
+        artist = dict(self.fixtures["artist"])
+        artist.update(self._artist_ref(id))
+        artist["followers"] = {"href": None, "total": self._rng(id).randint(1000, 10 ** 8)}
+        return artist
+
+    def _artist_albums(self, params, id):
+        limit, offset = min(int(params.get("limit", 20)), 50), int(params.get("offset", 0))
+        total = self.artist_album_count
+        items = [
+            self._simple_album(f"{id[-14:]}Disc{i:04d}", id)
+            for i in range(offset, min(offset + limit, total))
+        ]
+        return self._paging(f"https://api.spotify.com/v1/artists/{id}/albums", items, total, limit, offset)
+
+    def _search(self, params):
+        limit, offset = min(int(params.get("limit", 10)), 50), int(params.get("offset", 0))
+        seed = re.sub(r"[^A-Za-z0-9]", "", params.get("q", "")).ljust(8, "0")[:8]
+        types = params.get("type", "album").split(",")
+        href = "https://api.spotify.com/v1/search"
+        results = {}
+        if "album" in types:
+            items = [self._simple_album(f"Search{seed}{i:08d}") for i in range(offset, offset + limit)]
+            results["albums"] = self._paging(href, items, self.search_total, limit, offset)
+        if "artist" in types:
+            items = [self._artist(params, f"Search{seed}Art{i:05d}") for i in range(offset, offset + limit)]
+            results["artists"] = self._paging(href, items, self.search_total, limit, offset)
+        return results
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持长连接，与真实 API 一样复用连接池
+    disable_nagle_algorithm = True  # 响应头与正文分两次写出，避免 Nagle + 延迟确认带来的约 40ms 额外等待
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path
+        if not path.startswith("/v1/"):
+            return self._send(404, {"error": {"status": 404, "message": "Not found"}})
+        try:
+            body = self.server.api.handle(path[len("/v1/"):], parse_qs(parts.query))
+            self._send(200, body)
+        except ApiError as e:
+            self._send(e.status, {"error": {"status": e.status, "message": e.message}}, e.headers)
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), FakeSpotifyHandler)
+        self.api = api or FakeSpotify()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-spotify", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="本地 Spotify API 替身 / Local fake Spotify API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="每 N 个请求返回一次 429，0 表示关闭")
+    args = parser.parse_args()
+    server = FakeSpotifyServer(FakeSpotify(latency=args.latency, rate_limit_every=args.rate_limit_every), port=args.port)
+    print(f"Fake Spotify API listening on {server.url}/v1/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,220 @@
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from fake_spotify import FakeSpotify, FakeSpotifyServer, LARGE_ALBUM_PREFIX
+
+# ==== 离线基准测试 ==== #
+# 启动本地 Spotify 替身，把核心模块的 spotipy 客户端指向它，逐个入口测量
+# 延迟分位数、每次操作的上游调用数与缓存命中率；可与基线 JSON 对比，发现回归时退出码为 1
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "region_core.py")
+LATENCY_SLACK_MS = 5.0  # 延迟对比的绝对容差，避免亚毫秒级的缓存命中路径因抖动误报
+
+def load_app(path, workdir, rate_limit_every):
+    # 必须在导入前设置环境：缓存/索引写到临时目录、关闭后台刷新、限速放开、使用假凭证
+    os.environ.update({
+        "SPOTIFY_CLIENT_ID": "bench-client",
+        "SPOTIFY_CLIENT_SECRET": "bench-secret",
+        "CACHE_BACKEND": "sqlite",
+        "CACHE_DB_PATH": os.path.join(workdir, "bench_cache.sqlite3"),
+        "WATCH_REFRESH_INTERVAL": "0",
+        "API_RATE_PER_SEC": "100000",
+        "API_BURST": "100000",
+    })
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("spotify_region_checker_bench", path)
+    app = importlib.util.module_from_spec(spec)
+    # 缓存中的专辑记录按模块名反序列化，必须先注册到 sys.modules
+    sys.modules[spec.name] = app
+    # 导入不安装日志处理器，警告经 logging 默认处理写到 stderr，stdout 只留给结果
+    spec.loader.exec_module(app)
+    logging.getLogger("SpotifyRegionChecker").setLevel(logging.ERROR if rate_limit_every else logging.WARNING)
+    logging.getLogger("spotipy").setLevel(logging.CRITICAL)  # 注入的 429 属预期，不逐条打印
+    return app
+
+def point_app_at(app, url):
+    import spotipy
+    app.sp = spotipy.Spotify(auth="bench-token", requests_session=app.build_http_session())
+    app.sp.prefix = url + "/v1/"
+
+def percentile(values, pct):
+    # 最近秩法
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def cache_costs(app, namespace):
+    # (写入条数, 写入字节, 反序列化次数, 反序列化总耗时)，取自核心模块的缓存指标
+    snapshot = app.metrics.snapshot()
+    counters = {
+        c["name"]: c["value"] for c in snapshot["counters"]
+        if c["labels"].get("namespace") == namespace and c["name"] in ("cache_writes_total", "cache_written_bytes_total")
+    }
+    decode = next(
+        (h for h in snapshot["histograms"] if h["name"] == "cache_decode_seconds" and h["labels"].get("namespace") == namespace),
+        {"count": 0, "sum": 0.0}
+    )
+    return counters.get("cache_writes_total", 0), counters.get("cache_written_bytes_total", 0), decode["count"], decode["sum"]
+
+def measure(app, api, name, namespace, func, args_list):
+    before = app.get_cache_backend().stats()["namespaces"].get(namespace, {"hits": 0, "misses": 0})
+    costs_before = cache_costs(app, namespace)
+    api.reset()
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    after = app.get_cache_backend().stats()["namespaces"].get(namespace, {"hits": 0, "misses": 0})
+    writes, written, decodes, decode_time = (a - b for a, b in zip(cache_costs(app, namespace), costs_before))
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    upstream = api.stats()
+    ops = len(args_list)
+    return {
+        "scenario": name,
+        "ops": ops,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "upstream_calls_per_op": round(upstream["requests"] / ops, 3) if ops else 0.0,
+        "rate_limited": upstream["rate_limited"],
+        "cache_hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        "entry_kb": round(written / writes / 1024, 2) if writes else 0.0,
+        "decode_us": round(decode_time / decodes * 1e6, 1) if decodes else 0.0,
+        "calls": upstream["calls"],
+    }
+
+def run_scenarios(app, api, args):
+    # 每次运行使用全新的临时缓存，冷路径 ID 不与热路径重复
+    album_ids = [f"BenchAlbum{i:012d}" for i in range(args.albums)]
+    large_ids = [f"{LARGE_ALBUM_PREFIX}Album{i:012d}" for i in range(args.large_albums)]
+    queries = [f"bench query {i}" for i in range(args.searches)]
+    artist_ids = [f"BenchArtist{i:011d}" for i in range(args.artists)]
+    scenarios = [
+        ("album_cold", "album:v4", app.get_album_data, [(a,) for a in album_ids]),
+        ("album_warm", "album:v4", app.get_album_data, [(a,) for a in album_ids]),
+        ("large_album_cold", "album:v4", app.get_album_data, [(a,) for a in large_ids]),
+        ("large_album_warm", "album:v4", app.get_album_data, [(a,) for a in large_ids]),
+        ("search_cold", "search:v2", app.search_albums, [(q,) for q in queries]),
+        ("search_warm", "search:v2", app.search_albums, [(q,) for q in queries]),
+        ("artist_albums_cold", "artist_albums", app.get_artist_albums, [(a,) for a in artist_ids]),
+        ("artist_albums_warm", "artist_albums", app.get_artist_albums, [(a,) for a in artist_ids]),
+    ]
+    results = [measure(app, api, *scenario) for scenario in scenarios]
+    if args.rate_limit_every:
+        # 429 注入单独测一轮冷路径，观察调度器重试带来的延迟与额外调用
+        api.rate_limit_every = args.rate_limit_every
+        throttled_ids = [f"BenchThrottled{i:08d}" for i in range(args.albums)]
+        results.append(measure(app, api, "album_cold_429", "album:v4", app.get_album_data, [(a,) for a in throttled_ids]))
+        api.rate_limit_every = 0
+    return results
+
+def compare(results, baseline, tolerance):
+    # 延迟超过基线 (1 + tolerance) 倍且超出绝对容差、上游调用数增加、命中率下降、单条缓存变大，均视为回归
+    previous = {row["scenario"]: row for row in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        base = previous.get(row["scenario"])
+        if not base:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            limit = max(base[metric] * (1 + tolerance), base[metric] + LATENCY_SLACK_MS)
+            if row[metric] > limit:
+                regressions.append(f"{row['scenario']}: {metric} {row[metric]:.2f} > {base[metric]:.2f}")
+        if row["upstream_calls_per_op"] > base["upstream_calls_per_op"] + 1e-9:
+            regressions.append(
+                f"{row['scenario']}: upstream_calls_per_op {row['upstream_calls_per_op']} > {base['upstream_calls_per_op']}"
+            )
+        if row["cache_hit_ratio"] < base["cache_hit_ratio"] - 1e-9:
+            regressions.append(f"{row['scenario']}: cache_hit_ratio {row['cache_hit_ratio']} < {base['cache_hit_ratio']}")
+        if base.get("entry_kb") and row["entry_kb"] > base["entry_kb"] * (1 + tolerance):
+            regressions.append(f"{row['scenario']}: entry_kb {row['entry_kb']} > {base['entry_kb']}")
+    return regressions
+
+def format_table(results):
+    header = (
+        f"{'scenario':<20}{'ops':>6}{'p50 ms':>10}{'p99 ms':>10}{'calls/op':>10}{'429s':>6}{'hit ratio':>11}"
+        f"{'KB/entry':>10}{'decode us':>11}"
+    )
+    lines = [header, "-" * len(header)]
+    for row in results:
+        lines.append(
+            f"{row['scenario']:<20}{row['ops']:>6}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            f"{row['upstream_calls_per_op']:>10.2f}{row['rate_limited']:>6}{row['cache_hit_ratio']:>11.2f}"
+            f"{row['entry_kb']:>10.2f}{row['decode_us']:>11.1f}"
+        )
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试 / Offline benchmarks against a local fake Spotify API")
+    parser.add_argument("--app", default=APP_PATH, help="核心模块路径")
+    parser.add_argument("--latency", type=float, default=20.0, help="替身服务每个请求的延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="在延迟上叠加的随机抖动上限（毫秒）")
+    parser.add_argument("--albums", type=int, default=30, help="普通专辑数量")
+    parser.add_argument("--large-albums", type=int, default=3, help="超大专辑数量")
+    parser.add_argument("--large-tracks", type=int, default=1000, help="超大专辑的曲目数")
+    parser.add_argument("--searches", type=int, default=30, help="搜索关键词数量")
+    parser.add_argument("--artists", type=int, default=10, help="艺人数量")
+    parser.add_argument("--artist-albums", type=int, default=130, help="每位艺人的专辑数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="额外跑一轮每 N 个请求注入 429 的场景，0 表示跳过")
+    parser.add_argument("--retry-after", type=int, default=0, help="注入 429 时返回的 Retry-After（秒）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("-o", "--output", help="同时把 JSON 结果写入该文件，可作为后续基线")
+    parser.add_argument("--baseline", help="基线 JSON 文件，发现回归时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="延迟允许超出基线的比例")
+    args = parser.parse_args(argv)
+    args.app = os.path.abspath(args.app)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    api = FakeSpotify(
+        latency=args.latency / 1000, jitter=args.jitter / 1000, retry_after=args.retry_after,
+        large_album_tracks=args.large_tracks, artist_album_count=args.artist_albums,
+    )
+    server = FakeSpotifyServer(api).start()
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory(prefix="spotify-bench-") as workdir:
+            app = load_app(args.app, workdir, args.rate_limit_every)
+            point_app_at(app, server.url)
+            results = run_scenarios(app, api, args)
+            app.fetch_executor.shutdown(wait=True)
+            os.chdir(cwd)
+    finally:
+        server.stop()
+
+    report = {
+        "config": {
+            "latency_ms": args.latency, "jitter_ms": args.jitter, "large_tracks": args.large_tracks,
+            "artist_albums": args.artist_albums, "rate_limit_every": args.rate_limit_every,
+        },
+        "results": results,
+    }
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_table(results))
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
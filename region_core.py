@@ -0,0 +1,2492 @@
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+import re
+from collections import defaultdict, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice, count
+import os
+import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
+import atexit
+import sys
+import sqlite3
+import pickle
+import threading
+import functools
+from contextlib import contextmanager
+import argparse
+import json
+import csv
+import random
+import heapq
+import bisect
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import struct
+try:
+    import fcntl
+except ImportError:  # Windows 无 fcntl，令牌文件锁退化为进程内互斥
+    fcntl = None
+
+# ==== 进程级资源 ==== #
+def process_resource(factory):
+    # 本模块只导入一次，Streamlit 重跑与服务端各请求共享同一份；
+    # 会打开数据库、写文件或启动线程的进程级对象经此在首次使用时创建，之后复用（创建失败则下次重试），
+    # 导入本模块本身没有文件系统副作用
+    lock = threading.Lock()
+    created = []
+
+    @functools.wraps(factory)
+    def get():
+        if not created:
+            with lock:
+                if not created:
+                    created.append(factory())
+        return created[0]
+    return get
+
+
+# ==== 日志系统设置 ==== #
+# 调用方只把记录放入队列；格式化、写文件、轮转与刷新都在后台监听线程完成
+LOG_FILE_FORMAT = os.getenv("LOG_FILE_FORMAT", "json")       # json | text
+LOG_CONSOLE_FORMAT = os.getenv("LOG_CONSOLE_FORMAT", "text")  # json | text
+LOG_FIELDS = ("session", "album_id", "artist_id", "endpoint", "query", "latency", "api_calls")
+LOG_TYPE_PATTERN = re.compile(r"\s*\[Type: (\w+)\]$")
+
+# 当前 Streamlit 会话，经线程池复制的上下文带到抓取线程的日志里
+log_session = contextvars.ContextVar("log_session", default=None)
+
+class LogContextFilter(logging.Filter):
+    # 在调用方线程补充上下文字段，此时 contextvars 仍然有效
+    def filter(self, record):
+        if getattr(record, "session", None) is None:
+            record.session = log_session.get()
+        return True
+
+class DeferredQueueHandler(QueueHandler):
+    # 默认 prepare() 会在调用方线程格式化整条记录（含 traceback）；
+    # 这里只合并消息参数，异常信息原样交给后台线程格式化
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": message,
+            "thread": record.threadName,
+        }
+        # 消息末尾的 [Type: X] 标签拆成独立字段
+        match = LOG_TYPE_PATTERN.search(message)
+        if match:
+            entry["message"] = message[:match.start()]
+            entry["type"] = match.group(1)
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = round(value, 4) if isinstance(value, float) else value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def build_log_formatter(kind):
+    return JsonFormatter() if kind == "json" else logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+logger = logging.getLogger("SpotifyRegionChecker")
+logger.setLevel(logging.INFO)
+_logging_lock = threading.Lock()
+
+def setup_logging(console=None):
+    # 由页面、命令行、服务等入口调用；未调用时（被导入、测试、基准测试）日志走 logging 默认处理
+    with _logging_lock:
+        if logger.hasHandlers():
+            return
+        file_handler = RotatingFileHandler('spotify_app.log', maxBytes=3*1024*1024, backupCount=3)
+        file_handler.setFormatter(build_log_formatter(LOG_FILE_FORMAT))
+        console_handler = logging.StreamHandler(console or sys.stdout)
+        console_handler.setFormatter(build_log_formatter(LOG_CONSOLE_FORMAT))
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(LogContextFilter())
+        logger.addHandler(queue_handler)
+        log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        log_listener.start()
+        # 进程退出前排空队列
+        atexit.register(log_listener.stop)
+    logger.info("✅ 程序已启动，日志系统初始化成功")
+
+# ==== Spotify API 客户端 ==== #
+# spotipy/requests 只在首次调用 API 时导入并创建客户端；凭证检查放到页面与命令行入口
+SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+SPOTIFY_TOKEN_CACHE_PATH = os.getenv("SPOTIFY_TOKEN_CACHE_PATH", ".spotify_token.json")  # 同机各进程共享
+SPOTIFY_TOKEN_REFRESH_MARGIN = 300  # 秒，令牌剩余有效期低于该值时提前刷新
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))  # 每个主机保持的长连接数，应不小于并发抓取数
+
+def has_credentials():
+    return bool(SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET)
+
+@contextmanager
+def file_lock(path):
+    # 跨进程互斥（flock）；无 fcntl 的平台只依赖调用方的进程内锁
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class SharedTokenCache:
+    # client credentials 令牌：进程内直接复用内存副本；快过期时加线程锁 + 文件锁，
+    # 先看其他进程是否已写入新令牌，只有确实需要时才由一个进程请求，写回磁盘供同机其他进程使用
+    def __init__(self, credentials, client_id, path, refresh_margin=SPOTIFY_TOKEN_REFRESH_MARGIN):
+        self.credentials = credentials  # spotipy 的 SpotifyClientCredentials，只用于真正请求令牌
+        self.client_key = hashlib.sha256(client_id.encode("utf-8")).hexdigest()[:16]
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+
+    def _fresh(self, token):
+        return bool(token) and token.get("expires_at", 0) - time.time() > self.refresh_margin
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                token = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 同一台机器上可能跑着使用不同凭证的应用
+        return token if isinstance(token, dict) and token.get("client") == self.client_key else None
+
+    def _write(self, token):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(token, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Token cache write to {self.path} failed: {str(e)} [Type: Config]")
+
+    def _request(self):
+        start_time = time.perf_counter()
+        self.credentials.get_access_token(as_dict=False, check_cache=False)
+        token = dict(self.credentials.cache_handler.get_cached_token())
+        token["client"] = self.client_key
+        metrics.inc("spotify_token_requests_total")
+        logger.info(f"Requested new Spotify access token in {time.perf_counter() - start_time:.2f}s [Type: API]")
+        return token
+
+    def _refresh(self):
+        with self._lock:
+            if self._fresh(self._token):
+                return self._token
+            with file_lock(f"{self.path}.lock"):
+                token = self._read()
+                if not self._fresh(token):
+                    token = self._request()
+                    self._write(token)
+                self._token = token
+            return token
+
+    def get_access_token(self, as_dict=False):
+        # spotipy 每次请求都会调用；令牌有效时不加锁、不读盘
+        token = self._token
+        if not self._fresh(token):
+            token = self._refresh()
+        return dict(token) if as_dict else token["access_token"]
+
+def build_http_session(pool_size=HTTP_POOL_SIZE):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    # 只在连接层重试；429 交给全局请求调度器统一处理（保留 Retry-After 响应头）
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=False,
+        status=0,
+        backoff_factor=0.3,
+        respect_retry_after_header=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE'])
+    )
+    # 连接池按并发度定长；池满时等待空闲连接，而不是新建后丢弃（每次都要重新握手）
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_size, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+@process_resource
+def get_spotify_client():
+    if not has_credentials():
+        raise RuntimeError("缺少Spotify API凭证")
+    start_time = time.perf_counter()
+    import spotipy
+    from spotipy.cache_handler import MemoryCacheHandler
+    from spotipy.oauth2 import SpotifyClientCredentials
+    # 一个进程一个客户端：API 请求与令牌请求共用同一个连接池
+    session = build_http_session()
+    client_credentials_manager = SpotifyClientCredentials(
+        client_id=SPOTIFY_CLIENT_ID,
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        requests_session=session,
+        cache_handler=MemoryCacheHandler()
+    )
+    token_cache = SharedTokenCache(client_credentials_manager, SPOTIFY_CLIENT_ID, SPOTIFY_TOKEN_CACHE_PATH)
+    client = spotipy.Spotify(auth_manager=token_cache, requests_session=session)
+    logger.info(f"Spotify client ready in {time.perf_counter() - start_time:.2f}s [Type: Config]")
+    return client
+
+sp = None  # 非空时优先使用，测试与基准测试可替换为指向本地替身的客户端
+
+def spotify_client():
+    return sp if sp is not None else get_spotify_client()
+
+def spotify_error():
+    # 在 except 子句里按需取异常类型；能抛出它时 spotipy 已随客户端导入
+    from spotipy.exceptions import SpotifyException
+    return SpotifyException
+
+# ==== 地区信息表 ==== #
+# 覆盖 MARKET_CODES 中的全部地区：代码 -> (ISO-3 代码, 中文名, 英文名, 大洲)，两种语言共用
+CONTINENTS = {
+    "AS": ("亚洲", "Asia"),
+    "EU": ("欧洲", "Europe"),
+    "NA": ("北美洲", "North America"),
+    "SA": ("南美洲", "South America"),
+    "OC": ("大洋洲", "Oceania"),
+    "AF": ("非洲", "Africa"),
+}
+MARKET_TABLE = {
+    "AD": ("AND", "安道尔", "Andorra", "EU"),
+    "AE": ("ARE", "阿联酋", "United Arab Emirates", "AS"),
+    "AG": ("ATG", "安提瓜和巴布达", "Antigua and Barbuda", "NA"),
+    "AL": ("ALB", "阿尔巴尼亚", "Albania", "EU"),
+    "AM": ("ARM", "亚美尼亚", "Armenia", "AS"),
+    "AO": ("AGO", "安哥拉", "Angola", "AF"),
+    "AR": ("ARG", "阿根廷", "Argentina", "SA"),
+    "AT": ("AUT", "奥地利", "Austria", "EU"),
+    "AU": ("AUS", "澳大利亚", "Australia", "OC"),
+    "AZ": ("AZE", "阿塞拜疆", "Azerbaijan", "AS"),
+    "BA": ("BIH", "波黑", "Bosnia and Herzegovina", "EU"),
+    "BB": ("BRB", "巴巴多斯", "Barbados", "NA"),
+    "BD": ("BGD", "孟加拉国", "Bangladesh", "AS"),
+    "BE": ("BEL", "比利时", "Belgium", "EU"),
+    "BF": ("BFA", "布基纳法索", "Burkina Faso", "AF"),
+    "BG": ("BGR", "保加利亚", "Bulgaria", "EU"),
+    "BH": ("BHR", "巴林", "Bahrain", "AS"),
+    "BI": ("BDI", "布隆迪", "Burundi", "AF"),
+    "BJ": ("BEN", "贝宁", "Benin", "AF"),
+    "BN": ("BRN", "文莱", "Brunei", "AS"),
+    "BO": ("BOL", "玻利维亚", "Bolivia", "SA"),
+    "BR": ("BRA", "巴西", "Brazil", "SA"),
+    "BS": ("BHS", "巴哈马", "Bahamas", "NA"),
+    "BT": ("BTN", "不丹", "Bhutan", "AS"),
+    "BW": ("BWA", "博茨瓦纳", "Botswana", "AF"),
+    "BY": ("BLR", "白俄罗斯", "Belarus", "EU"),
+    "BZ": ("BLZ", "伯利兹", "Belize", "NA"),
+    "CA": ("CAN", "加拿大", "Canada", "NA"),
+    "CD": ("COD", "刚果（金）", "DR Congo", "AF"),
+    "CG": ("COG", "刚果（布）", "Republic of the Congo", "AF"),
+    "CH": ("CHE", "瑞士", "Switzerland", "EU"),
+    "CI": ("CIV", "科特迪瓦", "Côte d'Ivoire", "AF"),
+    "CL": ("CHL", "智利", "Chile", "SA"),
+    "CM": ("CMR", "喀麦隆", "Cameroon", "AF"),
+    "CO": ("COL", "哥伦比亚", "Colombia", "SA"),
+    "CR": ("CRI", "哥斯达黎加", "Costa Rica", "NA"),
+    "CV": ("CPV", "佛得角", "Cape Verde", "AF"),
+    "CW": ("CUW", "库拉索", "Curaçao", "NA"),
+    "CY": ("CYP", "塞浦路斯", "Cyprus", "EU"),
+    "CZ": ("CZE", "捷克", "Czechia", "EU"),
+    "DE": ("DEU", "德国", "Germany", "EU"),
+    "DJ": ("DJI", "吉布提", "Djibouti", "AF"),
+    "DK": ("DNK", "丹麦", "Denmark", "EU"),
+    "DM": ("DMA", "多米尼克", "Dominica", "NA"),
+    "DO": ("DOM", "多米尼加", "Dominican Republic", "NA"),
+    "DZ": ("DZA", "阿尔及利亚", "Algeria", "AF"),
+    "EC": ("ECU", "厄瓜多尔", "Ecuador", "SA"),
+    "EE": ("EST", "爱沙尼亚", "Estonia", "EU"),
+    "EG": ("EGY", "埃及", "Egypt", "AF"),
+    "ES": ("ESP", "西班牙", "Spain", "EU"),
+    "ET": ("ETH", "埃塞俄比亚", "Ethiopia", "AF"),
+    "FI": ("FIN", "芬兰", "Finland", "EU"),
+    "FJ": ("FJI", "斐济", "Fiji", "OC"),
+    "FM": ("FSM", "密克罗尼西亚", "Micronesia", "OC"),
+    "FR": ("FRA", "法国", "France", "EU"),
+    "GA": ("GAB", "加蓬", "Gabon", "AF"),
+    "GB": ("GBR", "英国", "United Kingdom", "EU"),
+    "GD": ("GRD", "格林纳达", "Grenada", "NA"),
+    "GE": ("GEO", "格鲁吉亚", "Georgia", "AS"),
+    "GH": ("GHA", "加纳", "Ghana", "AF"),
+    "GM": ("GMB", "冈比亚", "Gambia", "AF"),
+    "GN": ("GIN", "几内亚", "Guinea", "AF"),
+    "GQ": ("GNQ", "赤道几内亚", "Equatorial Guinea", "AF"),
+    "GR": ("GRC", "希腊", "Greece", "EU"),
+    "GT": ("GTM", "危地马拉", "Guatemala", "NA"),
+    "GW": ("GNB", "几内亚比绍", "Guinea-Bissau", "AF"),
+    "GY": ("GUY", "圭亚那", "Guyana", "SA"),
+    "HK": ("HKG", "香港", "Hong Kong", "AS"),
+    "HN": ("HND", "洪都拉斯", "Honduras", "NA"),
+    "HR": ("HRV", "克罗地亚", "Croatia", "EU"),
+    "HT": ("HTI", "海地", "Haiti", "NA"),
+    "HU": ("HUN", "匈牙利", "Hungary", "EU"),
+    "ID": ("IDN", "印尼", "Indonesia", "AS"),
+    "IE": ("IRL", "爱尔兰", "Ireland", "EU"),
+    "IL": ("ISR", "以色列", "Israel", "AS"),
+    "IN": ("IND", "印度", "India", "AS"),
+    "IQ": ("IRQ", "伊拉克", "Iraq", "AS"),
+    "IS": ("ISL", "冰岛", "Iceland", "EU"),
+    "IT": ("ITA", "意大利", "Italy", "EU"),
+    "JM": ("JAM", "牙买加", "Jamaica", "NA"),
+    "JO": ("JOR", "约旦", "Jordan", "AS"),
+    "JP": ("JPN", "日本", "Japan", "AS"),
+    "KE": ("KEN", "肯尼亚", "Kenya", "AF"),
+    "KG": ("KGZ", "吉尔吉斯斯坦", "Kyrgyzstan", "AS"),
+    "KH": ("KHM", "柬埔寨", "Cambodia", "AS"),
+    "KI": ("KIR", "基里巴斯", "Kiribati", "OC"),
+    "KM": ("COM", "科摩罗", "Comoros", "AF"),
+    "KN": ("KNA", "圣基茨和尼维斯", "Saint Kitts and Nevis", "NA"),
+    "KR": ("KOR", "韩国", "South Korea", "AS"),
+    "KW": ("KWT", "科威特", "Kuwait", "AS"),
+    "KZ": ("KAZ", "哈萨克斯坦", "Kazakhstan", "AS"),
+    "LA": ("LAO", "老挝", "Laos", "AS"),
+    "LB": ("LBN", "黎巴嫩", "Lebanon", "AS"),
+    "LC": ("LCA", "圣卢西亚", "Saint Lucia", "NA"),
+    "LI": ("LIE", "列支敦士登", "Liechtenstein", "EU"),
+    "LK": ("LKA", "斯里兰卡", "Sri Lanka", "AS"),
+    "LR": ("LBR", "利比里亚", "Liberia", "AF"),
+    "LS": ("LSO", "莱索托", "Lesotho", "AF"),
+    "LT": ("LTU", "立陶宛", "Lithuania", "EU"),
+    "LU": ("LUX", "卢森堡", "Luxembourg", "EU"),
+    "LV": ("LVA", "拉脱维亚", "Latvia", "EU"),
+    "LY": ("LBY", "利比亚", "Libya", "AF"),
+    "MA": ("MAR", "摩洛哥", "Morocco", "AF"),
+    "MC": ("MCO", "摩纳哥", "Monaco", "EU"),
+    "MD": ("MDA", "摩尔多瓦", "Moldova", "EU"),
+    "ME": ("MNE", "黑山", "Montenegro", "EU"),
+    "MG": ("MDG", "马达加斯加", "Madagascar", "AF"),
+    "MH": ("MHL", "马绍尔群岛", "Marshall Islands", "OC"),
+    "MK": ("MKD", "北马其顿", "North Macedonia", "EU"),
+    "ML": ("MLI", "马里", "Mali", "AF"),
+    "MN": ("MNG", "蒙古", "Mongolia", "AS"),
+    "MO": ("MAC", "澳门", "Macao", "AS"),
+    "MR": ("MRT", "毛里塔尼亚", "Mauritania", "AF"),
+    "MT": ("MLT", "马耳他", "Malta", "EU"),
+    "MU": ("MUS", "毛里求斯", "Mauritius", "AF"),
+    "MV": ("MDV", "马尔代夫", "Maldives", "AS"),
+    "MW": ("MWI", "马拉维", "Malawi", "AF"),
+    "MX": ("MEX", "墨西哥", "Mexico", "NA"),
+    "MY": ("MYS", "马来西亚", "Malaysia", "AS"),
+    "MZ": ("MOZ", "莫桑比克", "Mozambique", "AF"),
+    "NA": ("NAM", "纳米比亚", "Namibia", "AF"),
+    "NE": ("NER", "尼日尔", "Niger", "AF"),
+    "NG": ("NGA", "尼日利亚", "Nigeria", "AF"),
+    "NI": ("NIC", "尼加拉瓜", "Nicaragua", "NA"),
+    "NL": ("NLD", "荷兰", "Netherlands", "EU"),
+    "NO": ("NOR", "挪威", "Norway", "EU"),
+    "NP": ("NPL", "尼泊尔", "Nepal", "AS"),
+    "NR": ("NRU", "瑙鲁", "Nauru", "OC"),
+    "NZ": ("NZL", "新西兰", "New Zealand", "OC"),
+    "OM": ("OMN", "阿曼", "Oman", "AS"),
+    "PA": ("PAN", "巴拿马", "Panama", "NA"),
+    "PE": ("PER", "秘鲁", "Peru", "SA"),
+    "PG": ("PNG", "巴布亚新几内亚", "Papua New Guinea", "OC"),
+    "PH": ("PHL", "菲律宾", "Philippines", "AS"),
+    "PK": ("PAK", "巴基斯坦", "Pakistan", "AS"),
+    "PL": ("POL", "波兰", "Poland", "EU"),
+    "PR": ("PRI", "波多黎各", "Puerto Rico", "NA"),
+    "PS": ("PSE", "巴勒斯坦", "Palestine", "AS"),
+    "PT": ("PRT", "葡萄牙", "Portugal", "EU"),
+    "PW": ("PLW", "帕劳", "Palau", "OC"),
+    "PY": ("PRY", "巴拉圭", "Paraguay", "SA"),
+    "QA": ("QAT", "卡塔尔", "Qatar", "AS"),
+    "RO": ("ROU", "罗马尼亚", "Romania", "EU"),
+    "RS": ("SRB", "塞尔维亚", "Serbia", "EU"),
+    "RW": ("RWA", "卢旺达", "Rwanda", "AF"),
+    "SA": ("SAU", "沙特阿拉伯", "Saudi Arabia", "AS"),
+    "SB": ("SLB", "所罗门群岛", "Solomon Islands", "OC"),
+    "SC": ("SYC", "塞舌尔", "Seychelles", "AF"),
+    "SE": ("SWE", "瑞典", "Sweden", "EU"),
+    "SG": ("SGP", "新加坡", "Singapore", "AS"),
+    "SI": ("SVN", "斯洛文尼亚", "Slovenia", "EU"),
+    "SK": ("SVK", "斯洛伐克", "Slovakia", "EU"),
+    "SL": ("SLE", "塞拉利昂", "Sierra Leone", "AF"),
+    "SM": ("SMR", "圣马力诺", "San Marino", "EU"),
+    "SN": ("SEN", "塞内加尔", "Senegal", "AF"),
+    "SR": ("SUR", "苏里南", "Suriname", "SA"),
+    "ST": ("STP", "圣多美和普林西比", "São Tomé and Príncipe", "AF"),
+    "SV": ("SLV", "萨尔瓦多", "El Salvador", "NA"),
+    "SZ": ("SWZ", "斯威士兰", "Eswatini", "AF"),
+    "TD": ("TCD", "乍得", "Chad", "AF"),
+    "TG": ("TGO", "多哥", "Togo", "AF"),
+    "TH": ("THA", "泰国", "Thailand", "AS"),
+    "TJ": ("TJK", "塔吉克斯坦", "Tajikistan", "AS"),
+    "TL": ("TLS", "东帝汶", "Timor-Leste", "AS"),
+    "TN": ("TUN", "突尼斯", "Tunisia", "AF"),
+    "TO": ("TON", "汤加", "Tonga", "OC"),
+    "TR": ("TUR", "土耳其", "Türkiye", "AS"),
+    "TT": ("TTO", "特立尼达和多巴哥", "Trinidad and Tobago", "NA"),
+    "TV": ("TUV", "图瓦卢", "Tuvalu", "OC"),
+    "TW": ("TWN", "台湾", "Taiwan", "AS"),
+    "TZ": ("TZA", "坦桑尼亚", "Tanzania", "AF"),
+    "UA": ("UKR", "乌克兰", "Ukraine", "EU"),
+    "UG": ("UGA", "乌干达", "Uganda", "AF"),
+    "US": ("USA", "美国", "United States", "NA"),
+    "UY": ("URY", "乌拉圭", "Uruguay", "SA"),
+    "UZ": ("UZB", "乌兹别克斯坦", "Uzbekistan", "AS"),
+    "VC": ("VCT", "圣文森特和格林纳丁斯", "Saint Vincent and the Grenadines", "NA"),
+    "VE": ("VEN", "委内瑞拉", "Venezuela", "SA"),
+    "VN": ("VNM", "越南", "Vietnam", "AS"),
+    "VU": ("VUT", "瓦努阿图", "Vanuatu", "OC"),
+    "WS": ("WSM", "萨摩亚", "Samoa", "OC"),
+    "XK": ("XKX", "科索沃", "Kosovo", "EU"),
+    "ZA": ("ZAF", "南非", "South Africa", "AF"),
+    "ZM": ("ZMB", "赞比亚", "Zambia", "AF"),
+    "ZW": ("ZWE", "津巴布韦", "Zimbabwe", "AF"),
+}
+LANG_COLUMNS = {"zh": 0, "en": 1}
+MARKET_NAMES = {
+    lang: {code: info[1 + column] for code, info in MARKET_TABLE.items()}
+    for lang, column in LANG_COLUMNS.items()
+}
+# 每个大洲下的地区按代码排序，渲染时无需再分组
+CONTINENT_MARKETS = {
+    continent: tuple(code for code, info in MARKET_TABLE.items() if info[3] == continent)
+    for continent in CONTINENTS
+}
+
+def market_name(code, lang_code):
+    return MARKET_NAMES[lang_code].get(code, code)
+
+def continent_name(continent, lang_code):
+    return CONTINENTS[continent][LANG_COLUMNS[lang_code]]
+
+# ==== 地区位图编码 ==== #
+# 每个地区代码占用固定的位；新地区只能追加在末尾，不可调整顺序（缓存与索引依赖位序）
+MARKET_CODES = (
+    "AD", "AE", "AG", "AL", "AM", "AO", "AR", "AT", "AU", "AZ", "BA", "BB", "BD", "BE", "BF", "BG",
+    "BH", "BI", "BJ", "BN", "BO", "BR", "BS", "BT", "BW", "BY", "BZ", "CA", "CD", "CG", "CH", "CI",
+    "CL", "CM", "CO", "CR", "CV", "CW", "CY", "CZ", "DE", "DJ", "DK", "DM", "DO", "DZ", "EC", "EE",
+    "EG", "ES", "ET", "FI", "FJ", "FM", "FR", "GA", "GB", "GD", "GE", "GH", "GM", "GN", "GQ", "GR",
+    "GT", "GW", "GY", "HK", "HN", "HR", "HT", "HU", "ID", "IE", "IL", "IN", "IQ", "IS", "IT", "JM",
+    "JO", "JP", "KE", "KG", "KH", "KI", "KM", "KN", "KR", "KW", "KZ", "LA", "LB", "LC", "LI", "LK",
+    "LR", "LS", "LT", "LU", "LV", "LY", "MA", "MC", "MD", "ME", "MG", "MH", "MK", "ML", "MN", "MO",
+    "MR", "MT", "MU", "MV", "MW", "MX", "MY", "MZ", "NA", "NE", "NG", "NI", "NL", "NO", "NP", "NR",
+    "NZ", "OM", "PA", "PE", "PG", "PH", "PK", "PL", "PR", "PS", "PT", "PW", "PY", "QA", "RO", "RS",
+    "RW", "SA", "SB", "SC", "SE", "SG", "SI", "SK", "SL", "SM", "SN", "SR", "ST", "SV", "SZ", "TD",
+    "TG", "TH", "TJ", "TL", "TN", "TO", "TR", "TT", "TV", "TW", "TZ", "UA", "UG", "US", "UY", "UZ",
+    "VC", "VE", "VN", "VU", "WS", "XK", "ZA", "ZM", "ZW",
+)
+MARKET_POSITIONS = {code: i for i, code in enumerate(MARKET_CODES)}
+MARKET_BITS = {code: 1 << i for i, code in enumerate(MARKET_CODES)}
+MARKET_BITMAP_BYTES = (len(MARKET_CODES) + 7) // 8
+ALL_MARKETS = (1 << len(MARKET_CODES)) - 1
+_unknown_markets_logged = set()
+
+def encode_markets(codes):
+    bits = 0
+    unknown = []
+    for code in codes:
+        bit = MARKET_BITS.get(code)
+        if bit:
+            bits |= bit
+        elif code not in _unknown_markets_logged:
+            unknown.append(code)
+    if unknown:
+        _unknown_markets_logged.update(unknown)
+        logger.warning(f"Unknown market codes ignored: {', '.join(unknown)} [Type: Config]")
+    return bits
+
+def decode_markets(bits):
+    codes = []
+    while bits:
+        low = bits & -bits
+        codes.append(MARKET_CODES[low.bit_length() - 1])
+        bits ^= low
+    return codes
+
+def has_market(bits, code):
+    return bool(bits & MARKET_BITS.get(code, 0))
+
+def market_count(bits):
+    return bin(bits).count("1")
+
+def markets_union(bitsets):
+    result = 0
+    for bits in bitsets:
+        result |= bits
+    return result
+
+def markets_intersection(bitsets):
+    result = ALL_MARKETS
+    for bits in bitsets:
+        result &= bits
+    return result
+
+def markets_diff(bits, other):
+    return bits & ~other
+
+def market_counts(bitsets):
+    # 每个地区在多少个位图中出现，用于多专辑覆盖统计
+    counts = [0] * len(MARKET_CODES)
+    for bits in bitsets:
+        while bits:
+            low = bits & -bits
+            counts[low.bit_length() - 1] += 1
+            bits ^= low
+    return dict(zip(MARKET_CODES, counts))
+
+def markets_to_bytes(bits):
+    return bits.to_bytes(MARKET_BITMAP_BYTES, "little")
+
+def markets_from_bytes(data):
+    return int.from_bytes(data, "little")
+
+def extract_album_id(url):
+    if not url or not isinstance(url, str):
+        return None
+    pattern = r"(?:spotify\.com/album/|:album:)([\w\d]+)"
+    match = re.search(pattern, url)
+    return match.group(1) if match else None
+
+# ==== 指标与请求追踪 ==== #
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 秒
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))                             # Prometheus 抓取端口，0 表示关闭
+METRICS_SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH", "")                 # 定期写出 JSON 快照的文件，空表示关闭
+METRICS_SNAPSHOT_INTERVAL = int(os.getenv("METRICS_SNAPSHOT_INTERVAL", "60"))  # 秒
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一格为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # 按桶上界估算分位数，落在 +Inf 桶时返回最大有限上界
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def format_sample(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class MetricsRegistry:
+    # 进程内计数器与延迟直方图，按 (名称, 标签) 聚合；
+    # 采集函数在导出时现取数据（如缓存统计），按名称注册，脚本重跑时覆盖而不重复
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._collectors = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name, collector):
+        # collector() 产出 (指标名, 类型, 标签 dict, 值)
+        with self._lock:
+            self._collectors[name] = collector
+
+    def _collected(self):
+        with self._lock:
+            collectors = list(self._collectors.items())
+        samples = []
+        for name, collector in collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector {name} failed: {str(e)} [Type: Metrics]")
+        return samples
+
+    def histogram_summary(self, name):
+        # 各标签组合的调用数、总耗时与 p50/p99 估算，供界面展示
+        with self._lock:
+            items = [(dict(labels), h) for (n, labels), h in self._histograms.items() if n == name]
+            return [
+                {"labels": labels, "count": h.count, "sum": h.sum, "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+                for labels, h in sorted(items, key=lambda item: -item[1].sum)
+            ]
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                    "p50": h.quantile(0.5), "p99": h.quantile(0.99),
+                    "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)),
+                }
+                for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+        gauges = [
+            {"name": name, "type": kind, "labels": labels, "value": value}
+            for name, kind, labels, value in self._collected()
+        ]
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms, "collected": gauges}
+
+    def render_prometheus(self):
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                declare(name, "counter")
+                lines.append(f"{name}{format_labels(labels)} {format_sample(value)}")
+            for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0]):
+                declare(name, "histogram")
+                cumulative = 0
+                for bound, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {h.sum:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {h.count}")
+        for name, kind, labels, value in self._collected():
+            declare(name, kind)
+            lines.append(f"{name}{format_labels(sorted(labels.items()))} {format_sample(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+# 当前页面加载的追踪；抓取线程池提交任务时复制调用方上下文，子任务写入同一追踪。
+# 调度器等进程级对象跨重跑存活，上下文变量也必须是同一个对象
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class RequestTrace:
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def add(self, kind, name, start, duration, **attrs):
+        with self._lock:
+            self.spans.append({"kind": kind, "name": name, "offset": start - self.started, "duration": duration, **attrs})
+
+    def summary(self):
+        with self._lock:
+            spans = list(self.spans)
+        api_spans = [s for s in spans if s["kind"] == "api"]
+        cache_spans = [s for s in spans if s["kind"] == "cache"]
+        return {
+            "api_calls": len(api_spans),
+            "api_time": sum(s["duration"] for s in api_spans),
+            "rate_limited": sum(1 for s in api_spans if s.get("outcome") == "rate_limited"),
+            # 旧数据与合并等待都没有让本次请求访问上游，计为命中
+            "cache_hits": sum(1 for s in cache_spans if s.get("result") in ("hit", "stale", "shared")),
+            "cache_misses": sum(1 for s in cache_spans if s.get("result") == "miss"),
+            "elapsed": self.elapsed,
+        }
+
+@contextmanager
+def trace_request(kind, name):
+    trace = RequestTrace(kind, name)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        trace.elapsed = time.perf_counter() - trace.started
+        metrics.observe("page_load_duration_seconds", trace.elapsed, page=kind)
+        summary = trace.summary()
+        logger.info(
+            f"Trace {kind} {name}: {summary['api_calls']} API calls ({summary['rate_limited']} rate limited, "
+            f"{summary['api_time']:.2f}s), cache {summary['cache_hits']} hits / {summary['cache_misses']} misses, "
+            f"total {trace.elapsed:.2f}s [Type: Metrics]",
+            extra={
+                "album_id": name if kind == "album" else None,
+                "artist_id": name if kind == "artist" else None,
+                "query": name if kind == "search" else None,
+                "latency": trace.elapsed,
+                "api_calls": summary["api_calls"],
+            }
+        )
+
+def record_span(kind, name, start, **attrs):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(kind, name, start, time.perf_counter() - start, **attrs)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, content_type = self.server.registry.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(self.server.registry.snapshot(), ensure_ascii=False), "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsSnapshotWriter(threading.Thread):
+    def __init__(self, registry, path, interval):
+        super().__init__(name="metrics-snapshot", daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        # 先写临时文件再替换，读取方不会看到半个文件
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.registry.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Metrics snapshot to {self.path} failed: {str(e)} [Type: Metrics]")
+
+    def stop(self):
+        self._stop_event.set()
+
+@process_resource
+def start_metrics_exporter():
+    # 每个进程一个导出器：可选的 /metrics 抓取端点与定期 JSON 快照
+    exporters = []
+    if METRICS_PORT > 0:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+        except OSError as e:
+            logger.error(f"Metrics endpoint on {METRICS_HOST}:{METRICS_PORT} unavailable: {str(e)} [Type: Metrics]")
+        else:
+            server.daemon_threads = True
+            server.registry = metrics
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            exporters.append(server)
+            logger.info(f"Metrics endpoint listening on http://{METRICS_HOST}:{METRICS_PORT}/metrics [Type: Metrics]")
+    if METRICS_SNAPSHOT_PATH and METRICS_SNAPSHOT_INTERVAL > 0:
+        writer = MetricsSnapshotWriter(metrics, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL)
+        writer.start()
+        exporters.append(writer)
+        logger.info(f"Metrics snapshots every {METRICS_SNAPSHOT_INTERVAL}s to {METRICS_SNAPSHOT_PATH} [Type: Metrics]")
+    return exporters
+
+# ==== 持久化缓存 ==== #
+CACHE_TTL = 3600
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "spotify_cache.sqlite3")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_TOUCH_INTERVAL = 60  # LRU 访问时间的最小刷新间隔，避免每次命中都写库
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "86400"))  # 过期后仍可作为旧数据返回的时长（秒），0 表示到期即删除
+CACHE_REFRESH_BACKOFF = int(os.getenv("CACHE_REFRESH_BACKOFF", "60"))  # 后台刷新失败后，该条目在此秒数内不再刷新（429 时按 Retry-After）
+
+@contextmanager
+def sqlite_transaction(conn, mode="IMMEDIATE"):
+    # autocommit 连接上的显式事务：正常结束提交；异常、中断或提交失败时回滚，连接不会停留在事务中
+    conn.execute(f"BEGIN {mode}")
+    committed = False
+    try:
+        yield conn
+        conn.execute("COMMIT")
+        committed = True
+    finally:
+        if not committed and conn.in_transaction:
+            conn.execute("ROLLBACK")
+
+class CacheBackend:
+    # 缓存后端接口：值统一序列化为 pickle 字节，命中时返回新副本，与 st.cache_data 行为一致
+    # 条目过期后再保留 CACHE_STALE_TTL 秒，期间作为旧数据返回（stale-while-revalidate）
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._stats_lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"hits": 0, "stale": 0, "misses": 0})
+
+    def _record(self, namespace, result):
+        with self._stats_lock:
+            self._stats[namespace][result] += 1
+
+    def _record_entry(self, namespace, expires_at, now):
+        self._record(namespace, "misses" if expires_at is None else "stale" if expires_at < now else "hits")
+
+    def _encode(self, namespace, value):
+        # 写入字节数与反序列化耗时按命名空间计入指标，用于衡量每条缓存的内存与读取成本
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        metrics.inc("cache_written_bytes_total", len(payload), namespace=namespace)
+        metrics.inc("cache_writes_total", namespace=namespace)
+        return payload
+
+    def _decode(self, namespace, key, payload):
+        # 返回 (ok, value)；无法解码的条目（如记录格式版本不符）直接删除，按未命中处理
+        start = time.perf_counter()
+        try:
+            value = pickle.loads(payload)
+        except Exception as e:
+            logger.warning(f"Dropping undecodable cache entry {namespace}/{key}: {str(e)} [Type: Cache]")
+            self.delete(namespace, key)
+            return False, None
+        metrics.observe("cache_decode_seconds", time.perf_counter() - start, namespace=namespace)
+        return True, value
+
+    def get(self, namespace, key):
+        # 只返回未过期的条目
+        hit, value, expires_at = self.get_with_meta(namespace, key)
+        return (True, value) if hit and expires_at >= time.time() else (False, None)
+
+    def get_with_meta(self, namespace, key):
+        # 返回 (hit, value, expires_at)；expires_at 早于当前时间即为旧数据
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        raise NotImplementedError
+
+    def clear(self, namespace=None):
+        raise NotImplementedError
+
+    def usage(self):
+        raise NotImplementedError
+
+    def stats(self):
+        # 旧数据同样免去了一次等待上游，计入命中率
+        with self._stats_lock:
+            namespaces = {ns: dict(counts) for ns, counts in self._stats.items()}
+        hits = sum(c["hits"] for c in namespaces.values())
+        stale = sum(c["stale"] for c in namespaces.values())
+        misses = sum(c["misses"] for c in namespaces.values())
+        entries, size = self.usage()
+        return {
+            "backend": type(self).__name__,
+            "hits": hits,
+            "stale": stale,
+            "misses": misses,
+            "hit_ratio": (hits + stale) / (hits + stale + misses) if hits + stale + misses else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "namespaces": namespaces,
+        }
+
+class MemoryCacheBackend(CacheBackend):
+    # 进程内 LRU，仅用于开发或无磁盘环境
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get_with_meta(self, namespace, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry and entry[1] + CACHE_STALE_TTL < now:
+                self._bytes -= len(self._entries.pop((namespace, key))[0])
+                entry = None
+            if entry:
+                self._entries.move_to_end((namespace, key))
+        value = None
+        if entry:
+            ok, value = self._decode(namespace, key, entry[0])
+            entry = entry if ok else None
+        self._record_entry(namespace, entry[1] if entry else None, now)
+        return (True, value, entry[1]) if entry else (False, None, None)
+
+    def set(self, namespace, key, value, ttl):
+        payload = self._encode(namespace, value)
+        with self._lock:
+            old = self._entries.pop((namespace, key), None)
+            if old:
+                self._bytes -= len(old[0])
+            self._entries[(namespace, key)] = (payload, time.time() + ttl)
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            old = self._entries.pop((namespace, key), None)
+            if old:
+                self._bytes -= len(old[0])
+
+    def clear(self, namespace=None):
+        with self._lock:
+            for cache_key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                self._bytes -= len(self._entries.pop(cache_key)[0])
+
+    def usage(self):
+        with self._lock:
+            return len(self._entries), self._bytes
+
+class SQLiteCacheBackend(CacheBackend):
+    # 单机多进程共享：WAL 模式 + busy timeout，每个线程独立连接
+    def __init__(self, max_bytes, path):
+        super().__init__(max_bytes)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache_entries (last_access)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_with_meta(self, namespace, key):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, expires_at, last_access FROM cache_entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        now = time.time()
+        if row and row[1] + CACHE_STALE_TTL < now:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at < ?",
+                (namespace, key, now - CACHE_STALE_TTL)
+            )
+            row = None
+        value = None
+        if row:
+            ok, value = self._decode(namespace, key, row[0])
+            row = row if ok else None
+        if row and now - row[2] > CACHE_TOUCH_INTERVAL:
+            conn.execute("UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        self._record_entry(namespace, row[1] if row else None, now)
+        return (True, value, row[1]) if row else (False, None, None)
+
+    def set(self, namespace, key, value, ttl):
+        payload = self._encode(namespace, value)
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, key, payload, len(payload), now + ttl, now)
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now - CACHE_STALE_TTL,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        victims = []
+        for rowid, size in conn.execute("SELECT rowid, size FROM cache_entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            victims.append((rowid,))
+            total -= size
+        conn.executemany("DELETE FROM cache_entries WHERE rowid = ?", victims)
+        logger.info(f"Cache evicted {len(victims)} entries [Type: Cache]")
+
+    def delete(self, namespace, key):
+        self._connect().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace=None):
+        if namespace is None:
+            self._connect().execute("DELETE FROM cache_entries")
+        else:
+            self._connect().execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+    def usage(self):
+        return tuple(self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone())
+
+CACHE_BACKENDS = {
+    "sqlite": lambda: SQLiteCacheBackend(CACHE_MAX_BYTES, CACHE_DB_PATH),
+    "memory": lambda: MemoryCacheBackend(CACHE_MAX_BYTES),
+}
+
+def create_cache_backend(name=CACHE_BACKEND):
+    if name not in CACHE_BACKENDS:
+        logger.warning(f"Unknown cache backend {name}, falling back to memory [Type: Config]")
+        name = "memory"
+    try:
+        return CACHE_BACKENDS[name]()
+    except sqlite3.Error as e:
+        logger.error(f"Cache backend {name} unavailable: {str(e)}, falling back to memory [Type: Cache]")
+        return MemoryCacheBackend(CACHE_MAX_BYTES)
+
+get_cache_backend = process_resource(create_cache_backend)
+
+def observe_cache_call(namespace, result, start):
+    # 未命中时的耗时包含实际计算，即该入口的完整延迟；shared 表示等待了同键的进行中请求
+    metrics.observe("cached_call_duration_seconds", time.perf_counter() - start, namespace=namespace, result=result)
+    record_span("cache", namespace, start, result=result)
+
+def cache_metrics():
+    info = get_cache_backend().stats()
+    for namespace, counts in sorted(info["namespaces"].items()):
+        total = counts["hits"] + counts["stale"] + counts["misses"]
+        yield "cache_hits_total", "counter", {"namespace": namespace}, counts["hits"]
+        yield "cache_stale_hits_total", "counter", {"namespace": namespace}, counts["stale"]
+        yield "cache_misses_total", "counter", {"namespace": namespace}, counts["misses"]
+        yield "cache_hit_ratio", "gauge", {"namespace": namespace}, (counts["hits"] + counts["stale"]) / total if total else 0.0
+    yield "cache_entries", "gauge", {"backend": info["backend"]}, info["entries"]
+    yield "cache_bytes", "gauge", {"backend": info["backend"]}, info["bytes"]
+    yield "cache_inflight_requests", "gauge", {}, single_flight.in_flight()
+
+metrics.register_collector("cache", cache_metrics)
+
+class FlightAbandoned(Exception):
+    # 领头调用方未完成即被中断（Streamlit 重跑/停止、KeyboardInterrupt 等）；等待方应重新发起
+    pass
+
+class SingleFlight:
+    # 请求合并：同一键的并发未命中只由第一个调用方（leader）执行，其余调用方等待并共享其结果或异常
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join(self, key):
+        # 返回 (flight, leader)；leader 为 True 时调用方负责执行并以 finish 结束
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = Future()
+            flight.key = key
+            self._flights[key] = flight
+            return flight, True
+
+    def finish(self, flight, value=None, error=None):
+        # 可重复调用，只有第一次生效；之后到达的调用方重新发起请求
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.done():
+                return
+            if error is not None:
+                flight.set_exception(error)
+            else:
+                flight.set_result(value)
+
+    def abandon(self, flight):
+        # 领头调用方中途退出时结束本次执行；中断不是请求本身的结果，不交给等待方，等待方重新发起
+        self.finish(flight, error=FlightAbandoned(f"flight {flight.key!r} abandoned"))
+
+    def do(self, key, func):
+        while True:
+            flight, leader = self.join(key)
+            if not leader:
+                try:
+                    return flight.result(), False
+                except FlightAbandoned:
+                    continue
+            try:
+                value = func()
+                self.finish(flight, value=value)
+                return value, True
+            except Exception as e:
+                self.finish(flight, error=e)
+                raise
+            finally:
+                # 只有被 BaseException 中断时此处 flight 仍未结束；中断只在本调用方继续传播
+                self.abandon(flight)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+single_flight = SingleFlight()
+
+def cached(namespace, ttl=CACHE_TTL, key=None):
+    # 替代 st.cache_data：按 key(*args) 生成缓存键，异常不缓存；同键的并发未命中合并为一次计算
+    # 过期条目立即返回并交给后台刷新，刷新失败时继续使用旧数据
+    def decorator(func):
+        def make_key(*args, **kwargs):
+            return key(*args, **kwargs) if key else repr((args, sorted(kwargs.items())))
+
+        def entry_meta(expires_at):
+            # age 为距上次抓取的秒数
+            now = time.time()
+            return {"stale": expires_at < now, "age": max(0.0, now - (expires_at - ttl))}
+
+        # 刷新失败的条目在退避结束前不再刷新，上游故障或限流期间每次读取旧数据不会都触发一次请求
+        refresh_lock = threading.Lock()
+        refresh_not_before = {}
+
+        def refresh_backed_off(cache_key):
+            now = time.time()
+            with refresh_lock:
+                until = refresh_not_before.get(cache_key)
+                if until is not None and until <= now:
+                    del refresh_not_before[cache_key]
+                    until = None
+            return until is not None
+
+        def record_refresh_failure(cache_key, e):
+            backoff = CACHE_REFRESH_BACKOFF
+            if getattr(e, "http_status", None) == 429:
+                backoff = max(backoff, retry_after_seconds(e, backoff))
+            now = time.time()
+            with refresh_lock:
+                if len(refresh_not_before) >= 1024:
+                    for expired in [k for k, until in refresh_not_before.items() if until <= now]:
+                        del refresh_not_before[expired]
+                refresh_not_before[cache_key] = now + backoff
+            return backoff
+
+        def refresh(flight, cache_key, args, kwargs):
+            # 后台刷新以批量优先级执行，不计入任何页面的追踪
+            request_priority.set(PRIORITY_BATCH)
+            current_trace.set(None)
+            try:
+                value = func(*args, **kwargs)
+                get_cache_backend().set(namespace, cache_key, value, ttl)
+                single_flight.finish(flight, value=value)
+                metrics.inc("cache_refreshes_total", namespace=namespace, outcome="ok")
+            except Exception as e:
+                backoff = record_refresh_failure(cache_key, e)
+                single_flight.finish(flight, error=e)
+                metrics.inc("cache_refreshes_total", namespace=namespace, outcome="error")
+                logger.warning(
+                    f"Background refresh failed for {namespace} {cache_key}, keeping stale entry and retrying in {backoff}s: {str(e)} [Type: Cache]"
+                )
+            finally:
+                # 被中断时释放等待方，由它们重新发起
+                single_flight.abandon(flight)
+
+        def revalidate(cache_key, args, kwargs):
+            # 同一条目同时只有一个刷新任务；刷新期间到达的未命中也会等待它
+            if refresh_backed_off(cache_key):
+                metrics.inc("cache_refreshes_total", namespace=namespace, outcome="backoff")
+                return
+            flight, leader = single_flight.join((namespace, cache_key))
+            if not leader:
+                return
+            try:
+                refresh_executor.submit(refresh, flight, cache_key, args, kwargs)
+            except RuntimeError as e:
+                single_flight.finish(flight, error=e)
+
+        def get_with_meta(*args, **kwargs):
+            # 返回 (value, meta)；meta["stale"] 为 True 表示返回的是旧数据，已触发后台刷新
+            start = time.perf_counter()
+            cache_key = make_key(*args, **kwargs)
+            hit, value, expires_at = get_cache_backend().get_with_meta(namespace, cache_key)
+            if hit:
+                meta = entry_meta(expires_at)
+                if meta["stale"]:
+                    revalidate(cache_key, args, kwargs)
+                observe_cache_call(namespace, "stale" if meta["stale"] else "hit", start)
+                return value, meta
+
+            def compute():
+                value = func(*args, **kwargs)
+                get_cache_backend().set(namespace, cache_key, value, ttl)
+                return value
+
+            value, leader = single_flight.do((namespace, cache_key), compute)
+            observe_cache_call(namespace, "miss" if leader else "shared", start)
+            return value, {"stale": False, "age": 0.0}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return get_with_meta(*args, **kwargs)[0]
+
+        def lookup(*args, **kwargs):
+            # 只查缓存不抓取，返回 (hit, value, meta)；旧数据同样算命中并触发后台刷新
+            start = time.perf_counter()
+            cache_key = make_key(*args, **kwargs)
+            hit, value, expires_at = get_cache_backend().get_with_meta(namespace, cache_key)
+            meta = entry_meta(expires_at) if hit else {"stale": False, "age": 0.0}
+            if meta["stale"]:
+                revalidate(cache_key, args, kwargs)
+            observe_cache_call(namespace, "stale" if meta["stale"] else "hit" if hit else "miss", start)
+            return hit, value, meta
+
+        wrapper.cache_key = make_key
+        wrapper.get_with_meta = get_with_meta
+        wrapper.lookup = lookup
+        wrapper.join = lambda *args, **kwargs: single_flight.join((namespace, make_key(*args, **kwargs)))
+        wrapper.store = lambda value, *args, **kwargs: get_cache_backend().set(namespace, make_key(*args, **kwargs), value, ttl)
+        wrapper.invalidate = lambda *args, **kwargs: get_cache_backend().delete(namespace, make_key(*args, **kwargs))
+        wrapper.clear = lambda: get_cache_backend().clear(namespace)
+        return wrapper
+    return decorator
+
+# ==== 全局请求调度器 ==== #
+PRIORITY_INTERACTIVE = 0  # 页面交互查询优先
+PRIORITY_BATCH = 1        # 批量/后台任务让路
+
+# 未显式指定优先级的调用沿用当前上下文的优先级，后台任务设一次即可覆盖其派生的全部抓取
+request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+API_RATE_PER_SEC = float(os.getenv("API_RATE_PER_SEC", "10"))
+API_BURST = float(os.getenv("API_BURST", "20"))
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "4"))
+API_BACKOFF_BASE = 1.0
+API_BACKOFF_MAX = 30.0
+
+def retry_after_seconds(e, default=2):
+    return int((getattr(e, "headers", None) or {}).get('Retry-After', default))
+
+class LocalRateState:
+    # 进程内令牌桶与 429 冷却窗口
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.time()
+        self._cooldown_until = 0.0
+
+    def try_acquire(self):
+        # 返回 0 表示已取得令牌，否则返回需要等待的秒数
+        with self._lock:
+            now = time.time()
+            if self._cooldown_until > now:
+                return self._cooldown_until - now
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def set_cooldown(self, until):
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, until)
+            self._tokens = 0
+
+class SQLiteRateState:
+    # 同机多进程共享的令牌桶与 429 冷却窗口，存放在缓存库中
+    def __init__(self, rate, burst, path, name="spotify"):
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_state (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                cooldown_until REAL NOT NULL
+            )""")
+        conn.execute(
+            "INSERT OR IGNORE INTO rate_limit_state (name, tokens, updated_at, cooldown_until) VALUES (?, ?, ?, 0)",
+            (name, burst, time.time())
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def try_acquire(self):
+        with sqlite_transaction(self._connect()) as conn:
+            tokens, updated_at, cooldown_until = conn.execute(
+                "SELECT tokens, updated_at, cooldown_until FROM rate_limit_state WHERE name = ?", (self.name,)
+            ).fetchone()
+            now = time.time()
+            if cooldown_until > now:
+                return cooldown_until - now
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            wait_for = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait_for = (1 - tokens) / self.rate
+            conn.execute(
+                "UPDATE rate_limit_state SET tokens = ?, updated_at = ? WHERE name = ?", (tokens, now, self.name)
+            )
+            return wait_for
+
+    def set_cooldown(self, until):
+        self._connect().execute(
+            "UPDATE rate_limit_state SET cooldown_until = MAX(cooldown_until, ?), tokens = 0 WHERE name = ?",
+            (until, self.name)
+        )
+
+class RequestScheduler:
+    # 所有 sp.* 调用的唯一入口：令牌桶限速、集中处理 Retry-After、带抖动的指数退避、交互请求优先
+    def __init__(self, state, max_retries=API_MAX_RETRIES):
+        self.state = state
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = count()
+
+    def _acquire(self, priority):
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    delay = None
+                    if self._queue[0] == ticket:
+                        delay = self.state.try_acquire()
+                        if delay <= 0:
+                            return
+                    self._cond.wait(timeout=delay)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def _observe(self, endpoint, outcome, attempt, queued, start):
+        # 每次尝试单独计时：排队等待（限速/优先级）与上游耗时分开统计
+        duration = time.perf_counter() - start
+        metrics.observe("spotify_api_queue_seconds", start - queued, endpoint=endpoint)
+        metrics.observe("spotify_api_request_duration_seconds", duration, endpoint=endpoint, outcome=outcome)
+        if outcome == "rate_limited":
+            metrics.inc("spotify_api_rate_limited_total", endpoint=endpoint)
+        record_span("api", endpoint, start, outcome=outcome, attempt=attempt, queued=start - queued)
+
+    def call(self, endpoint, func, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            self._acquire(priority)
+            start = time.perf_counter()
+            outcome = "ok"
+            try:
+                return func(*args, **kwargs)
+            except spotify_error() as e:
+                outcome = "rate_limited" if getattr(e, "http_status", None) == 429 else "error"
+                if outcome == "error" or attempt >= self.max_retries:
+                    raise
+                retry_after = retry_after_seconds(e)
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                self._observe(endpoint, outcome, attempt, queued, start)
+            # 冷却窗口全局生效；各调用者再叠加随机退避，避免冷却结束时一起重试
+            self.state.set_cooldown(time.time() + retry_after)
+            backoff = random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+            metrics.inc("spotify_api_retries_total", endpoint=endpoint)
+            logger.warning(
+                f"Rate limit hit on {endpoint}, cooldown {retry_after}s, backoff {backoff:.2f}s (attempt {attempt + 1}) [Type: API]",
+                extra={"endpoint": endpoint}
+            )
+            time.sleep(backoff)
+
+def create_rate_state():
+    backend = get_cache_backend()
+    if isinstance(backend, SQLiteCacheBackend):
+        try:
+            return SQLiteRateState(API_RATE_PER_SEC, API_BURST, backend.path)
+        except sqlite3.Error as e:
+            logger.error(f"Shared rate limit state unavailable: {str(e)}, using process-local state [Type: Config]")
+    return LocalRateState(API_RATE_PER_SEC, API_BURST)
+
+def create_request_scheduler():
+    return RequestScheduler(create_rate_state())
+
+get_request_scheduler = process_resource(create_request_scheduler)
+
+def api_call(endpoint, *args, priority=None, **kwargs):
+    if priority is None:
+        priority = request_priority.get()
+    return get_request_scheduler().call(endpoint, getattr(spotify_client(), endpoint), *args, priority=priority, **kwargs)
+
+# ==== 地区倒排索引 ==== #
+MARKET_INDEX_REBUILD_THRESHOLD = 1000  # 单次同步超过该条数时整体重建倒排位图
+
+class MarketIndex:
+    # 地区 -> 专辑槽位位图的倒排索引；专辑每次获取/刷新时增量更新，查询不产生 API 请求
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._slots = {}        # album_id -> 槽位
+        self._albums = []       # 槽位 -> {"id", "name", "artists", "market_bits", "updated_at"}
+        self._postings = [0] * len(MARKET_CODES)
+        self._all_slots = 0
+        self._synced_at = 0.0
+        if path:
+            self._connect().execute("""
+                CREATE TABLE IF NOT EXISTS album_markets (
+                    album_id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    artists TEXT NOT NULL,
+                    market_bits BLOB NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            self._connect().execute("CREATE INDEX IF NOT EXISTS idx_album_markets_updated ON album_markets (updated_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _apply(self, album_id, name, artists, market_bits, updated_at):
+        # 调用方持有 self._lock
+        slot = self._slots.get(album_id)
+        if slot is None:
+            slot = len(self._albums)
+            self._slots[album_id] = slot
+            self._albums.append(None)
+            self._all_slots |= 1 << slot
+            old_bits = 0
+        else:
+            old_bits = self._albums[slot]["market_bits"]
+        slot_bit = 1 << slot
+        for code in decode_markets(markets_diff(old_bits, market_bits)):
+            self._postings[MARKET_POSITIONS[code]] &= ~slot_bit
+        for code in decode_markets(markets_diff(market_bits, old_bits)):
+            self._postings[MARKET_POSITIONS[code]] |= slot_bit
+        self._albums[slot] = {
+            "id": album_id,
+            "name": name,
+            "artists": artists,
+            "market_bits": market_bits,
+            "updated_at": updated_at,
+        }
+
+    def _rebuild_postings(self):
+        # 调用方持有 self._lock；把每张专辑的地区位图转置成每个地区的专辑位图
+        width = len(MARKET_CODES)
+        rows = [format(album["market_bits"], f"0{width}b") for album in self._albums]
+        postings = [0] * width
+        if rows:
+            # 位串高位在前：第 i 列对应地区位置 width-1-i；列内按槽位倒序拼接得到专辑位图
+            for column, chars in enumerate(zip(*rows)):
+                postings[width - 1 - column] = int("".join(reversed(chars)), 2)
+        self._postings = postings
+
+    def record_albums(self, albums):
+        # albums 可以是原始 API 专辑（available_markets）或 AlbumRecord
+        updated_at = time.time()
+        entries = []
+        for album in albums:
+            if isinstance(album, AlbumRecord):
+                entries.append((album.id, album.name, ", ".join(album.artist_names()), album.market_bits, updated_at))
+                continue
+            if not album or not album.get('id'):
+                continue
+            artists = ", ".join(artist['name'] for artist in album.get('artists', []))
+            market_bits = encode_markets(album.get('available_markets', []))
+            entries.append((album['id'], album.get('name', ''), artists, market_bits, updated_at))
+        if not entries:
+            return
+        with self._lock:
+            for entry in entries:
+                self._apply(*entry)
+        if self.path:
+            try:
+                with sqlite_transaction(self._connect(), "DEFERRED") as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO album_markets (album_id, name, artists, market_bits, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        [(album_id, name, artists, markets_to_bytes(bits), ts) for album_id, name, artists, bits, ts in entries]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Market index write failed for {len(entries)} albums: {str(e)} [Type: Cache]")
+
+    def sync(self):
+        # 增量读取其他进程写入的记录
+        if not self.path:
+            return
+        try:
+            rows = self._connect().execute(
+                "SELECT album_id, name, artists, market_bits, updated_at FROM album_markets WHERE updated_at >= ? ORDER BY updated_at",
+                (self._synced_at,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Market index sync failed: {str(e)} [Type: Cache]")
+            return
+        if not rows:
+            return
+        with self._lock:
+            rebuild = len(rows) > MARKET_INDEX_REBUILD_THRESHOLD
+            for album_id, name, artists, market_bits, updated_at in rows:
+                self._synced_at = max(self._synced_at, updated_at)
+                slot = self._slots.get(album_id)
+                if slot is not None and self._albums[slot]["updated_at"] >= updated_at:
+                    continue
+                if not rebuild:
+                    self._apply(album_id, name, artists, markets_from_bytes(market_bits), updated_at)
+                    continue
+                if slot is None:
+                    slot = len(self._albums)
+                    self._slots[album_id] = slot
+                    self._albums.append(None)
+                    self._all_slots |= 1 << slot
+                self._albums[slot] = {
+                    "id": album_id,
+                    "name": name,
+                    "artists": artists,
+                    "market_bits": markets_from_bytes(market_bits),
+                    "updated_at": updated_at,
+                }
+            if rebuild:
+                self._rebuild_postings()
+
+    def _match_mask(self, available_in, unavailable_in):
+        # 调用方持有 self._lock
+        mask = self._all_slots
+        for code in available_in:
+            mask &= self._postings[MARKET_POSITIONS[code]] if code in MARKET_POSITIONS else 0
+        for code in unavailable_in:
+            if code in MARKET_POSITIONS:
+                mask &= ~self._postings[MARKET_POSITIONS[code]]
+        return mask
+
+    def query(self, available_in=(), unavailable_in=(), limit=None):
+        # 在 available_in 全部可用、且在 unavailable_in 全部不可用的专辑
+        self.sync()
+        with self._lock:
+            mask = self._match_mask(available_in, unavailable_in)
+            results = []
+            while mask and (limit is None or len(results) < limit):
+                low = mask & -mask
+                results.append(dict(self._albums[low.bit_length() - 1]))
+                mask ^= low
+        return results
+
+    def count(self, available_in=(), unavailable_in=()):
+        self.sync()
+        with self._lock:
+            return market_count(self._match_mask(available_in, unavailable_in))
+
+def create_market_index():
+    backend = get_cache_backend()
+    if isinstance(backend, SQLiteCacheBackend):
+        try:
+            return MarketIndex(backend.path)
+        except sqlite3.Error as e:
+            logger.error(f"Persistent market index unavailable: {str(e)}, using in-memory index [Type: Cache]")
+    return MarketIndex()
+
+get_market_index = process_resource(create_market_index)
+
+# ==== 并发抓取引擎 ==== #
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "8"))
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    # 任务在提交方的 contextvars 上下文中执行，工作线程内的调用计入同一请求追踪
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+# 线程池的工作线程在首次提交任务时才创建
+fetch_executor = ContextThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="spotify-fetch")
+
+CACHE_REFRESH_WORKERS = int(os.getenv("CACHE_REFRESH_WORKERS", "2"))
+
+# 过期条目的后台刷新；与 fetch_executor 分开，刷新任务内部的并发抓取不会占满自身线程池
+refresh_executor = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+
+def timed_call(timings, name, func, *args, **kwargs):
+    # 记录单次 API 调用耗时，timings 可在多个抓取线程间共享
+    start_time = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[name] = time.perf_counter() - start_time
+
+def format_timings(timings):
+    return ", ".join(f"{name}={elapsed:.2f}s" for name, elapsed in timings.items())
+
+# ==== 专辑记录 ==== #
+# 缓存中只保存页面与服务实际用到的字段；曲目按列打包序列化，地区位图定长拼接。
+# 序列化格式带版本号，格式变化时递增 ALBUM_RECORD_VERSION 并同步更新缓存命名空间
+ALBUM_RECORD_VERSION = 1
+
+class TrackRecord:
+    __slots__ = ("id", "name", "duration_ms", "popularity", "artists", "market_bits")
+
+    def __init__(self, id, name, duration_ms=0, popularity=0, artists=(), market_bits=None):
+        self.id = id
+        self.name = name
+        self.duration_ms = duration_ms
+        self.popularity = popularity
+        self.artists = artists          # 曲目艺人名称元组
+        self.market_bits = market_bits  # 没有曲目详情时为 None
+
+    @classmethod
+    def from_api(cls, track, detail=None):
+        # detail 为 tracks 接口返回的完整曲目，带流行度与地区列表
+        return cls(
+            track.get('id'),
+            track.get('name', 'Unknown Track'),
+            track.get('duration_ms', 0),
+            detail.get('popularity', 0) if detail else 0,
+            tuple(artist['name'] for artist in (detail or track).get('artists', [])),
+            encode_markets(detail.get('available_markets') or []) if detail else None,
+        )
+
+class AlbumRecord:
+    __slots__ = (
+        "id", "name", "artists", "release_date", "album_type", "popularity", "image_url", "spotify_url",
+        "genres", "artist_followers", "artist_url", "tracks", "market_bits",
+    )
+
+    def __init__(self, id, name, artists=(), release_date="", album_type="", popularity=0, image_url="",
+                 spotify_url="", genres=(), artist_followers=0, artist_url="", tracks=None, market_bits=0):
+        self.id = id
+        self.name = name
+        self.artists = artists  # (艺人 ID, 名称) 元组
+        self.release_date = release_date
+        self.album_type = album_type
+        self.popularity = popularity
+        self.image_url = image_url
+        self.spotify_url = spotify_url
+        self.genres = genres
+        self.artist_followers = artist_followers
+        self.artist_url = artist_url
+        self.tracks = tracks if tracks is not None else []
+        self.market_bits = market_bits
+
+    @classmethod
+    def from_api(cls, album):
+        images = album.get('images') or []
+        return cls(
+            album['id'],
+            album.get('name', ''),
+            tuple((artist.get('id'), artist.get('name', '')) for artist in album.get('artists', [])),
+            album.get('release_date', ''),
+            album.get('album_type', ''),
+            album.get('popularity', 0),
+            images[0]['url'] if images else '',
+            album.get('external_urls', {}).get('spotify', ''),
+        )
+
+    def artist_names(self):
+        return tuple(name for _, name in self.artists)
+
+    def add_tracks(self, tracks):
+        # 与专辑艺人相同的曲目共用同一个元组
+        names = self.artist_names()
+        for track in tracks:
+            if track.artists == names:
+                track.artists = names
+        self.tracks.extend(tracks)
+
+    def __reduce__(self):
+        return load_album_record, (self.to_state(),)
+
+    def to_state(self):
+        tracks = self.tracks
+        names = self.artist_names()
+        return (
+            ALBUM_RECORD_VERSION, self.id, self.name, self.artists, self.release_date, self.album_type,
+            self.popularity, self.image_url, self.spotify_url, tuple(self.genres), self.artist_followers,
+            self.artist_url, self.market_bits,
+            tuple(track.id for track in tracks),
+            tuple(track.name for track in tracks),
+            struct.pack(f"<{len(tracks)}I", *(track.duration_ms for track in tracks)),
+            bytes(min(max(track.popularity, 0), 255) for track in tracks),
+            # 与专辑艺人相同时记为 None
+            tuple(None if track.artists == names else track.artists for track in tracks),
+            bytes(track.market_bits is not None for track in tracks),
+            b"".join(markets_to_bytes(track.market_bits or 0) for track in tracks),
+        )
+
+def load_album_record(state):
+    if state[0] != ALBUM_RECORD_VERSION:
+        raise ValueError(f"Unsupported album record version {state[0]}")
+    (_, album_id, name, artists, release_date, album_type, popularity, image_url, spotify_url, genres,
+     artist_followers, artist_url, market_bits, track_ids, track_names, durations, popularities,
+     track_artists, known, markets) = state
+    album = AlbumRecord(
+        album_id, name, artists, release_date, album_type, popularity, image_url, spotify_url,
+        genres, artist_followers, artist_url, [], market_bits,
+    )
+    names = album.artist_names()
+    width = MARKET_BITMAP_BYTES
+    album.tracks = [
+        TrackRecord(
+            track_ids[i], track_names[i], duration, popularities[i],
+            names if track_artists[i] is None else track_artists[i],
+            markets_from_bytes(markets[i * width:(i + 1) * width]) if known[i] else None,
+        )
+        for i, duration in enumerate(struct.unpack(f"<{len(track_ids)}I", durations))
+    ]
+    return album
+
+# ==== 大专辑曲目加载 ==== #
+ALBUM_TRACKS_PAGE_SIZE = 50  # album_tracks 单页上限
+TRACKS_BATCH_SIZE = 50       # tracks 单次最多 50 个 ID
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def fetch_track_page(album_id, page, offset, timings):
+    # 单页任务：需要时先拉取该页，再补全曲目详情；单页不超过 50 首，正好是一个满批次
+    if page is None:
+        page = timed_call(
+            timings, f"album_tracks@{offset}",
+            api_call, "album_tracks", album_id, limit=ALBUM_TRACKS_PAGE_SIZE, offset=offset
+        )
+    tracks = page.get('items', [])
+    details_by_id = {}
+    track_ids = [track['id'] for track in tracks if track.get('id')]
+    for batch_no, batch in enumerate(chunked(track_ids, TRACKS_BATCH_SIZE)):
+        name = f"tracks@{offset + batch_no * TRACKS_BATCH_SIZE}"
+        for detail in timed_call(timings, name, api_call, "tracks", batch).get('tracks', []):
+            if detail and detail.get('id'):
+                details_by_id[detail['id']] = detail
+    # 按曲目 ID 合并，而非依赖列表位置；曲目详情自带地区列表，顺带保存为位图，逐曲目比对无需额外请求
+    return [TrackRecord.from_api(track, details_by_id.get(track.get('id'))) for track in tracks]
+
+def album_track_page_offsets(first_page):
+    total = first_page.get('total', 0)
+    next_offset = first_page.get('offset', 0) + (first_page.get('limit') or ALBUM_TRACKS_PAGE_SIZE)
+    return list(range(next_offset, total, ALBUM_TRACKS_PAGE_SIZE))
+
+def submit_album_track_pages(album_id, first_page, timings):
+    # 首页随专辑一起返回；total 已知，所有分页任务在调用时即一次性提交，返回按页顺序排列的 future
+    page_futures = [fetch_executor.submit(fetch_track_page, album_id, first_page, first_page.get('offset', 0), timings)]
+    page_futures += [
+        fetch_executor.submit(fetch_track_page, album_id, None, offset, timings)
+        for offset in album_track_page_offsets(first_page)
+    ]
+    return page_futures
+
+def stream_album_data(album_id):
+    # 分阶段产出 (stage, payload, progress)：album -> artist -> tracks（逐页）-> markets -> done
+    # progress 为已完成的上游步骤比例；最后的 done 携带完整专辑数据
+    if not album_id or not isinstance(album_id, str):
+        logger.warning("无效专辑ID [Type: Input]")
+        raise ValueError("无效的专辑ID")
+    try:
+        start_time = time.perf_counter()
+        timings = {}
+        # 第一轮：专辑本体（已包含首页曲目）
+        response = timed_call(timings, "album", api_call, "album", album_id)
+        first_page = response.get('tracks') or {}
+        markets = response.get('available_markets') or []
+        # 原始响应只在这里读取一次，之后只保留精简记录
+        album = AlbumRecord.from_api(response)
+        # 第二轮起：艺人信息、剩余分页与曲目详情只依赖专辑响应，并发获取
+        artist_future = None
+        if album.artists:
+            artist_future = fetch_executor.submit(timed_call, timings, "artist", api_call, "artist", album.artists[0][0])
+        total_steps = 3 + (1 if artist_future else 0) + len(album_track_page_offsets(first_page))
+        done_steps = 1
+        # 分页任务须在等待艺人结果之前提交，否则两者退化为先后两轮
+        page_futures = submit_album_track_pages(album_id, first_page, timings)
+        yield "album", album, done_steps / total_steps
+        if artist_future:
+            artist = artist_future.result()
+            album.genres = tuple(artist.get('genres', []))
+            album.artist_followers = artist.get('followers', {}).get('total', 0)
+            album.artist_url = artist.get('external_urls', {}).get('spotify', '')
+            done_steps += 1
+            yield "artist", album, done_steps / total_steps
+        # 只有产出顺序是串行的：先艺人，再按页顺序逐页产出
+        for future in page_futures:
+            tracks = future.result()
+            album.add_tracks(tracks)
+            done_steps += 1
+            yield "tracks", tracks, done_steps / total_steps
+        # 专辑无地区信息时取所有曲目地区的并集，个别曲目受限的地区仍可在逐曲目视图中看到
+        album.market_bits = encode_markets(markets)
+        if not album.market_bits:
+            album.market_bits = markets_union(track.market_bits or 0 for track in album.tracks)
+        done_steps += 1
+        yield "markets", album.market_bits, done_steps / total_steps
+        get_market_index().record_albums([album])
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"Fetched album {album_id} in {elapsed:.2f}s ({format_timings(timings)}) [Type: API]",
+            extra={"album_id": album_id, "latency": elapsed, "api_calls": len(timings)}
+        )
+        yield "done", album, 1.0
+    except spotify_error() as e:
+        logger.error(f"Spotify API error for album {album_id}: {str(e)} [Type: API]", exc_info=True, extra={"album_id": album_id})
+        raise Exception("Spotify API错误")
+    except Exception as e:
+        logger.error(f"Failed to fetch album data for {album_id}: {str(e)} [Type: General]", exc_info=True, extra={"album_id": album_id})
+        raise Exception("获取专辑数据失败")
+
+@cached("album:v4", key=lambda album_id: str(album_id))
+def get_album_data(album_id):
+    album = None
+    for stage, payload, _ in stream_album_data(album_id):
+        if stage == "done":
+            album = payload
+    return album
+
+# ==== 曲目地区差异 ==== #
+def track_market_gaps(album):
+    # 曲目 × 地区缺失矩阵：专辑可用但曲目不可用的地区为 True；
+    # 位图整体展开为 numpy 位矩阵后一次性运算，只保留存在缺失的曲目行与地区列
+    import numpy as np
+    width = len(MARKET_CODES)
+    rows = [(i, track) for i, track in enumerate(album.tracks, 1) if track.market_bits is not None]
+    packed = np.frombuffer(
+        b"".join(markets_to_bytes(track.market_bits) for _, track in rows), dtype=np.uint8
+    ).reshape(len(rows), MARKET_BITMAP_BYTES)
+    available = np.unpackbits(packed, axis=1, bitorder="little")[:, :width].astype(bool)
+    album_row = np.unpackbits(
+        np.frombuffer(markets_to_bytes(album.market_bits), dtype=np.uint8), bitorder="little"
+    )[:width].astype(bool)
+    missing = album_row & ~available
+    track_mask = missing.any(axis=1)
+    market_mask = missing.any(axis=0)
+    return {
+        "tracks": [(i, track.name) for (i, track), gap in zip(rows, track_mask) if gap],
+        "markets": [code for code, gap in zip(MARKET_CODES, market_mask) if gap],
+        "missing": missing[track_mask][:, market_mask],
+        "checked": len(rows),
+    }
+
+# ==== 搜索 ==== #
+SEARCH_PREFIX_CACHE_SIZE = 512
+
+def normalize_query(query):
+    # 大小写、首尾及连续空白不影响搜索结果，统一后作为缓存键
+    if not isinstance(query, str):
+        return ""
+    return " ".join(query.split()).casefold()
+
+def search_haystack(item):
+    names = [item.get('name', '')] + [artist.get('name', '') for artist in item.get('artists', [])]
+    return " ".join(names).casefold()
+
+class SearchPrefixCache:
+    # 进程内前缀感知缓存：某个前缀的结果若已是完整结果集（total 未超过 limit），
+    # 更长的查询可直接在本地过滤得出，边输入边搜索时无需重复请求
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def put(self, query, limit, albums, artists, complete):
+        with self._lock:
+            self._entries[query] = (limit, albums, artists, complete)
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, query, limit):
+        tokens = query.split()
+        with self._lock:
+            for end in range(len(query) - 1, 0, -1):
+                entry = self._entries.get(query[:end])
+                if not entry:
+                    continue
+                entry_limit, albums, artists, complete = entry
+                if not complete or entry_limit < limit:
+                    continue
+                self._entries.move_to_end(query[:end])
+                albums = [a for a in albums if all(t in search_haystack(a) for t in tokens)][:limit]
+                artists = [a for a in artists if all(t in a.get('name', '').casefold() for t in tokens)][:limit]
+                # 本地过滤为空时不能断定无结果（上游是模糊匹配），交回上游
+                return (albums, artists) if albums or artists else None
+        return None
+
+search_prefix_cache = SearchPrefixCache(SEARCH_PREFIX_CACHE_SIZE)
+
+@cached("search:v2", key=lambda query, limit=10: f"{limit}:{normalize_query(query)}")
+def search_albums(query, limit=10):
+    query = normalize_query(query)
+    if not query:
+        logger.warning("无效的搜索关键词 [Type: Input]")
+        return [], []
+    local = search_prefix_cache.lookup(query, limit)
+    if local:
+        logger.info(f"Search served from prefix cache for query: {query} [Type: Cache]", extra={"query": query})
+        return local
+    try:
+        # 专辑与艺人合并为一次请求
+        results = api_call("search", q=query, type='album,artist', limit=limit)
+        album_page = results.get('albums') or {}
+        artist_page = results.get('artists') or {}
+        albums = album_page.get('items', [])
+        artists = artist_page.get('items', [])
+        complete = album_page.get('total', 0) <= len(albums) and artist_page.get('total', 0) <= len(artists)
+        search_prefix_cache.put(query, limit, albums, artists, complete)
+        logger.info(f"Search successful for query: {query} [Type: API]", extra={"query": query, "endpoint": "search"})
+        return albums, artists
+    except spotify_error() as e:
+        logger.error(f"Spotify API error for search {query}: {str(e)} [Type: API]", exc_info=True, extra={"query": query})
+        raise Exception("Spotify API错误")
+    except Exception as e:
+        logger.error(f"Search failed for {query}: {str(e)} [Type: General]", exc_info=True, extra={"query": query})
+        return [], []
+
+# ==== 艺人专辑 ==== #
+ARTIST_ALBUMS_PAGE_SIZE = 50  # artist_albums 单页上限
+
+@cached("artist_albums", key=lambda artist_id: str(artist_id))
+def get_artist_albums(artist_id):
+    # 首页给出 total，其余分页按 offset 并发拉取，完整覆盖多产艺人的作品集
+    start_time = time.perf_counter()
+    first_page = api_call("artist_albums", artist_id=artist_id, album_type="album,single", limit=ARTIST_ALBUMS_PAGE_SIZE)
+    page_futures = [
+        fetch_executor.submit(
+            api_call, "artist_albums", artist_id=artist_id, album_type="album,single",
+            limit=ARTIST_ALBUMS_PAGE_SIZE, offset=offset
+        )
+        for offset in range(ARTIST_ALBUMS_PAGE_SIZE, first_page.get('total', 0), ARTIST_ALBUMS_PAGE_SIZE)
+    ]
+    albums = []
+    seen = set()
+    for page in [first_page] + [future.result() for future in page_futures]:
+        for item in page['items']:
+            if item['id'] not in seen:
+                albums.append(item)
+                seen.add(item['id'])
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Fetched {len(albums)} albums for artist {artist_id} in {elapsed:.2f}s [Type: API]",
+        extra={"artist_id": artist_id, "latency": elapsed, "api_calls": 1 + len(page_futures)}
+    )
+    return albums
+
+# ==== 批量地区查询（命令行） ==== #
+ALBUMS_BATCH_SIZE = 20  # albums 接口单次最多 20 个 ID
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", "4"))
+ALBUM_ID_PATTERN = re.compile(r"^[A-Za-z0-9]{22}$")
+BATCH_FIELDS = ["album_id", "name", "market_count", "markets", "error"]
+
+def parse_album_ref(line):
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    return extract_album_id(line) or (line if ALBUM_ID_PATTERN.match(line) else None)
+
+def iter_album_ids(lines):
+    for line_no, line in enumerate(lines, 1):
+        album_id = parse_album_ref(line)
+        if album_id:
+            yield album_id
+        elif line.strip() and not line.strip().startswith("#"):
+            logger.warning(f"Skipping invalid album reference on line {line_no}: {line.strip()} [Type: Input]")
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def fetch_albums_batch(album_ids, priority=PRIORITY_BATCH):
+    return api_call("albums", album_ids, priority=priority).get('albums', [])
+
+def album_region_row(album_id, album, error=""):
+    markets = sorted(decode_markets(encode_markets(album.get('available_markets', [])))) if album else []
+    return {
+        "album_id": album_id,
+        "name": album.get('name', '') if album else '',
+        "market_count": len(markets),
+        "markets": markets,
+        "error": error if album or error else "not_found",
+    }
+
+def fetch_region_rows(album_ids):
+    try:
+        albums = fetch_albums_batch(album_ids)
+    except Exception as e:
+        if getattr(e, "http_status", None) in (400, 404):
+            # 上游因个别无效 ID 拒绝整批时二分重试，只把无效的专辑记为未找到
+            if len(album_ids) == 1:
+                return [album_region_row(album_ids[0], None)]
+            mid = len(album_ids) // 2
+            return fetch_region_rows(album_ids[:mid]) + fetch_region_rows(album_ids[mid:])
+        logger.error(f"Album batch failed ({len(album_ids)} ids): {str(e)} [Type: API]")
+        return [album_region_row(album_id, None, error=str(e).splitlines()[0] or "error") for album_id in album_ids]
+    by_id = {album['id']: album for album in albums if album}
+    get_market_index().record_albums(by_id.values())
+    return [album_region_row(album_id, by_id.get(album_id)) for album_id in album_ids]
+
+def iter_region_rows(album_ids, batch_size=ALBUMS_BATCH_SIZE, max_in_flight=BATCH_MAX_IN_FLIGHT):
+    # 同时在途的批次数受限，输入按需读取，内存占用与输入规模无关
+    with ContextThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="spotify-batch") as pool:
+        pending = set()
+        for batch in iter_chunks(album_ids, batch_size):
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(pool.submit(fetch_region_rows, batch))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+def write_region_rows(rows, out, fmt):
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=BATCH_FIELDS)
+        writer.writeheader()
+    for row in rows:
+        if fmt == "csv":
+            writer.writerow(dict(row, markets=" ".join(row["markets"])))
+        else:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+        if count % ALBUMS_BATCH_SIZE == 0:
+            out.flush()
+    out.flush()
+    return count
+
+def run_batch_cli(argv):
+    parser = argparse.ArgumentParser(
+        prog="SpotifyRegionChecker batch",
+        description="批量查询专辑可用地区 / Bulk album region check"
+    )
+    parser.add_argument("input", nargs="?", default="-", help="每行一个专辑链接或 ID 的文件，缺省或 - 时读取 stdin")
+    parser.add_argument("-o", "--output", default="-", help="输出文件，缺省或 - 时写到 stdout")
+    parser.add_argument("-f", "--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_MAX_IN_FLIGHT, help="同时在途的批次数")
+    args = parser.parse_args(argv)
+
+    infile = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    start_time = time.time()
+    try:
+        rows = iter_region_rows(iter_album_ids(infile), max_in_flight=max(1, args.concurrency))
+        count = write_region_rows(rows, outfile, args.format)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    elapsed = time.time() - start_time
+    logger.info(f"Batch region check finished: {count} albums in {elapsed:.2f}s [Type: Batch]", extra={"latency": elapsed})
+    return 0
+
+# ==== 艺人专辑地区矩阵 ==== #
+@cached("artist_matrix:v2", key=lambda artist_id: str(artist_id))
+def get_artist_market_matrix(artist_id):
+    # 专辑 × 地区可用性矩阵：专辑详情按 20 个一批并发获取
+    start_time = time.perf_counter()
+    albums = get_artist_albums(artist_id)
+    batch_futures = [
+        fetch_executor.submit(fetch_albums_batch, [album['id'] for album in batch], PRIORITY_INTERACTIVE)
+        for batch in chunked(albums, ALBUMS_BATCH_SIZE)
+    ]
+    details_by_id = {}
+    for future in batch_futures:
+        for album in future.result():
+            if album:
+                details_by_id[album['id']] = album
+    get_market_index().record_albums(details_by_id.values())
+    rows = []
+    for album in albums:
+        rows.append({
+            "id": album['id'],
+            "name": album['name'],
+            "release_date": album.get('release_date', ''),
+            "market_bits": encode_markets((details_by_id.get(album['id']) or {}).get('available_markets', [])),
+        })
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Built market matrix for artist {artist_id}: {len(rows)} albums in {elapsed:.2f}s [Type: API]",
+        extra={"artist_id": artist_id, "latency": elapsed}
+    )
+    return {"albums": rows, "market_bits": markets_union(row["market_bits"] for row in rows)}
+
+def market_matrix_frame(matrix, album_label, count_label):
+    import pandas as pd
+    markets = sorted(decode_markets(matrix["market_bits"]))
+    index = [f"{row['name']} ({row['release_date'][:4]})" for row in matrix["albums"]]
+    data = [[has_market(row["market_bits"], code) for code in markets] for row in matrix["albums"]]
+    frame = pd.DataFrame(data, index=pd.Index(index, name=album_label), columns=markets)
+    frame.insert(0, count_label, [market_count(row["market_bits"]) for row in matrix["albums"]])
+    return frame
+
+# ==== 地区变更监控 ==== #
+WATCH_DB_PATH = os.getenv("WATCH_DB_PATH", CACHE_DB_PATH)
+WATCH_REFRESH_INTERVAL = int(os.getenv("WATCH_REFRESH_INTERVAL", "900"))  # 秒，0 表示关闭后台刷新
+WATCH_API_BUDGET = int(os.getenv("WATCH_API_BUDGET", "10"))               # 每轮最多调用 albums 接口的次数
+WATCH_MIN_INTERVAL = int(os.getenv("WATCH_MIN_INTERVAL", "3600"))         # 同一专辑两次检查的最短间隔
+WATCH_CHANGE_WEIGHT = 4.0  # 历史变更频率对刷新优先级的加权
+
+class WatchList:
+    # 监控列表：每张专辑只保存最新地区快照，历史以增量（新增/下架地区）形式记录
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS watched_albums (
+                album_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                market_bits BLOB NOT NULL,
+                added_at REAL NOT NULL,
+                last_checked REAL NOT NULL,
+                last_changed REAL,
+                check_count INTEGER NOT NULL DEFAULT 0,
+                change_count INTEGER NOT NULL DEFAULT 0
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS market_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                album_id TEXT NOT NULL,
+                changed_at REAL NOT NULL,
+                added BLOB NOT NULL,
+                removed BLOB NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_market_changes_album ON market_changes (album_id, id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS watch_lease (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def __contains__(self, album_id):
+        return self._connect().execute(
+            "SELECT 1 FROM watched_albums WHERE album_id = ?", (album_id,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM watched_albums").fetchone()[0]
+
+    def add(self, album_id, name, market_bits):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR IGNORE INTO watched_albums (album_id, name, market_bits, added_at, last_checked) VALUES (?, ?, ?, ?, ?)",
+            (album_id, name, markets_to_bytes(market_bits), now, now)
+        )
+
+    def remove(self, album_id):
+        self._connect().execute("DELETE FROM watched_albums WHERE album_id = ?", (album_id,))
+
+    def record_snapshot(self, album_id, market_bits, name=None):
+        # 与上次快照比较，只在地区发生变化时写入增量；返回是否有变化
+        now = time.time()
+        with sqlite_transaction(self._connect()) as conn:
+            row = conn.execute("SELECT market_bits FROM watched_albums WHERE album_id = ?", (album_id,)).fetchone()
+            if row is None:
+                return False
+            old_bits = markets_from_bytes(row[0])
+            changed = old_bits != market_bits
+            if changed:
+                conn.execute(
+                    "INSERT INTO market_changes (album_id, changed_at, added, removed) VALUES (?, ?, ?, ?)",
+                    (album_id, now,
+                     markets_to_bytes(markets_diff(market_bits, old_bits)),
+                     markets_to_bytes(markets_diff(old_bits, market_bits)))
+                )
+            conn.execute(
+                """UPDATE watched_albums SET
+                       market_bits = ?, name = COALESCE(?, name), last_checked = ?,
+                       check_count = check_count + 1,
+                       change_count = change_count + ?,
+                       last_changed = CASE WHEN ? THEN ? ELSE last_changed END
+                   WHERE album_id = ?""",
+                (markets_to_bytes(market_bits), name, now, int(changed), int(changed), now, album_id)
+            )
+            return changed
+
+    def mark_checked(self, album_id):
+        self._connect().execute(
+            "UPDATE watched_albums SET last_checked = ?, check_count = check_count + 1 WHERE album_id = ?",
+            (time.time(), album_id)
+        )
+
+    def due_albums(self, limit, min_interval=WATCH_MIN_INTERVAL):
+        # 优先级 = 距上次检查的时长 × (1 + 权重 × 历史变更频率)
+        now = time.time()
+        rows = self._connect().execute(
+            """SELECT album_id FROM watched_albums
+               WHERE last_checked <= ?
+               ORDER BY (? - last_checked) * (1.0 + ? * change_count * 1.0 / MAX(check_count, 1)) DESC
+               LIMIT ?""",
+            (now - min_interval, now, WATCH_CHANGE_WEIGHT, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def changes(self, album_id=None, since=None, after_id=None, limit=100):
+        clauses, params = [], []
+        if album_id:
+            clauses.append("c.album_id = ?")
+            params.append(album_id)
+        if since is not None:
+            clauses.append("c.changed_at >= ?")
+            params.append(since)
+        if after_id is not None:
+            clauses.append("c.id > ?")
+            params.append(after_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"""SELECT c.id, c.album_id, COALESCE(w.name, ''), c.changed_at, c.added, c.removed
+                FROM market_changes c LEFT JOIN watched_albums w ON w.album_id = c.album_id
+                {where} ORDER BY c.id DESC LIMIT ?""",
+            params + [limit]
+        ).fetchall()
+        return [
+            {
+                "id": change_id,
+                "album_id": change_album_id,
+                "name": name,
+                "changed_at": changed_at,
+                "added": decode_markets(markets_from_bytes(added)),
+                "removed": decode_markets(markets_from_bytes(removed)),
+            }
+            for change_id, change_album_id, name, changed_at, added, removed in rows
+        ]
+
+    def acquire_lease(self, holder, ttl, name="refresher"):
+        # 同机多个进程中只有持有租约的一个执行刷新
+        now = time.time()
+        with sqlite_transaction(self._connect()) as conn:
+            row = conn.execute("SELECT holder, expires_at FROM watch_lease WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO watch_lease (name, holder, expires_at) VALUES (?, ?, ?)",
+                (name, holder, now + ttl)
+            )
+            return True
+
+def create_watch_list():
+    return WatchList(WATCH_DB_PATH)
+
+get_watch_list = process_resource(create_watch_list)
+
+def watch_albums(album_ids, priority=PRIORITY_BATCH):
+    # 加入监控并记录基线快照
+    added = 0
+    for batch in iter_chunks(album_ids, ALBUMS_BATCH_SIZE):
+        albums = [album for album in fetch_albums_batch(batch, priority) if album]
+        for album in albums:
+            get_watch_list().add(album['id'], album.get('name', ''), encode_markets(album.get('available_markets', [])))
+        get_market_index().record_albums(albums)
+        added += len(albums)
+    return added
+
+def refresh_watched_albums(api_budget=WATCH_API_BUDGET, min_interval=WATCH_MIN_INTERVAL):
+    # 在固定的 API 调用预算内，按优先级重新检查一轮监控专辑
+    start_time = time.perf_counter()
+    watch_list = get_watch_list()
+    album_ids = watch_list.due_albums(api_budget * ALBUMS_BATCH_SIZE, min_interval)
+    checked = changed = calls = failed = 0
+    for batch in chunked(album_ids, ALBUMS_BATCH_SIZE):
+        if calls >= api_budget:
+            break
+        # 失败的调用同样消耗预算；失败批次的专辑不标记为已检查，下一轮仍会优先刷新
+        calls += 1
+        try:
+            albums = fetch_albums_batch(batch, PRIORITY_BATCH)
+        except Exception as e:
+            failed += 1
+            logger.error(f"Watch refresh batch of {len(batch)} albums from {batch[0]} failed: {str(e)} [Type: Watch]")
+            if getattr(e, "http_status", None) == 429:
+                # 调度器的限流重试已用尽，本轮剩余批次留到冷却之后
+                break
+            continue
+        by_id = {album['id']: album for album in albums if album}
+        for album_id in batch:
+            album = by_id.get(album_id)
+            checked += 1
+            if album is None:
+                watch_list.mark_checked(album_id)
+            elif watch_list.record_snapshot(album_id, encode_markets(album.get('available_markets', [])), album.get('name')):
+                changed += 1
+                # 地区已变化，丢弃该专辑的页面缓存
+                get_album_data.invalidate(album_id)
+        get_market_index().record_albums(by_id.values())
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Watch refresh: {checked} checked, {changed} changed, {failed} failed batches, {calls} API calls in {elapsed:.2f}s [Type: Watch]",
+        extra={"latency": elapsed, "api_calls": calls}
+    )
+    return {"checked": checked, "changed": changed, "failed_batches": failed, "api_calls": calls}
+
+class WatchRefresher(threading.Thread):
+    def __init__(self, interval, api_budget):
+        super().__init__(name="watch-refresher", daemon=True)
+        self.interval = interval
+        self.api_budget = api_budget
+        self.holder = f"{os.getpid()}-{id(self)}"
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                if get_watch_list().acquire_lease(self.holder, self.interval * 2):
+                    refresh_watched_albums(self.api_budget)
+            except Exception as e:
+                logger.error(f"Watch refresher cycle failed: {str(e)} [Type: Watch]", exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+
+@process_resource
+def start_watch_refresher():
+    # 每个进程只启动一个后台刷新线程
+    if WATCH_REFRESH_INTERVAL <= 0:
+        return None
+    refresher = WatchRefresher(WATCH_REFRESH_INTERVAL, WATCH_API_BUDGET)
+    refresher.start()
+    logger.info(f"Watch refresher started, every {WATCH_REFRESH_INTERVAL}s with budget {WATCH_API_BUDGET} calls [Type: Watch]")
+    return refresher
+
+def run_watch_cli(argv):
+    parser = argparse.ArgumentParser(
+        prog="SpotifyRegionChecker watch",
+        description="专辑地区变更监控 / Album market change tracking"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="加入监控（每行一个专辑链接或 ID）")
+    add_parser.add_argument("input", nargs="?", default="-", help="输入文件，缺省或 - 时读取 stdin")
+    remove_parser = commands.add_parser("remove", help="取消监控")
+    remove_parser.add_argument("album_ids", nargs="+")
+    refresh_parser = commands.add_parser("refresh", help="执行一轮刷新")
+    refresh_parser.add_argument("--budget", type=int, default=WATCH_API_BUDGET, help="本轮最多调用 albums 接口的次数")
+    refresh_parser.add_argument("--min-interval", type=int, default=WATCH_MIN_INTERVAL, help="跳过在该秒数内检查过的专辑")
+    changes_parser = commands.add_parser("changes", help="以 JSONL 输出变更记录")
+    changes_parser.add_argument("--album")
+    changes_parser.add_argument("--after-id", type=int)
+    changes_parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.command == "add":
+        infile = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        try:
+            added = watch_albums(iter_album_ids(infile))
+        finally:
+            if infile is not sys.stdin:
+                infile.close()
+        logger.info(f"Watching {added} new albums, {len(get_watch_list())} in total [Type: Watch]")
+    elif args.command == "remove":
+        for album_id in args.album_ids:
+            get_watch_list().remove(parse_album_ref(album_id) or album_id)
+    elif args.command == "refresh":
+        print(json.dumps(refresh_watched_albums(args.budget, args.min_interval)))
+    elif args.command == "changes":
+        for change in get_watch_list().changes(album_id=args.album, after_id=args.after_id, limit=args.limit):
+            print(json.dumps(change, ensure_ascii=False))
+    return 0
+
+# ==== 启动预热 ==== #
+PREWARM_ALBUMS = os.getenv("PREWARM_ALBUMS", "")  # 逗号或空白分隔的专辑链接/ID，启动后在后台预先缓存
+
+def prewarm_albums(refs):
+    # 以批量优先级逐张抓取，已缓存的跳过，不与页面请求争抢
+    request_priority.set(PRIORITY_BATCH)
+    start_time = time.perf_counter()
+    warmed = 0
+    for album_id in iter_album_ids(refs):
+        if get_album_data.lookup(album_id)[0]:
+            continue
+        try:
+            get_album_data(album_id)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Prewarm failed for album {album_id}: {str(e)} [Type: Cache]", extra={"album_id": album_id})
+    logger.info(f"Prewarmed {warmed} albums in {time.perf_counter() - start_time:.2f}s [Type: Cache]")
+
+@process_resource
+def start_prewarm():
+    refs = PREWARM_ALBUMS.replace(",", " ").split()
+    if not refs or not has_credentials():
+        return None
+    thread = threading.Thread(target=prewarm_albums, args=(refs,), name="cache-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def run_cli(argv):
+    # 命令行入口：batch 批量查询 / watch 地区变更监控
+    if not argv or argv[0] not in ("batch", "watch"):
+        print("usage: region_core.py {batch,watch} ...", file=sys.stderr)
+        return 2
+    run = run_batch_cli if argv[0] == "batch" else run_watch_cli
+    if "-h" in argv or "--help" in argv:
+        # 只打印用法：不初始化日志、不检查凭证
+        return run(argv[1:])
+    # 命令行模式下 stdout 留给结果输出，控制台日志写到 stderr
+    setup_logging(sys.stderr)
+    if not has_credentials():
+        logger.error("❌ 缺少Spotify API凭证，程序终止 [Type: Config]")
+        return 2
+    exporters = start_metrics_exporter()
+    try:
+        return run(argv[1:])
+    finally:
+        # 命令行任务往往短于快照间隔，退出前补写一次
+        for exporter in exporters:
+            if isinstance(exporter, MetricsSnapshotWriter):
+                exporter.write()
+
+if __name__ == "__main__":
+    sys.exit(run_cli(sys.argv[1:]))
@@ -0,0 +1,390 @@
+import asyncio
+import argparse
+import functools
+import json
+import os
+import re
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from region_core import (
+    logger, setup_logging, metrics, has_credentials, decode_markets, markets_diff, market_count, MARKET_POSITIONS,
+    parse_album_ref, album_region_row, iter_region_rows, get_market_index, get_album_data, search_albums,
+    get_artist_albums, get_artist_market_matrix, start_watch_refresher, start_prewarm
+)
+
+# ==== 地区查询 HTTP 服务 ==== #
+# 单个事件循环负责所有连接的读写；缓存读取与上游抓取在线程池中执行，不阻塞事件循环。
+# 与页面共用核心模块的缓存、请求合并与调度器，缓存命中时只需一次本地查询
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "32"))       # 同时执行的请求数，超出的在事件循环中排队
+SERVICE_MAX_BATCH = int(os.getenv("SERVICE_MAX_BATCH", "1000"))  # 单次批量查询的专辑数上限
+SERVICE_MAX_BODY = 1024 * 1024
+SERVICE_MAX_HEADERS = 100
+SERVICE_KEEPALIVE_TIMEOUT = 30  # 秒，空闲长连接的保持时间
+SEARCH_MAX_LIMIT = 50
+ARTIST_ID_PATTERN = re.compile(r"^[A-Za-z0-9]{1,64}$")
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 414: "URI Too Long", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 501: "Not Implemented", 502: "Bad Gateway",
+}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def cache_info(meta):
+    return {"stale": meta["stale"], "age": round(meta["age"], 1)}
+
+def artist_refs(artists):
+    return [{"id": artist.get('id'), "name": artist.get('name', '')} for artist in artists or []]
+
+def album_payload(album, meta, with_tracks):
+    market_bits = album.market_bits
+    payload = {
+        "id": album.id,
+        "name": album.name,
+        "artists": [{"id": artist_id, "name": name} for artist_id, name in album.artists],
+        "release_date": album.release_date,
+        "album_type": album.album_type,
+        "popularity": album.popularity,
+        "total_tracks": len(album.tracks),
+        "market_count": market_count(market_bits),
+        "markets": sorted(decode_markets(market_bits)),
+        "cache": cache_info(meta),
+    }
+    if with_tracks:
+        # 只列出缺失地区；没有曲目地区数据时为 null
+        payload["tracks"] = [
+            {
+                "id": track.id,
+                "name": track.name,
+                "missing_markets": (
+                    sorted(decode_markets(markets_diff(market_bits, track.market_bits)))
+                    if track.market_bits is not None else None
+                ),
+            }
+            for track in album.tracks
+        ]
+    return payload
+
+def query_flag(params, name):
+    return params.get(name, [""])[0].lower() in ("1", "true", "yes")
+
+def query_codes(params, name):
+    codes = [code.strip().upper() for value in params.get(name, []) for code in value.split(",") if code.strip()]
+    unknown = [code for code in codes if code not in MARKET_POSITIONS]
+    if unknown:
+        raise HttpError(400, f"unknown market codes: {', '.join(unknown)}")
+    return codes
+
+def upstream_status(e):
+    # 核心模块把 Spotify 异常包装成通用异常，原始异常保留在 __context__ 上
+    while e is not None:
+        status = getattr(e, "http_status", None)
+        if status:
+            return status
+        e = e.__context__
+    return None
+
+def handle_album(params, body, album_ref):
+    album_id = parse_album_ref(album_ref)
+    if not album_id:
+        raise HttpError(400, "invalid album id")
+    try:
+        album, meta = get_album_data.get_with_meta(album_id)
+    except Exception as e:
+        if upstream_status(e) in (400, 404):
+            raise HttpError(404, "album not found")
+        raise
+    if not album:
+        raise HttpError(404, "album not found")
+    return album_payload(album, meta, query_flag(params, "tracks"))
+
+def handle_search(params, body):
+    query = params.get("q", [""])[0]
+    if not query.strip():
+        raise HttpError(400, "missing q")
+    try:
+        limit = min(max(int(params.get("limit", ["10"])[0]), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        raise HttpError(400, "invalid limit")
+    (albums, artists), meta = search_albums.get_with_meta(query, limit=limit)
+    return {
+        "albums": [
+            {"id": album.get('id'), "name": album.get('name', ''), "artists": artist_refs(album.get('artists')),
+             "release_date": album.get('release_date', '')}
+            for album in albums
+        ],
+        "artists": [
+            {"id": artist.get('id'), "name": artist.get('name', ''), "genres": artist.get('genres', []),
+             "followers": artist.get('followers', {}).get('total', 0)}
+            for artist in artists
+        ],
+        "cache": cache_info(meta),
+    }
+
+def handle_artist_albums(params, body, artist_id):
+    if not ARTIST_ID_PATTERN.match(artist_id):
+        raise HttpError(400, "invalid artist id")
+    if query_flag(params, "markets"):
+        # 整个唱片目录的地区矩阵，每张专辑附带可用地区
+        matrix, meta = get_artist_market_matrix.get_with_meta(artist_id)
+        albums = [
+            {"id": row['id'], "name": row['name'], "release_date": row['release_date'],
+             "market_count": market_count(row['market_bits']), "markets": sorted(decode_markets(row['market_bits']))}
+            for row in matrix['albums']
+        ]
+    else:
+        items, meta = get_artist_albums.get_with_meta(artist_id)
+        albums = [
+            {"id": album.get('id'), "name": album.get('name', ''), "release_date": album.get('release_date', '')}
+            for album in items
+        ]
+    return {"artist_id": artist_id, "albums": albums, "cache": cache_info(meta)}
+
+def region_result(ref, row):
+    # 单项状态：200 找到，404 上游无此专辑，502 该批次上游请求失败
+    status = 200 if not row["error"] else 404 if row["error"] == "not_found" else 502
+    return {"ref": ref, "status": status, **row}
+
+def handle_regions(params, body):
+    # 批量地区查询：请求体为 {"albums": [专辑链接或 ID, ...]}，走 albums 批量接口；
+    # results 与输入逐项对应，无效引用与未找到的专辑也各占一项
+    try:
+        refs = json.loads(body or b"{}").get("albums")
+    except (ValueError, AttributeError):
+        raise HttpError(400, "body must be a JSON object")
+    if not isinstance(refs, list) or not all(isinstance(ref, str) for ref in refs):
+        raise HttpError(400, "albums must be a list of strings")
+    if len(refs) > SERVICE_MAX_BATCH:
+        raise HttpError(413, f"at most {SERVICE_MAX_BATCH} albums per request")
+    album_ids = [parse_album_ref(ref) for ref in refs]
+    rows = {row["album_id"]: row for row in iter_region_rows(dict.fromkeys(filter(None, album_ids)))}
+    results = []
+    for ref, album_id in zip(refs, album_ids):
+        if album_id:
+            results.append(region_result(ref, rows[album_id]))
+        else:
+            results.append({"ref": ref, "status": 400, **album_region_row(None, None, error="invalid_ref")})
+    return {"results": results}
+
+def handle_index(params, body):
+    # 已查询专辑的倒排索引，不访问上游
+    available_in = query_codes(params, "available")
+    unavailable_in = query_codes(params, "unavailable")
+    try:
+        limit = min(max(int(params.get("limit", ["200"])[0]), 1), 1000)
+    except ValueError:
+        raise HttpError(400, "invalid limit")
+    market_index = get_market_index()
+    matches = market_index.query(available_in, unavailable_in, limit=limit)
+    return {
+        "total": market_index.count(available_in, unavailable_in),
+        "albums": [
+            {"id": match['id'], "name": match['name'], "artists": match['artists'],
+             "market_count": market_count(match['market_bits'])}
+            for match in matches
+        ],
+    }
+
+def handle_health(params, body):
+    return {"status": "ok", "indexed_albums": len(get_market_index())}
+
+ROUTES = [
+    ("GET", re.compile(r"^/v1/albums/([^/]+)$"), "album", handle_album),
+    ("GET", re.compile(r"^/v1/search$"), "search", handle_search),
+    ("GET", re.compile(r"^/v1/artists/([^/]+)/albums$"), "artist_albums", handle_artist_albums),
+    ("POST", re.compile(r"^/v1/regions$"), "regions", handle_regions),
+    ("GET", re.compile(r"^/v1/index$"), "index", handle_index),
+    ("GET", re.compile(r"^/healthz$"), "health", handle_health),
+]
+
+def json_response(status, payload):
+    return status, "application/json; charset=utf-8", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def match_route(method, path):
+    # 返回 (路由名, 处理函数, 路径参数)；路径参数已做百分号解码，专辑链接可整体编码后放入路径
+    for route_method, pattern, name, handler in ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        if method != route_method:
+            raise HttpError(405, f"use {route_method}")
+        return name, handler, [unquote(group) for group in match.groups()]
+    raise HttpError(404, "no such endpoint")
+
+def dispatch(method, target, body):
+    # 在工作线程中执行：路由、调用核心模块并序列化响应
+    start_time = time.perf_counter()
+    url = urlsplit(target)
+    route = "unknown"
+    try:
+        if url.path == "/metrics" and method == "GET":
+            route = "metrics"
+            response = 200, "text/plain; version=0.0.4; charset=utf-8", metrics.render_prometheus().encode("utf-8")
+        else:
+            route, handler, path_args = match_route(method, url.path)
+            response = json_response(200, handler(parse_qs(url.query), body, *path_args))
+    except HttpError as e:
+        response = json_response(e.status, {"error": str(e)})
+    except Exception as e:
+        logger.error(f"Service request {method} {url.path} failed: {str(e)} [Type: Service]", exc_info=True)
+        response = json_response(502, {"error": str(e).splitlines()[0] if str(e) else "upstream error"})
+    metrics.observe(
+        "service_request_duration_seconds", time.perf_counter() - start_time, route=route, status=str(response[0])
+    )
+    return response
+
+async def read_line(reader, status, message):
+    # 超过 StreamReader 缓冲上限（64 KiB）的行以对应状态码拒绝，而不是让异常中断连接处理
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise HttpError(status, message)
+
+async def read_chunked_body(reader):
+    body = bytearray()
+    while True:
+        line = await read_line(reader, 400, "chunk size line too long")
+        try:
+            size = int(line.split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            raise HttpError(400, "invalid chunk size")
+        if size < 0:
+            raise HttpError(400, "invalid chunk size")
+        if size == 0:
+            break
+        if len(body) + size > SERVICE_MAX_BODY:
+            raise HttpError(413, "request body too large")
+        body += await reader.readexactly(size)
+        if await reader.readexactly(2) != b"\r\n":
+            raise HttpError(400, "malformed chunk")
+    # 忽略分块尾部的 trailer 字段
+    for _ in range(SERVICE_MAX_HEADERS + 1):
+        line = await read_line(reader, 431, "trailer field too large")
+        if line in (b"\r\n", b"\n", b""):
+            return bytes(body)
+    raise HttpError(431, "too many trailer fields")
+
+async def read_request(reader):
+    # 返回 (method, target, version, headers, body)；连接已关闭时返回 None
+    line = await read_line(reader, 414, "request line too long")
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HttpError(400, "malformed request line")
+    method, target, version = parts
+    headers = {}
+    while True:
+        line = await read_line(reader, 431, "header field too large")
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= SERVICE_MAX_HEADERS:
+            raise HttpError(431, "too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    transfer_encoding = headers.get("transfer-encoding", "").strip().lower()
+    if transfer_encoding:
+        # 同时带 Content-Length 的请求边界有歧义，直接拒绝；只支持 chunked
+        if "content-length" in headers:
+            raise HttpError(400, "both transfer-encoding and content-length")
+        if transfer_encoding != "chunked":
+            raise HttpError(501, f"unsupported transfer-encoding: {transfer_encoding}")
+        return method.upper(), target, version, headers, await read_chunked_body(reader)
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HttpError(400, "invalid content-length")
+    if length < 0:
+        raise HttpError(400, "invalid content-length")
+    if length > SERVICE_MAX_BODY:
+        raise HttpError(413, "request body too large")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), target, version, headers, body
+
+def format_response(status, content_type, data, keep_alive):
+    head = (
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Unknown')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + data
+
+async def handle_connection(reader, writer, executor):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader), SERVICE_KEEPALIVE_TIMEOUT)
+            except HttpError as e:
+                writer.write(format_response(*json_response(e.status, {"error": str(e)}), keep_alive=False))
+                await writer.drain()
+                break
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+            if request is None:
+                break
+            method, target, version, headers, body = request
+            # HTTP/1.1 默认保持连接，HTTP/1.0 需显式声明
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+            status, content_type, data = await loop.run_in_executor(executor, dispatch, method, target, body)
+            writer.write(format_response(status, content_type, data, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(host, port, workers):
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service")
+    server = await asyncio.start_server(
+        functools.partial(handle_connection, executor=executor), host, port, backlog=1024
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows 或非主线程
+            pass
+    bound = ", ".join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}" for sock in server.sockets)
+    logger.info(f"Region service listening on {bound} with {workers} workers [Type: Service]")
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("Region service stopped [Type: Service]")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="region_service",
+        description="专辑地区查询 HTTP 服务 / Album region lookup HTTP service"
+    )
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="同时执行的请求数")
+    args = parser.parse_args(argv)
+    setup_logging()
+    if not has_credentials():
+        logger.error("❌ 缺少Spotify API凭证，程序终止 [Type: Config]")
+        return 2
+    start_watch_refresher()
+    start_prewarm()
+    asyncio.run(serve(args.host, args.port, max(1, args.workers)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 核心模块在导入时读取配置：缓存与监控库写到临时目录，关闭后台刷新，放开限速，使用假凭证
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+WORKDIR = tempfile.mkdtemp(prefix="spotify-tests-")
+os.environ.update({
+    "SPOTIFY_CLIENT_ID": "test-client",
+    "SPOTIFY_CLIENT_SECRET": "test-secret",
+    "CACHE_BACKEND": "sqlite",
+    "CACHE_DB_PATH": os.path.join(WORKDIR, "cache.sqlite3"),
+    "WATCH_DB_PATH": os.path.join(WORKDIR, "watch.sqlite3"),
+    "SPOTIFY_TOKEN_CACHE_PATH": os.path.join(WORKDIR, "token.json"),
+    "WATCH_REFRESH_INTERVAL": "0",
+    "API_RATE_PER_SEC": "100000",
+    "API_BURST": "100000",
+})
+
+import region_core
+from fake_spotify import FakeSpotify, FakeSpotifyServer
+
+@pytest.fixture(scope="session")
+def fake_server():
+    server = FakeSpotifyServer(FakeSpotify()).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def fake_api(fake_server, monkeypatch):
+    # 核心模块的 spotipy 客户端指向本地替身；返回替身以便检查上游调用次数
+    import spotipy
+    client = spotipy.Spotify(auth="test-token", requests_session=region_core.build_http_session())
+    client.prefix = fake_server.url + "/v1/"
+    monkeypatch.setattr(region_core, "sp", client)
+    fake_server.api.reset()
+    yield fake_server.api
+    fake_server.api.rate_limit_every = 0
@@ -0,0 +1,199 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import region_core
+from region_core import MemoryCacheBackend, SQLiteCacheBackend, SingleFlight, cached, get_cache_backend
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCacheBackend(1024 * 1024)
+    return SQLiteCacheBackend(1024 * 1024, str(tmp_path / "cache.sqlite3"))
+
+def test_backend_round_trip_returns_copies(backend):
+    backend.set("ns", "k", {"markets": ["US"]}, 60)
+    hit, value = backend.get("ns", "k")
+    assert hit and value == {"markets": ["US"]}
+    value["markets"].append("JP")
+    assert backend.get("ns", "k")[1] == {"markets": ["US"]}
+    assert backend.get("other", "k") == (False, None)
+
+def test_backend_expired_entry_is_served_as_stale(backend):
+    backend.set("ns", "k", "old", -10)
+    assert backend.get("ns", "k") == (False, None)
+    hit, value, expires_at = backend.get_with_meta("ns", "k")
+    assert hit and value == "old" and expires_at < time.time()
+    assert backend.stats()["namespaces"]["ns"]["stale"] == 2
+
+def test_backend_drops_entries_past_stale_window(backend, monkeypatch):
+    monkeypatch.setattr(region_core, "CACHE_STALE_TTL", 5)
+    backend.set("ns", "k", "old", -10)
+    assert backend.get_with_meta("ns", "k") == (False, None, None)
+    assert backend.usage()[0] == 0
+
+def test_backend_delete_and_clear(backend):
+    backend.set("a", "1", 1, 60)
+    backend.set("a", "2", 2, 60)
+    backend.set("b", "1", 3, 60)
+    backend.delete("a", "1")
+    assert not backend.get("a", "1")[0] and backend.get("a", "2")[0]
+    backend.clear("a")
+    assert backend.usage()[0] == 1 and backend.get("b", "1") == (True, 3)
+    backend.clear()
+    assert backend.usage() == (0, 0)
+
+def test_backend_evicts_least_recently_used(tmp_path):
+    for backend in (MemoryCacheBackend(2500), SQLiteCacheBackend(2500, str(tmp_path / "lru.sqlite3"))):
+        for i in range(5):
+            backend.set("ns", str(i), b"x" * 1000, 60)
+        entries, size = backend.usage()
+        assert size <= 2500 and entries == 2
+        assert backend.get("ns", "4")[0] and not backend.get("ns", "0")[0]
+
+def test_cached_hits_after_first_call():
+    calls = []
+
+    @cached("test:hit", ttl=60)
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    assert double(2) == 4 and double(2) == 4 and double(3) == 6
+    assert calls == [2, 3]
+    hit, value, meta = double.lookup(2)
+    assert hit and value == 4 and not meta["stale"]
+    double.invalidate(2)
+    assert double.lookup(2)[0] is False
+
+def test_cached_does_not_store_errors():
+    calls = []
+
+    @cached("test:error", ttl=60)
+    def flaky(x):
+        calls.append(x)
+        if len(calls) == 1:
+            raise RuntimeError("upstream down")
+        return x
+
+    with pytest.raises(RuntimeError):
+        flaky(1)
+    assert flaky(1) == 1 and calls == [1, 1]
+
+def test_stale_entry_is_returned_and_refreshed_in_background():
+    calls = []
+
+    @cached("test:swr", ttl=60)
+    def lookup_value(x):
+        calls.append(x)
+        return f"new-{x}"
+
+    get_cache_backend().set("test:swr", lookup_value.cache_key("a"), "old-a", -10)
+    value, meta = lookup_value.get_with_meta("a")
+    assert value == "old-a" and meta["stale"]
+    assert wait_until(lambda: lookup_value.lookup("a")[1] == "new-a")
+    assert lookup_value.get_with_meta("a") == ("new-a", {"stale": False, "age": pytest.approx(0, abs=1)})
+    assert calls == ["a"]
+
+def test_failed_refresh_keeps_stale_entry_and_backs_off(monkeypatch):
+    monkeypatch.setattr(region_core, "CACHE_REFRESH_BACKOFF", 0.3)
+    calls = []
+
+    @cached("test:swr-error", ttl=60)
+    def broken(x):
+        calls.append(x)
+        raise RuntimeError("upstream down")
+
+    get_cache_backend().set("test:swr-error", broken.cache_key("a"), "old-a", -10)
+    assert broken("a") == "old-a"
+    assert wait_until(lambda: calls and region_core.single_flight.in_flight() == 0)
+    # 退避期内读取旧数据不再触发刷新
+    for _ in range(5):
+        assert broken("a") == "old-a"
+    time.sleep(0.05)
+    assert calls == ["a"] and region_core.single_flight.in_flight() == 0
+    # 退避结束后再次刷新
+    time.sleep(0.3)
+    assert broken("a") == "old-a"
+    assert wait_until(lambda: len(calls) == 2)
+
+def run_concurrently(flights, key, func, callers=8):
+    # 领头调用方开始执行后再放入其余调用方，确保它们都在等待同一次执行
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader_func():
+        started.set()
+        release.wait(5)
+        return func()
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        futures = [pool.submit(flights.do, key, leader_func)]
+        assert started.wait(5)
+        futures += [pool.submit(flights.do, key, leader_func) for _ in range(callers - 1)]
+        time.sleep(0.1)
+        release.set()
+        return futures
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+    futures = run_concurrently(flights, "k", lambda: calls.append(1) or "value")
+    results = [f.result() for f in futures]
+    assert calls == [1]
+    assert [value for value, _ in results] == ["value"] * len(futures)
+    assert sum(leader for _, leader in results) == 1
+    assert flights.in_flight() == 0
+
+def test_single_flight_propagates_errors_to_waiters():
+    flights = SingleFlight()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError("boom")
+
+    futures = run_concurrently(flights, "k", fail)
+    for future in futures:
+        with pytest.raises(ValueError, match="boom"):
+            future.result()
+    assert calls == [1] and flights.in_flight() == 0
+    # 失败不被记住，下一次调用重新执行
+    assert flights.do("k", lambda: "ok") == ("ok", True)
+
+class Interrupted(BaseException):
+    pass
+
+def test_single_flight_interrupted_leader_releases_waiters():
+    # 中断只在领头调用方传播，等待方重新发起并拿到结果，而不是收到中断
+    flights = SingleFlight()
+    calls = []
+
+    def interrupted_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise Interrupted()
+        return "value"
+
+    futures = run_concurrently(flights, "k", interrupted_once)
+    with pytest.raises(Interrupted):
+        futures[0].result()
+    assert [f.result()[0] for f in futures[1:]] == ["value"] * (len(futures) - 1)
+    assert len(calls) >= 2 and flights.in_flight() == 0
+
+def test_single_flight_abandon_is_a_no_op_after_finish():
+    flights = SingleFlight()
+    flight, leader = flights.join("k")
+    flights.finish(flight, value="value")
+    flights.abandon(flight)
+    assert leader and flight.result() == "value"
@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_has_no_side_effects(tmp_path):
+    # 仅导入核心模块与服务模块：不创建日志、缓存或令牌文件，不启动后台线程
+    code = (
+        "import threading, region_core, region_service;"
+        "assert threading.active_count() == 1, threading.enumerate();"
+        "assert not region_core.logger.handlers"
+    )
+    env = {key: value for key, value in os.environ.items() if key not in ("CACHE_DB_PATH", "WATCH_DB_PATH")}
+    env["PYTHONPATH"] = ROOT
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True)
+    assert os.listdir(tmp_path) == []
+
+def test_cli_help_has_no_side_effects(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key not in ("CACHE_DB_PATH", "WATCH_DB_PATH")}
+    env["PYTHONPATH"] = ROOT
+    for argv in (["batch", "--help"], ["watch", "refresh", "-h"]):
+        result = subprocess.run(
+            [sys.executable, os.path.join(ROOT, "region_core.py"), *argv],
+            cwd=tmp_path, env=env, capture_output=True, text=True
+        )
+        assert result.returncode == 0 and "usage:" in result.stdout
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,48 @@
+from region_core import (
+    MARKET_CODES, MARKET_BITMAP_BYTES, ALL_MARKETS, encode_markets, decode_markets, has_market, market_count,
+    markets_union, markets_intersection, markets_diff, market_counts, markets_to_bytes, markets_from_bytes,
+    extract_album_id, parse_album_ref, iter_album_ids,
+)
+
+def test_encode_decode_round_trip():
+    codes = ["US", "JP", "GB", "ZW", "AD"]
+    bits = encode_markets(codes)
+    assert sorted(decode_markets(bits)) == sorted(codes)
+    assert market_count(bits) == len(codes)
+    assert has_market(bits, "JP") and not has_market(bits, "FR")
+
+def test_all_markets_round_trip():
+    assert decode_markets(encode_markets(MARKET_CODES)) == list(MARKET_CODES)
+    assert encode_markets(MARKET_CODES) == ALL_MARKETS
+
+def test_unknown_codes_are_ignored():
+    # 未知代码不占位，也不影响已知代码
+    bits = encode_markets(["US", "QQ", "", "us", "XX"])
+    assert decode_markets(bits) == ["US"]
+    assert not has_market(bits, "QQ")
+    assert encode_markets([]) == 0 and decode_markets(0) == []
+
+def test_set_operations():
+    a = encode_markets(["US", "GB", "JP"])
+    b = encode_markets(["GB", "DE"])
+    assert sorted(decode_markets(markets_union([a, b]))) == ["DE", "GB", "JP", "US"]
+    assert decode_markets(markets_intersection([a, b])) == ["GB"]
+    assert sorted(decode_markets(markets_diff(a, b))) == ["JP", "US"]
+    counts = market_counts([a, b])
+    assert counts["GB"] == 2 and counts["US"] == 1 and counts["FR"] == 0
+
+def test_bytes_round_trip():
+    bits = encode_markets(["AD", "ZW", "BR"])
+    data = markets_to_bytes(bits)
+    assert len(data) == MARKET_BITMAP_BYTES
+    assert markets_from_bytes(data) == bits
+    assert markets_from_bytes(markets_to_bytes(ALL_MARKETS)) == ALL_MARKETS
+
+def test_album_refs():
+    album_id = "4aawyAB9vmqN3uQ7FjRGTy"
+    assert extract_album_id(f"https://open.spotify.com/album/{album_id}?si=abc") == album_id
+    assert extract_album_id(f"spotify:album:{album_id}") == album_id
+    assert extract_album_id("not a link") is None
+    assert parse_album_ref(album_id) == album_id
+    assert parse_album_ref("# comment") is None
+    assert list(iter_album_ids([album_id, "", f"spotify:album:{album_id}"])) == [album_id, album_id]
@@ -0,0 +1,59 @@
+import pickle
+
+import pytest
+
+import region_core
+from region_core import AlbumRecord, TrackRecord, load_album_record, get_album_data, encode_markets, decode_markets
+from fake_spotify import LARGE_ALBUM_PREFIX
+
+def record_fields(album):
+    return (
+        [getattr(album, name) for name in AlbumRecord.__slots__ if name != "tracks"],
+        [[getattr(track, name) for name in TrackRecord.__slots__] for track in album.tracks],
+    )
+
+def test_album_record_pickle_round_trip():
+    album = AlbumRecord("a1", "Album", (("ar1", "Artist"),), market_bits=encode_markets(["US", "JP"]))
+    album.add_tracks([
+        TrackRecord("t1", "One", 1000, 50, ("Artist",), encode_markets(["US"])),
+        TrackRecord("t2", "Two", 2000, 300, ("Guest",), None),
+    ])
+    copy = pickle.loads(pickle.dumps(album, protocol=pickle.HIGHEST_PROTOCOL))
+    assert record_fields(copy)[0] == record_fields(album)[0]
+    assert [track.market_bits for track in copy.tracks] == [encode_markets(["US"]), None]
+    assert [track.popularity for track in copy.tracks] == [50, 255]
+    assert copy.tracks[0].artists == ("Artist",)
+    assert copy.tracks[1].artists == ("Guest",)
+
+def test_unsupported_record_version_is_rejected():
+    state = list(AlbumRecord("a1", "Album").to_state())
+    state[0] = region_core.ALBUM_RECORD_VERSION + 1
+    with pytest.raises(ValueError, match="Unsupported album record version"):
+        load_album_record(tuple(state))
+
+def test_get_album_data_builds_slim_record(fake_api):
+    album = get_album_data("TestAlbum0000000000001")
+    assert isinstance(album, AlbumRecord)
+    assert album.id == "TestAlbum0000000000001"
+    assert len(album.tracks) == fake_api.album_tracks
+    assert decode_markets(album.market_bits) and all(track.market_bits is not None for track in album.tracks)
+    calls = fake_api.stats()["requests"]
+    assert record_fields(get_album_data("TestAlbum0000000000001")) == record_fields(album)
+    assert fake_api.stats()["requests"] == calls
+
+def test_large_album_is_fully_paginated(fake_api):
+    album = get_album_data(f"{LARGE_ALBUM_PREFIX}Album000000000001")
+    assert len(album.tracks) == fake_api.large_album_tracks
+    assert len({track.id for track in album.tracks}) == fake_api.large_album_tracks
+
+def test_cached_record_with_old_version_is_refetched(fake_api, monkeypatch):
+    album_id = "TestAlbum0000000000002"
+    album = get_album_data(album_id)
+    # 以旧版本格式写入缓存，读取时应丢弃并重新抓取
+    with monkeypatch.context() as patch:
+        patch.setattr(region_core, "ALBUM_RECORD_VERSION", 0)
+        get_album_data.store(album, album_id)
+    fake_api.reset()
+    assert get_album_data.lookup(album_id)[0] is False
+    assert record_fields(get_album_data(album_id)) == record_fields(album)
+    assert fake_api.stats()["calls"].get("album") == 1
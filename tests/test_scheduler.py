@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import region_core
+from region_core import LocalRateState, SQLiteRateState, RequestScheduler
+
+@pytest.fixture(params=["local", "sqlite"])
+def rate_state(request, tmp_path):
+    if request.param == "local":
+        return LocalRateState(10, 3)
+    return SQLiteRateState(10, 3, str(tmp_path / "rate.sqlite3"))
+
+def test_token_bucket_allows_burst_then_waits(rate_state):
+    assert [rate_state.try_acquire() for _ in range(3)] == [0, 0, 0]
+    wait_for = rate_state.try_acquire()
+    assert 0 < wait_for <= 0.1 + 1e-6
+    time.sleep(wait_for + 0.01)
+    assert rate_state.try_acquire() == 0
+
+def test_cooldown_blocks_until_it_expires(rate_state):
+    rate_state.set_cooldown(time.time() + 5)
+    assert 4 < rate_state.try_acquire() <= 5
+    # 冷却只会延长，不会被更早的时间覆盖
+    rate_state.set_cooldown(time.time() + 1)
+    assert rate_state.try_acquire() > 4
+
+def test_scheduler_retries_rate_limited_calls(monkeypatch):
+    monkeypatch.setattr(region_core, "API_BACKOFF_BASE", 0.001)
+    state = LocalRateState(1000, 1000)
+    scheduler = RequestScheduler(state, max_retries=2)
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise SpotifyException(429, -1, "rate limited", headers={"Retry-After": "0"})
+        return "ok"
+
+    assert scheduler.call("albums", call) == "ok"
+    assert len(attempts) == 3
+
+def test_scheduler_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(region_core, "API_BACKOFF_BASE", 0.001)
+    scheduler = RequestScheduler(LocalRateState(1000, 1000), max_retries=1)
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise SpotifyException(429, -1, "rate limited", headers={"Retry-After": "0"})
+
+    with pytest.raises(SpotifyException):
+        scheduler.call("albums", call)
+    assert len(attempts) == 2
+
+def test_scheduler_does_not_retry_other_errors():
+    scheduler = RequestScheduler(LocalRateState(1000, 1000))
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise SpotifyException(404, -1, "not found")
+
+    with pytest.raises(SpotifyException):
+        scheduler.call("album", call)
+    assert len(attempts) == 1
@@ -0,0 +1,41 @@
+from region_core import SearchPrefixCache, normalize_query, search_albums
+
+def album(name, artist="Someone"):
+    return {"name": name, "artists": [{"name": artist}]}
+
+def test_normalize_query():
+    assert normalize_query("  Taylor   SWIFT ") == "taylor swift"
+    assert normalize_query("Ünïcode\tÄlbum") == "ünïcode älbum"
+    assert normalize_query(None) == ""
+
+def test_prefix_cache_filters_complete_results():
+    cache = SearchPrefixCache(8)
+    albums = [album("Blue Train", "John Coltrane"), album("Blue Lines"), album("Kind of Blue", "Miles Davis")]
+    cache.put("blu", 10, albums, [{"name": "Blue Oyster Cult"}], True)
+    assert cache.lookup("blue tr", 10) == ([albums[0]], [])
+    assert cache.lookup("blue miles", 10) == ([albums[2]], [])
+    assert cache.lookup("blue", 10) == (albums, [{"name": "Blue Oyster Cult"}])
+    # 本地过滤为空时交回上游
+    assert cache.lookup("blux", 10) is None
+
+def test_prefix_cache_skips_incomplete_or_smaller_results():
+    cache = SearchPrefixCache(8)
+    cache.put("blu", 10, [album("Blue Train")], [], False)
+    assert cache.lookup("blue", 10) is None
+    cache.put("blu", 5, [album("Blue Train")], [], True)
+    assert cache.lookup("blue", 10) is None
+    assert cache.lookup("blue", 5) == ([album("Blue Train")], [])
+
+def test_prefix_cache_is_bounded():
+    cache = SearchPrefixCache(2)
+    for query in ("a", "b", "c"):
+        cache.put(query, 10, [album(query * 3)], [], True)
+    assert cache.lookup("aa", 10) is None
+    assert cache.lookup("cc", 10) == ([album("ccc")], [])
+
+def test_search_queries_are_normalized_before_caching(fake_api):
+    albums, artists = search_albums("  Prefix  Query ")
+    assert albums and artists
+    assert search_albums("prefix query") == (albums, artists)
+    assert search_albums("PREFIX QUERY") == (albums, artists)
+    assert fake_api.stats()["calls"] == {"search": 1}
@@ -0,0 +1,155 @@
+import asyncio
+import json
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import region_core
+import region_service
+from region_service import HttpError, dispatch, read_request
+from fake_spotify import ApiError
+
+def parse(raw):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_request(reader)
+    return asyncio.run(run())
+
+def call(method, target, body=b""):
+    status, content_type, data = dispatch(method, target, body)
+    return status, json.loads(data) if content_type.startswith("application/json") else data
+
+def test_read_request_with_body():
+    request = parse(b'POST /v1/regions HTTP/1.1\r\nHost: x\r\nContent-Length: 2\r\n\r\n{}GET / HTTP/1.1\r\n')
+    assert request == ("POST", "/v1/regions", "HTTP/1.1", {"host": "x", "content-length": "2"}, b"{}")
+
+def test_read_request_closed_connection():
+    assert parse(b"") is None
+
+def test_read_request_decodes_chunked_body():
+    raw = (
+        b"POST /v1/regions HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"4\r\n{\"al\r\n9;ext=1\r\nbums\": []\r\n1\r\n}\r\n0\r\nX-Trailer: 1\r\n\r\n"
+    )
+    assert parse(raw)[4] == b'{"albums": []}'
+
+LONG = b"x" * (70 * 1024)
+
+@pytest.mark.parametrize("raw, status", [
+    (b"GARBAGE\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (region_service.SERVICE_MAX_BODY + 1), 413),
+    (b"GET /" + LONG + b" HTTP/1.1\r\n\r\n", 414),
+    (b"GET / HTTP/1.1\r\nX-Long: " + LONG + b"\r\n\r\n", 431),
+    (b"GET / HTTP/1.1\r\n" + b"".join(b"X-H%d: 1\r\n" % i for i in range(region_service.SERVICE_MAX_HEADERS + 1)) + b"\r\n", 431),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip, chunked\r\n\r\n", 501),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\nContent-Length: 3\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nabc\r\n0\r\n\r\n", 400),
+    (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n%x\r\n" % (region_service.SERVICE_MAX_BODY + 1), 413),
+])
+def test_read_request_rejects_malformed_requests(raw, status):
+    with pytest.raises(HttpError) as error:
+        parse(raw)
+    assert error.value.status == status
+
+def test_album_endpoint(fake_api):
+    status, payload = call("GET", "/v1/albums/ServiceAlbum0000000001?tracks=1")
+    assert status == 200
+    assert payload["id"] == "ServiceAlbum0000000001"
+    assert payload["market_count"] == len(payload["markets"])
+    assert len(payload["tracks"]) == payload["total_tracks"] == fake_api.album_tracks
+    assert payload["cache"]["stale"] is False
+
+def test_album_endpoint_accepts_encoded_links(fake_api):
+    status, payload = call("GET", "/v1/albums/https%3A%2F%2Fopen.spotify.com%2Falbum%2FServiceAlbum0000000001")
+    assert status == 200 and payload["id"] == "ServiceAlbum0000000001"
+
+def test_search_endpoint(fake_api):
+    status, payload = call("GET", "/v1/search?q=service+query&limit=3")
+    assert status == 200
+    assert len(payload["albums"]) == 3 and len(payload["artists"]) == 3
+    assert call("GET", "/v1/search")[0] == 400
+
+def test_routing_errors():
+    assert call("GET", "/v1/nope")[0] == 404
+    assert call("GET", "/v1/regions")[0] == 405
+    assert call("GET", "/v1/albums/not-an-id")[0] == 400
+    assert call("GET", "/v1/index?available=QQ")[0] == 400
+    assert call("GET", "/healthz")[0] == 200
+
+@pytest.mark.parametrize("body", [b"[]", b"not json", b'{"albums": "x"}', b'{"albums": [1]}'])
+def test_regions_rejects_bad_bodies(body):
+    assert call("POST", "/v1/regions", body)[0] == 400
+
+def exchange(raw):
+    # 经真实连接发送原始请求，返回服务端在关闭连接前写回的全部字节
+    async def run():
+        server = await asyncio.start_server(
+            lambda reader, writer: region_service.handle_connection(reader, writer, None), "127.0.0.1", 0
+        )
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+    return asyncio.run(run())
+
+def test_oversized_header_gets_a_response():
+    response = exchange(b"GET /healthz HTTP/1.1\r\nX-Long: " + LONG + b"\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 431 Request Header Fields Too Large\r\n")
+    assert b"Connection: close" in response
+
+def test_unsupported_transfer_encoding_gets_a_response():
+    response = exchange(b"POST /v1/regions HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 501 Not Implemented\r\n")
+
+def fake_albums_batch(album_ids, priority=None):
+    # Bad* 使整批被上游以 400 拒绝，Missing* 在批量结果中为 null
+    if any(album_id.startswith("Bad") for album_id in album_ids):
+        raise SpotifyException(400, -1, "invalid id")
+    return [
+        None if album_id.startswith("Missing") else {"id": album_id, "name": album_id, "available_markets": ["US"]}
+        for album_id in album_ids
+    ]
+
+def test_regions_results_are_aligned_with_input(monkeypatch):
+    monkeypatch.setattr(region_core, "fetch_albums_batch", fake_albums_batch)
+    refs = [
+        "RegionAlbum00000000001", "not a ref", "https://open.spotify.com/album/RegionAlbum00000000002",
+        "BadAlbum00000000000001", "RegionAlbum00000000001", "MissingAlbum0000000001", "",
+    ]
+    status, payload = call("POST", "/v1/regions", json.dumps({"albums": refs}).encode())
+    assert status == 200
+    results = payload["results"]
+    assert [r["ref"] for r in results] == refs
+    assert [r["status"] for r in results] == [200, 400, 200, 404, 200, 404, 400]
+    assert [r["error"] for r in results] == ["", "invalid_ref", "", "not_found", "", "not_found", "invalid_ref"]
+    assert [r["album_id"] for r in results] == [
+        "RegionAlbum00000000001", None, "RegionAlbum00000000002", "BadAlbum00000000000001",
+        "RegionAlbum00000000001", "MissingAlbum0000000001", None,
+    ]
+    assert results[0]["markets"] == ["US"] and results[3]["markets"] == []
+
+def test_regions_report_failed_batches_per_ref(monkeypatch):
+    def unavailable(album_ids, priority=None):
+        raise SpotifyException(503, -1, "service unavailable")
+
+    monkeypatch.setattr(region_core, "fetch_albums_batch", unavailable)
+    status, payload = call("POST", "/v1/regions", b'{"albums": ["RegionAlbum00000000001"]}')
+    assert status == 200
+    assert payload["results"][0]["status"] == 502 and payload["results"][0]["error"]
+
+def test_album_not_found_upstream_is_404(fake_api, monkeypatch):
+    def missing(params, id):
+        raise ApiError(404, "non existing id")
+
+    monkeypatch.setattr(fake_api, "_album", missing)
+    status, payload = call("GET", "/v1/albums/MissingAlbum0000000002")
+    assert status == 404 and payload == {"error": "album not found"}
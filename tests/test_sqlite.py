@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+
+from region_core import sqlite_transaction
+
+class Interrupted(BaseException):
+    pass
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "tx.sqlite3"), isolation_level=None)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    return conn
+
+def count(conn):
+    return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+def test_transaction_commits(conn):
+    with sqlite_transaction(conn):
+        conn.execute("INSERT INTO t VALUES (1)")
+    assert count(conn) == 1 and not conn.in_transaction
+
+@pytest.mark.parametrize("error", [ValueError, Interrupted])
+def test_transaction_rolls_back_on_errors_and_interrupts(conn, error):
+    with pytest.raises(error):
+        with sqlite_transaction(conn):
+            conn.execute("INSERT INTO t VALUES (1)")
+            raise error()
+    assert count(conn) == 0 and not conn.in_transaction
+    # 连接可以继续开启新事务
+    with sqlite_transaction(conn):
+        conn.execute("INSERT INTO t VALUES (2)")
+    assert count(conn) == 1
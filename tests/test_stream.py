@@ -0,0 +1,46 @@
+import time
+
+from region_core import stream_album_data
+from fake_spotify import ROUTES, LARGE_ALBUM_PREFIX
+
+LATENCY = 0.2
+
+def record_spans(fake_api, monkeypatch):
+    # 按端点记录每个上游请求在替身内的起止时间，并为每个请求注入固定延迟
+    spans = []
+    handle = fake_api.handle
+
+    def timed_handle(path, query):
+        start = time.perf_counter()
+        try:
+            return handle(path, query)
+        finally:
+            endpoint = next((name for name, pattern in ROUTES if pattern.match(path)), path)
+            spans.append((endpoint, start, time.perf_counter()))
+
+    monkeypatch.setattr(fake_api, "latency", LATENCY)
+    monkeypatch.setattr(fake_api, "handle", timed_handle)
+    return spans
+
+def overlaps(spans, first, second):
+    return any(
+        start_a < end_b and start_b < end_a
+        for name_a, start_a, end_a in spans if name_a == first
+        for name_b, start_b, end_b in spans if name_b == second
+    )
+
+def test_artist_and_track_details_are_fetched_concurrently(fake_api, monkeypatch):
+    spans = record_spans(fake_api, monkeypatch)
+    start = time.perf_counter()
+    stages = [stage for stage, _, _ in stream_album_data("StreamAlbum00000000001")]
+    elapsed = time.perf_counter() - start
+    assert stages == ["album", "artist", "tracks", "markets", "done"]
+    assert overlaps(spans, "artist", "tracks")
+    # 专辑本体一轮，艺人与曲目详情并发一轮
+    assert elapsed < 2.75 * LATENCY
+
+def test_track_pages_are_submitted_before_waiting_for_artist(fake_api, monkeypatch):
+    spans = record_spans(fake_api, monkeypatch)
+    stages = [stage for stage, _, _ in stream_album_data(f"{LARGE_ALBUM_PREFIX}Stream0000000001")]
+    assert stages[:2] == ["album", "artist"] and stages[-2:] == ["markets", "done"]
+    assert overlaps(spans, "artist", "album_tracks")
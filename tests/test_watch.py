@@ -0,0 +1,46 @@
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import region_core
+from region_core import ALBUMS_BATCH_SIZE, WatchList, encode_markets, refresh_watched_albums
+
+@pytest.fixture
+def watch_list(tmp_path, monkeypatch):
+    watch_list = WatchList(str(tmp_path / "watch.sqlite3"))
+    monkeypatch.setattr(region_core, "get_watch_list", lambda: watch_list)
+    for i in range(3 * ALBUMS_BATCH_SIZE):
+        watch_list.add(f"WatchAlbum{i:012d}", f"Album {i}", encode_markets(["US"]))
+    return watch_list
+
+def fake_batches(monkeypatch, fail):
+    # fail(n) 返回第 n 次批量调用要抛出的异常，None 表示成功
+    batches = []
+
+    def fetch(album_ids, priority=region_core.PRIORITY_BATCH):
+        batches.append(list(album_ids))
+        error = fail(len(batches))
+        if error:
+            raise error
+        return [{"id": album_id, "name": "", "available_markets": ["US"]} for album_id in album_ids]
+
+    monkeypatch.setattr(region_core, "fetch_albums_batch", fetch)
+    return batches
+
+def test_refresh_continues_after_failed_batch(watch_list, monkeypatch):
+    batches = fake_batches(monkeypatch, lambda n: RuntimeError("boom") if n == 1 else None)
+    result = refresh_watched_albums(api_budget=10, min_interval=0)
+    assert len(batches) == 3
+    assert result == {"checked": 2 * ALBUMS_BATCH_SIZE, "changed": 0, "failed_batches": 1, "api_calls": 3}
+    # 失败批次的专辑仍未检查，下一轮优先刷新
+    assert set(watch_list.due_albums(ALBUMS_BATCH_SIZE, 0)) == set(batches[0])
+
+def test_refresh_stops_on_rate_limit(watch_list, monkeypatch):
+    batches = fake_batches(monkeypatch, lambda n: SpotifyException(429, -1, "rate limited") if n == 2 else None)
+    result = refresh_watched_albums(api_budget=10, min_interval=0)
+    assert len(batches) == 2
+    assert result["failed_batches"] == 1 and result["checked"] == ALBUMS_BATCH_SIZE
+
+def test_refresh_respects_api_budget(watch_list, monkeypatch):
+    batches = fake_batches(monkeypatch, lambda n: None)
+    assert refresh_watched_albums(api_budget=2, min_interval=0)["api_calls"] == 2
+    assert len(batches) == 2